@@ -0,0 +1,152 @@
+"""
+Global queue of items waiting for a player to classify them.
+
+Requests are deduplicated by (game, item), and only one player is asked about an item at a time.  The prompt's buttons
+are handled by a persistent component callback rather than a waiter, so nothing is held in memory while waiting for an
+answer.  When the asked player skips or doesn't answer in time, the next player who has the item is asked instead.
+"""
+import collections
+import hashlib
+import logging
+import time
+from typing import Awaitable, Callable
+
+import attrs
+
+from ap_alert.metrics import CLASSIFY_PENDING, record_error
+
+Prompt = tuple[int, int]  # channel_id, message_id
+
+classify_logger = logging.getLogger("ap_alert.classification")
+
+
+def classification_key(game: str, item: str) -> str:
+    return hashlib.sha1(f"{game}\0{item}".encode()).hexdigest()[:16]
+
+
+@attrs.define()
+class PendingClassification:
+    game: str
+    item: str
+    candidates: list[int] = attrs.field(factory=list)
+    declined: set[int] = attrs.field(factory=set)
+    asked: int | None = None
+    prompt: Prompt | None = None
+    asked_at: float = 0.0
+
+    @property
+    def key(self) -> str:
+        return classification_key(self.game, self.item)
+
+
+class ClassificationQueue:
+    def __init__(
+        self,
+        ask: Callable[[int, str, str, str], Awaitable[Prompt]],
+        retract: Callable[[Prompt], Awaitable[None]],
+        timeout: float = 3600,
+        max_prompts_per_user: int = 5,
+    ) -> None:
+        self.ask = ask
+        self.retract = retract
+        self.timeout = timeout
+        self.max_prompts_per_user = max_prompts_per_user
+        self.pending: dict[str, PendingClassification] = {}
+        self.prompts_by_user: collections.Counter[int] = collections.Counter()
+
+    def _update_gauge(self) -> None:
+        CLASSIFY_PENDING.set(len(self.pending))
+
+    async def request(self, user_id: int, game: str, item: str) -> None:
+        key = classification_key(game, item)
+        entry = self.pending.get(key)
+        if entry is None:
+            entry = self.pending[key] = PendingClassification(game, item)
+            self._update_gauge()
+        if user_id != entry.asked and user_id not in entry.declined and user_id not in entry.candidates:
+            entry.candidates.append(user_id)
+        await self._advance(entry)
+
+    async def _advance(self, entry: PendingClassification) -> None:
+        """Ask the next available candidate, if nobody is being asked about this item yet."""
+        if entry.asked is not None:
+            return
+        # Candidates can be added while a prompt is being sent, so look again after each attempt.
+        while (user_id := next((u for u in entry.candidates if self.prompts_by_user[u] < self.max_prompts_per_user), None)) is not None:
+            entry.candidates.remove(user_id)
+            # Reserved before awaiting, so a request that arrives while the prompt is being sent doesn't ask someone else.
+            entry.asked = user_id
+            entry.asked_at = time.monotonic()
+            self.prompts_by_user[user_id] += 1
+            try:
+                prompt = await self.ask(user_id, entry.game, entry.item, entry.key)
+            except Exception as e:
+                record_error("classify_ask", e)
+                classify_logger.warning(f"Could not ask {user_id} about {entry.item}: {e}")
+                entry.declined.add(user_id)
+                if entry.asked != user_id:
+                    return  # answered or moved on in the meantime
+                await self._release(entry)
+                continue
+            if entry.asked != user_id or self.pending.get(entry.key) is not entry:
+                # Answered or moved on while the prompt was being sent.
+                await self._retract(prompt)
+                return
+            entry.prompt = prompt
+            return
+        if not entry.candidates:
+            # Nobody left to ask.  It will be requested again the next time someone receives the item.
+            self.pending.pop(entry.key, None)
+            self._update_gauge()
+
+    async def _release(self, entry: PendingClassification) -> None:
+        if entry.asked is not None:
+            self.prompts_by_user[entry.asked] -= 1
+            if self.prompts_by_user[entry.asked] <= 0:
+                del self.prompts_by_user[entry.asked]
+        prompt = entry.prompt
+        entry.asked = None
+        entry.prompt = None
+        if prompt is not None:
+            await self._retract(prompt)
+
+    async def _retract(self, prompt: Prompt) -> None:
+        try:
+            await self.retract(prompt)
+        except Exception as e:
+            record_error("classify_retract", e)
+
+    async def _advance_waiting(self) -> None:
+        for entry in list(self.pending.values()):
+            if entry.asked is None:
+                await self._advance(entry)
+
+    async def resolve(self, key: str) -> PendingClassification | None:
+        """Someone answered; withdraw every prompt for the item."""
+        entry = self.pending.pop(key, None)
+        self._update_gauge()
+        if entry is None:
+            return None
+        await self._release(entry)
+        await self._advance_waiting()
+        return entry
+
+    async def decline(self, key: str, user_id: int) -> None:
+        entry = self.pending.get(key)
+        if entry is None:
+            return
+        entry.declined.add(user_id)
+        if user_id in entry.candidates:
+            entry.candidates.remove(user_id)
+        if entry.asked == user_id:
+            await self._release(entry)
+            await self._advance(entry)
+            await self._advance_waiting()
+
+    async def expire(self) -> int:
+        """Move unanswered prompts on to the next candidate."""
+        now = time.monotonic()
+        expired = [e for e in self.pending.values() if e.asked is not None and now - e.asked_at > self.timeout]
+        for entry in expired:
+            await self.decline(entry.key, entry.asked)
+        return len(expired)
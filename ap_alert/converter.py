@@ -1,8 +1,16 @@
-import datetime
-import cattrs
+from ap_alert.models.hint import Hint
+from ap_alert.models.network_item import NetworkItem
+from ap_alert.models.player import Player
+from ap_alert.models.tracked_game import TrackedGame
+from ap_alert.multiworld import Multiworld
+from shared.converter import converter, precompile
 
+# What load() and save() read and write.  Pass these as `unstructure_as` so the generated hooks are used directly
+# instead of dispatching on each value's runtime type.
+TRACKERS = dict[int, list[TrackedGame]]
+MULTIWORLDS = dict[str, Multiworld]
+PLAYERS = dict[int, Player]
 
-converter = cattrs.Converter()
+precompile(NetworkItem, Hint, TrackedGame, Multiworld, Player, TRACKERS, MULTIWORLDS, PLAYERS)
 
-converter.register_structure_hook(datetime.datetime, lambda x, *_: datetime.datetime.fromisoformat(x) if x else None)
-converter.register_unstructure_hook(datetime.datetime, lambda x, *_: x.isoformat() if x else None)
+__all__ = ["converter", "TRACKERS", "MULTIWORLDS", "PLAYERS"]
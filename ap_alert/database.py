@@ -1,97 +1,350 @@
+import logging
+import random
+import weakref
+from typing import Any, AsyncIterator
+
 import attrs
 import pymongo
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.asynchronous.database import AsyncDatabase
 from interactions.client.smart_cache import TTLCache
 
+from ap_alert.metrics import DB_READ_SECONDS, DB_WRITE_SECONDS
+from ap_alert.tracing import span
 from ap_alert.models.player import Player
 from shared import configuration
 from .models.tracked_game import TrackedGame
-from shared.automongocache import from_dict, to_dict
+from .outbox import Notification
+from ap_alert.converter import converter
+from shared.automongocache import from_dict, to_dict, unstructure_fields
 
 configuration.DEFAULTS["mongo_uri"] = "mongodb://localhost:27017/"
 configuration.DEFAULTS["mongo_collection"] = "multiworld_tracker"
+configuration.DEFAULTS["tracker_write_batch"] = 100
+
+_client: pymongo.AsyncMongoClient | None = None
+
+
+def get_db() -> AsyncDatabase:
+    """The database, with the client created the first time it's needed rather than when this module is imported."""
+    global _client
+    if _client is None:
+        _client = pymongo.AsyncMongoClient(configuration.get_str("mongo_uri"))
+    return _client[configuration.get_str("mongo_collection")]
+
+
+@attrs.frozen()
+class LazyCollection:
+    """A collection that doesn't touch the client until it's used."""
 
-client = pymongo.AsyncMongoClient(configuration.get("mongo_uri"))
-db = client[configuration.get("mongo_collection")]
+    name: str
 
-tracker_collection = db["trackers"]
-player_collection = db["players"]
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(get_db()[self.name], attr)
+
+
+tracker_collection = LazyCollection("trackers")
+player_collection = LazyCollection("players")
+notification_collection = LazyCollection("notifications")
+state_collection = LazyCollection("tracker_state")  # _id: the tracker's _id
+
+# Large per-slot state that most callers don't need.  Stored in `tracker_state` and loaded on demand by `ensure_state`.
+HEAVY_FIELDS = ("checks", "finder_hints", "receiver_hints", "notification_queue")
+LIGHT_PROJECTION = {field: 0 for field in HEAVY_FIELDS}
+
+# (collection, key) pairs for every lookup the bot makes.
+INDEXES = [
+    (tracker_collection, "user_id"),
+    (tracker_collection, "url"),
+    (tracker_collection, "cheese_id"),
+    (player_collection, "id"),
+    (notification_collection, "id"),
+]
 
 
 @attrs.define(eq=False, order=False, hash=False, kw_only=False)
 class Database:
     tracker_cache: TTLCache = attrs.field(repr=False, factory=TTLCache)  # key: (object_id)
     player_cache: TTLCache = attrs.field(repr=False, factory=TTLCache)  # key: (player_id)
+    # Every TrackedGame that is alive anywhere, so a document is only ever represented by one object.
+    live_trackers: weakref.WeakValueDictionary[str, TrackedGame] = attrs.field(repr=False, factory=weakref.WeakValueDictionary)
+    pending_writes: list[tuple[TrackedGame, set[str], str, UpdateOne]] = attrs.field(repr=False, factory=list)  # (tracker, fields, collection, op)
+    writing: list[tuple[TrackedGame, set[str], str, UpdateOne]] = attrs.field(repr=False, factory=list)  # being sent by flush_trackers
+
+    async def ensure_indexes(self) -> None:
+        for collection, key in INDEXES:
+            with DB_WRITE_SECONDS.time(collection=collection.name, op="create_index"):
+                await collection.create_index(key)
+
+    def cached_tracker(self, object_id: str) -> TrackedGame | None:
+        tracker = self.live_trackers.get(object_id)
+        if tracker is None and object_id in self.tracker_cache:
+            tracker = self.tracker_cache[object_id]
+        return tracker
 
     async def fetch_tracker(self, object_id: str) -> TrackedGame | None:
         if isinstance(object_id, ObjectId):
             object_id = str(object_id)
-        if object_id in self.tracker_cache:
-            return self.tracker_cache[object_id]
+        if tracker := self.cached_tracker(object_id):
+            return tracker
 
-        document = await tracker_collection.find_one({"_id": ObjectId(object_id)})
+        with DB_READ_SECONDS.time(collection="trackers", op="find_one"):
+            document = await tracker_collection.find_one({"_id": ObjectId(object_id)}, LIGHT_PROJECTION)
         if document is None:
             return None
 
         return self.place_tracker(document)
 
-    async def fetch_trackers_for_user(self, user_id: int) -> list[TrackedGame]:
+    async def fetch_trackers_for_user(self, user_id: int, heavy: bool = False) -> list[TrackedGame]:
+        return await self.fetch_trackers({"user_id": user_id}, heavy)
+
+    async def fetch_trackers(self, query: dict, heavy: bool = False) -> list[TrackedGame]:
+        """
+        Only documents whose revision differs from the live copy are fetched and structured.
+
+        The `HEAVY_FIELDS` are loaded on demand by `ensure_state`, or up front for all of the trackers with `heavy`.
+        """
+        with DB_READ_SECONDS.time(collection="trackers", op="find_ids"):
+            stamps = [(str(d["_id"]), d.get("revision", 0)) async for d in tracker_collection.find(query, {"_id": 1, "revision": 1})]
+        unflushed = self.unflushed()
+        stale = [
+            ObjectId(object_id)
+            for object_id, revision in stamps
+            if ((t := self.cached_tracker(object_id)) is None or t.revision != revision) and object_id not in unflushed
+        ]
+        if stale:
+            with DB_READ_SECONDS.time(collection="trackers", op="find"):
+                async for document in tracker_collection.find({"_id": {"$in": stale}}, LIGHT_PROJECTION):
+                    self.place_tracker(document)
         trackers = []
-        async for document in tracker_collection.find({"user_id": user_id}):
-            trackers.append(self.place_tracker(document))
+        for object_id, _revision in stamps:
+            if tracker := self.cached_tracker(object_id):
+                self.tracker_cache[object_id] = tracker
+                trackers.append(tracker)
+        if heavy:
+            await self.ensure_state(*trackers)
         return trackers
 
+    def unflushed(self) -> set[str]:
+        """The `_id`s of trackers with writes that are queued or being sent."""
+        return {tracker._id for tracker, _fields, _collection, _op in self.pending_writes + self.writing}
+
     def place_tracker(self, document: dict) -> TrackedGame:
+        """
+        Structure a document, updating the live object for it in place if there is one.
+
+        A live object with unflushed writes is newer than any document, so it's kept as it is.
+        """
         object_id = str(document["_id"])
-        tracker = from_dict(document, TrackedGame)
+        tracker = self.cached_tracker(object_id)
+        if tracker is not None and object_id in self.unflushed():
+            return tracker
+        fresh = from_dict(document, TrackedGame)
+        if tracker is None:
+            tracker = fresh
+            tracker.state_loaded = False
+        else:
+            unsaved_state = tracker.dirty.intersection(HEAVY_FIELDS)
+            for field in attrs.fields(TrackedGame):
+                if field.init and field.name not in HEAVY_FIELDS:
+                    setattr(tracker, field.name, getattr(fresh, field.name))
+            tracker.dirty.clear()
+            tracker.dirty.update(unsaved_state)
+            if not unsaved_state:
+                # Someone else wrote to it, so the state may have changed too.
+                tracker.state_loaded = False
+        self.live_trackers[object_id] = tracker
         self.tracker_cache[object_id] = tracker
         return tracker
 
-    async def save_tracker(self, tracker: TrackedGame) -> None:
-        data = to_dict(tracker)
-        del data["_id"]
-        if tracker._id is None or tracker._id == "None":
-            result = await tracker_collection.insert_one(data)
-            tracker._id = str(result.inserted_id)
-            self.tracker_cache[tracker._id] = tracker
-        else:
+    async def ensure_state(self, *trackers: TrackedGame) -> None:
+        """Load the `HEAVY_FIELDS` of any of these trackers that haven't been loaded yet, in one query."""
+        unloaded = {ObjectId(t._id): t for t in trackers if not t.state_loaded and t._id not in (None, "None")}
+        if not unloaded:
+            return
+        documents = {}
+        with DB_READ_SECONDS.time(collection="tracker_state", op="find"):
+            async for document in state_collection.find({"_id": {"$in": list(unloaded)}}):
+                documents[document["_id"]] = document
+        missing = [object_id for object_id in unloaded if object_id not in documents]
+        if missing:
+            # Written before the state had its own collection; the next save moves it over.
+            with DB_READ_SECONDS.time(collection="trackers", op="find_state"):
+                async for document in tracker_collection.find({"_id": {"$in": missing}}, {field: 1 for field in HEAVY_FIELDS}):
+                    documents[document["_id"]] = document
+        types = {f.name: f.type for f in attrs.fields(TrackedGame)}
+        for object_id, tracker in unloaded.items():
+            if tracker.state_loaded:
+                # Loaded by someone else while we were waiting, and possibly modified since.
+                continue
+            document = documents.get(object_id, {})
+            for name in HEAVY_FIELDS:
+                if name in document:
+                    # Bypass change tracking; this is what's already stored.
+                    object.__setattr__(tracker, name, converter.structure(document[name], types[name]))
+            if object_id in missing and any(name in document for name in HEAVY_FIELDS):
+                tracker.mark_dirty(*HEAVY_FIELDS)
+            tracker.state_loaded = True
+
+    async def save_tracker(self, tracker: TrackedGame, defer: bool = False) -> None:
+        """
+        Write the fields that changed since the last save.  The `HEAVY_FIELDS` go to the `tracker_state` collection.
+
+        With `defer`, the write is queued and sent in a `bulk_write` with others by `flush_trackers`, or once
+        `tracker_write_batch` writes are waiting.
+        """
+        with span("db.write", collection="trackers"):
+            if tracker._id is None or tracker._id == "None":
+                data = to_dict(tracker)
+                del data["_id"]
+                for name in HEAVY_FIELDS:
+                    del data[name]
+                with DB_WRITE_SECONDS.time(collection="trackers", op="insert_one"):
+                    result = await tracker_collection.insert_one(data)
+                tracker._id = str(result.inserted_id)
+                tracker.dirty.clear()
+                tracker.dirty.update(name for name in HEAVY_FIELDS if getattr(tracker, name))
+                self.live_trackers[tracker._id] = tracker
+                self.tracker_cache[tracker._id] = tracker
+
+            fields = tracker.dirty - {"_id", "revision"}
+            tracker.dirty.clear()
+            state_fields = fields.intersection(HEAVY_FIELDS)
+            if state_fields and not tracker.state_loaded:
+                # Only part of the state is in memory; writing it would overwrite what's stored.
+                logging.warning(f"Not saving {sorted(state_fields)} for {tracker.url}: state was modified before it was loaded")
+                fields -= state_fields
+                state_fields = set()
+            if not fields:
+                return
+            tracker_fields = fields - state_fields
+            update: dict = {"$inc": {"revision": 1}}
+            if tracker_fields:
+                update["$set"] = unstructure_fields(tracker, tracker_fields)
+            if state_fields:
+                # Drop any copy left inline by older versions.
+                update["$unset"] = {name: "" for name in HEAVY_FIELDS}
+            object_id = ObjectId(tracker._id)
+            self.pending_writes.append((tracker, tracker_fields, "trackers", UpdateOne({"_id": object_id}, update, upsert=True)))
+            if state_fields:
+                state_update = UpdateOne({"_id": object_id}, {"$set": unstructure_fields(tracker, state_fields)}, upsert=True)
+                self.pending_writes.append((tracker, state_fields, "tracker_state", state_update))
+            self.live_trackers[tracker._id] = tracker
+            if not defer or len(self.pending_writes) >= configuration.get_int("tracker_write_batch"):
+                await self.flush_trackers()
+
+    async def flush_trackers(self) -> None:
+        """Send every queued tracker write, one round trip per collection."""
+        if not self.pending_writes:
+            return
+        pending, self.pending_writes = self.pending_writes, []
+        self.writing.extend(pending)
+        failed = None
+        try:
+            for name in ("trackers", "tracker_state"):
+                writes = [w for w in pending if w[2] == name]
+                if not writes:
+                    continue
+                try:
+                    with DB_WRITE_SECONDS.time(collection=name, op="bulk_write" if len(writes) > 1 else "update_one"):
+                        await get_db()[name].bulk_write([op for _t, _f, _c, op in writes], ordered=True)
+                except Exception as e:
+                    # Nothing is lost; the next save of each tracker writes these fields again.
+                    for tracker, fields, _collection, _op in writes:
+                        tracker.dirty.update(fields)
+                    failed = e
+                    continue
+                if name == "trackers":
+                    # Only now does the stored revision match, so a fetch in the meantime can't mistake ours for stale.
+                    for tracker, _fields, _collection, _op in writes:
+                        tracker.revision += 1
+        finally:
+            sent = {id(write) for write in pending}
+            self.writing = [write for write in self.writing if id(write) not in sent]
+        if failed:
+            raise failed
+
+    async def set_cheese_id(self, tracker: TrackedGame, cheese_id: int):
+        tracker.cheese_id = cheese_id
+        with DB_WRITE_SECONDS.time(collection="trackers", op="update_one"):
             await tracker_collection.update_one(
                 {"_id": ObjectId(tracker._id)},
-                {"$set": data},
+                {"$set": {"cheese_id": cheese_id}},
                 upsert=True,
             )
 
-    async def set_cheese_id(self, tracker: TrackedGame, cheese_id: int):
-        tracker.cheese_id = cheese_id
-        await tracker_collection.update_one(
-            {"_id": ObjectId(tracker._id)},
-            {"$set": {"cheese_id": cheese_id}},
-            upsert=True,
-        )
-
     async def fetch_player(self, player_id: int) -> Player | None:
         if player_id in self.player_cache:
             return self.player_cache[player_id]
-        document = await player_collection.find_one({"id": player_id})
+        with DB_READ_SECONDS.time(collection="players", op="find_one"):
+            document = await player_collection.find_one({"id": player_id})
         player = from_dict(document, Player) if document else None
         if player:
             self.player_cache[player_id] = player
         return player
 
     async def save_player(self, player: Player) -> None:
-        await player_collection.update_one(
-            {"id": player.id},
-            {"$set": to_dict(player)},
-            upsert=True,
-        )
-
-    async def fetch_all_players(self) -> list[Player]:
-        players = []
-        async for document in player_collection.find({}):
-            player = from_dict(document, Player)
-            self.player_cache[player.id] = player
-            players.append(player)
-        return players
+        with DB_WRITE_SECONDS.time(collection="players", op="update_one"):
+            await player_collection.update_one(
+                {"id": player.id},
+                {"$set": to_dict(player)},
+                upsert=True,
+            )
+
+    async def count_players(self) -> int:
+        return await player_collection.estimated_document_count()
+
+    async def random_player_id(self) -> ObjectId | None:
+        """A random player's `_id`, for starting a pass over the players somewhere different each time."""
+        with DB_READ_SECONDS.time(collection="players", op="aggregate"):
+            async for document in await player_collection.aggregate([{"$sample": {"size": 1}}, {"$project": {"_id": 1}}]):
+                return document["_id"]
+        return None
+
+    async def iter_player_batches(self, query: dict, batch_size: int = 100) -> AsyncIterator[tuple[ObjectId, list[tuple[Player, list[TrackedGame]]]]]:
+        """
+        Stream the players matching `query` with their enabled trackers, `batch_size` players at a time, in `_id` order.
+
+        Each batch takes one query for its trackers and one for their state, rather than one per player.  Players are
+        shuffled within a batch, and only players that are already cached are kept in the cache.  Each batch comes with
+        the `_id` of its last player, so a stream that fails can be resumed after it.
+        """
+        batch: list[dict] = []
+        async for document in player_collection.find(query).sort("_id", 1).batch_size(batch_size):
+            batch.append(document)
+            if len(batch) >= batch_size:
+                yield batch[-1]["_id"], await self._join_trackers(batch)
+                batch = []
+        if batch:
+            yield batch[-1]["_id"], await self._join_trackers(batch)
+
+    async def _join_trackers(self, documents: list[dict]) -> list[tuple[Player, list[TrackedGame]]]:
+        players = [self.player_cache[d["id"]] if d["id"] in self.player_cache else from_dict(d, Player) for d in documents]
+        by_user: dict[int, list[TrackedGame]] = {p.id: [] for p in players}
+        for tracker in await self.fetch_trackers({"user_id": {"$in": list(by_user)}, "disabled": {"$ne": True}}, heavy=True):
+            by_user.setdefault(tracker.user_id, []).append(tracker)
+        random.shuffle(players)
+        return [(p, by_user[p.id]) for p in players]
+
+    async def save_notification(self, notification: Notification) -> None:
+        with DB_WRITE_SECONDS.time(collection="notifications", op="update_one"):
+            await notification_collection.update_one(
+                {"id": notification.id},
+                {"$set": to_dict(notification)},
+                upsert=True,
+            )
+
+    async def delete_notification(self, notification: Notification) -> None:
+        with DB_WRITE_SECONDS.time(collection="notifications", op="delete_one"):
+            await notification_collection.delete_one({"id": notification.id})
+
+    async def fetch_notifications(self) -> list[Notification]:
+        notifications = []
+        with DB_READ_SECONDS.time(collection="notifications", op="find"):
+            async for document in notification_collection.find({}):
+                notifications.append(from_dict(document, Notification))
+        return notifications
 
 
 DATABASE = Database()
@@ -13,6 +13,7 @@ from interactions.models.internal.tasks import IntervalTrigger, Task
 
 from shared import configuration
 
+from .models.inventory import classification_changed
 from .multiworld import Datapackage, ItemClassification, DATAPACKAGES
 
 configuration.DEFAULTS["world_data_repo_url"] = "git@github.com:silasary/world_data.git"
@@ -75,9 +76,10 @@ async def update_all(dps: dict[str, Datapackage]) -> None:
     await push()
 
 
-async def load_all(dps: dict[str, Datapackage]) -> None:
-    """Load all datapackages."""
-    await clone_repo()
+async def load_all(dps: dict[str, Datapackage], sync: bool = True) -> None:
+    """Load all datapackages.  With `sync` false, world_data is used as it is instead of being pulled first."""
+    if sync:
+        await clone_repo()
     for name, dp in dps.items():
         await import_datapackage(name, dp)
     await push()
@@ -97,6 +99,7 @@ async def import_datapackage(name: str, dp: Datapackage) -> Datapackage:
     safe_name = name.replace("/", "_").replace(":", "_")
     dp = load_datapackage(safe_name, dp)
     DATAPACKAGES[name] = dp
+    classification_changed(name)
 
     save_datapackage(name, dp)
     name = getattr(dp, "game_name", None) or name
@@ -0,0 +1,181 @@
+"""
+Journaled persistence for trackers, multiworlds and players.
+
+With `persistence_mode` set to "journal", `APTracker.save()` appends only the records that changed since the last save
+to `journal.jsonl` instead of rewriting the snapshot.  Once the journal is bigger than `journal_compact_bytes` it's
+rotated to `journal.jsonl.1` and folded into a fresh snapshot in a worker thread, without touching live objects.
+Loading reads the snapshot and replays whatever journal segments are left, so a crash loses at most the changes made
+since the last save.
+
+A record is `{"t": kind, "k": key, "v": document}`, where `v` is null if the object was removed.  Tracker records
+are keyed by `[user, url]`, and `[user, null]` removes all of a user's trackers.  Replaying a record twice gives the
+same result, so a compaction that dies after writing the snapshot but before deleting the rotated segment is harmless.
+"""
+import asyncio
+import json
+import logging
+import os
+from collections.abc import MutableMapping
+from typing import Any, Callable
+
+import aiofiles
+import attrs
+import sentry_sdk
+
+from ap_alert import snapshot
+from ap_alert.converter import converter
+from ap_alert.models.player import Player
+from ap_alert.models.tracked_game import TrackedGame
+from ap_alert.multiworld import Multiworld
+from shared import configuration
+
+configuration.DEFAULTS["persistence_mode"] = "snapshot"  # "snapshot" rewrites everything on save, "journal" appends changes
+configuration.DEFAULTS["journal_compact_bytes"] = 16 * 1024 * 1024
+
+JOURNAL = "journal.jsonl"
+ROTATED = "journal.jsonl.1"
+
+
+def apply(state: dict[str, MutableMapping], record: dict) -> None:
+    kind, key, value = record["t"], record["k"], record["v"]
+    if kind == "trackers":
+        user, url = str(key[0]), key[1]
+        if url is None:
+            state["trackers"].pop(user, None)
+            return
+        trackers = state["trackers"].setdefault(user, [])
+        for i, tracker in enumerate(trackers):
+            if tracker["url"] == url:
+                if value is None:
+                    del trackers[i]
+                else:
+                    trackers[i] = value
+                break
+        else:
+            if value is not None:
+                trackers.append(value)
+        if not trackers:
+            del state["trackers"][user]
+    elif value is None:
+        state[kind].pop(str(key), None)
+    else:
+        state[kind][str(key)] = value
+
+
+def replay(state: dict[str, MutableMapping], path: str) -> int:
+    """Apply every record in the journal segment at `path`.  A torn last line from a crash mid-write is skipped."""
+    if not os.path.exists(path):
+        return 0
+    count = 0
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"Skipping unreadable journal record in {path}")
+                continue
+            apply(state, record)
+            count += 1
+    return count
+
+
+def read_state() -> dict[str, MutableMapping]:
+    """The raw records from the last snapshot, with any journal segments replayed on top."""
+    state = snapshot.read()
+    for path in (ROTATED, JOURNAL):
+        if count := replay(state, path):
+            logging.info(f"Replayed {count} records from {path}")
+    return state
+
+
+def discard() -> None:
+    """Remove the journal segments, once a full snapshot has been written."""
+    for path in (ROTATED, JOURNAL):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def compact() -> None:
+    """Fold the rotated segment into the snapshot.  Only reads and writes files, so it's safe to run in a thread."""
+    state = snapshot.read()
+    replay(state, ROTATED)
+    if configuration.get_str("snapshot_format") == "json":
+        for kind, records in state.items():
+            snapshot.write_json(kind, dict(records.items()))
+    else:
+        snapshot.write({kind: snapshot.entries(records) for kind, records in state.items()})
+    os.remove(ROTATED)
+
+
+def loaded(mapping: MutableMapping) -> MutableMapping:
+    """What's been structured so far.  Anything still in the snapshot can't have changed."""
+    return mapping.loaded if isinstance(mapping, snapshot.LazyMapping) else mapping
+
+
+class Journal:
+    def __init__(self, on_compacted: Callable[[], None] | None = None) -> None:
+        # (kind, key) -> a cheap marker of the object as last written.  A different marker means it needs writing.
+        self.markers: dict[tuple[str, Any], tuple] = {}
+        self.compaction: asyncio.Task | None = None
+        self.on_compacted = on_compacted
+
+    def changes(self, trackers: dict[int, list[TrackedGame]], multiworlds: dict[str, Multiworld], players: dict[int, Player]) -> list[dict]:
+        """Records for everything added, changed or removed since the last call."""
+        records = []
+        seen = set()
+
+        def check(kind: str, key: Any, value: Any, marker: tuple, cl: type) -> None:
+            seen.add((kind, key))
+            if self.markers.get((kind, key)) != marker:
+                self.markers[(kind, key)] = marker
+                records.append({"t": kind, "k": key, "v": converter.unstructure(value, unstructure_as=cl)})
+
+        for user, games in loaded(trackers).items():
+            for tracker in games:
+                # `version` covers every stored field except the notification queue.
+                marker = (id(tracker), tracker.version, tracker.revision, len(tracker.notification_queue))
+                check("trackers", (user, tracker.url), tracker, marker, TrackedGame)
+        for key, multiworld in loaded(multiworlds).items():
+            marker = (id(multiworld), multiworld.last_refreshed, multiworld.last_update, multiworld.title, multiworld.last_port)
+            check("multiworlds", key, multiworld, marker, Multiworld)
+        for key, player in loaded(players).items():
+            check("players", key, player, attrs.astuple(player, recurse=False), Player)
+
+        for kind, key in self.markers.keys() - seen:
+            del self.markers[(kind, key)]
+            records.append({"t": kind, "k": key, "v": None})
+        for kind, mapping in (("trackers", trackers), ("multiworlds", multiworlds), ("players", players)):
+            if isinstance(mapping, snapshot.LazyMapping):
+                for key in mapping.deleted:
+                    records.append({"t": kind, "k": (key, None) if kind == "trackers" else key, "v": None})
+                mapping.deleted.clear()
+        return records
+
+    async def save(self, trackers: dict[int, list[TrackedGame]], multiworlds: dict[str, Multiworld], players: dict[int, Player]) -> int:
+        records = self.changes(trackers, multiworlds, players)
+        if records:
+            lines = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+            async with aiofiles.open(JOURNAL, "a") as f:
+                await f.write(lines)
+        self.maybe_compact()
+        return len(records)
+
+    def maybe_compact(self) -> None:
+        if self.compaction is not None and not self.compaction.done():
+            return
+        if not os.path.exists(ROTATED):
+            if not os.path.exists(JOURNAL) or os.path.getsize(JOURNAL) < configuration.get_int("journal_compact_bytes"):
+                return
+            # New records go to a fresh journal while the old one is compacted.
+            os.replace(JOURNAL, ROTATED)
+        self.compaction = asyncio.create_task(self.compact())
+
+    async def compact(self) -> None:
+        try:
+            await asyncio.to_thread(compact)
+            logging.info("Compacted the journal into the snapshot")
+            if self.on_compacted:
+                self.on_compacted()
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+            logging.error(f"Journal compaction failed, will retry on the next save: {e}")
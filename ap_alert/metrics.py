@@ -0,0 +1,37 @@
+"""
+Metrics for the polling pipeline.
+
+Served in the Prometheus text format by `shared.metrics.start_server`.
+"""
+from shared import configuration
+from shared.metrics import Counter, Gauge, Histogram
+
+configuration.DEFAULTS["metrics_host"] = "127.0.0.1"
+configuration.DEFAULTS["metrics_port"] = 9108
+
+AGENT_REFRESH_SECONDS = Histogram("mwtb_agent_refresh_seconds", "Time spent in an agent's refresh or refresh_game.", ("agent", "host", "stage"))
+PARSE_SECONDS = Histogram("mwtb_parse_seconds", "Time spent decoding and parsing tracker responses.", ("agent",))
+
+DB_WRITE_SECONDS = Histogram("mwtb_db_write_seconds", "Latency of MongoDB writes.", ("collection", "op"))
+DB_READ_SECONDS = Histogram("mwtb_db_read_seconds", "Latency of MongoDB reads.", ("collection", "op"))
+
+DISCORD_SEND_SECONDS = Histogram("mwtb_discord_send_seconds", "Latency of notifications delivered to Discord.", ("kind",))
+OUTBOX_DEPTH = Gauge("mwtb_outbox_depth", "Notifications waiting in the outbox.")
+SCHEDULER_WAIT_SECONDS = Histogram("mwtb_scheduler_wait_seconds", "Time messages waited in the send scheduler.", ("priority",))
+OUTBOX_DELIVERIES = Counter("mwtb_outbox_deliveries_total", "Notifications leaving the outbox.", ("kind", "outcome"))
+
+CYCLE_SECONDS = Histogram(
+    "mwtb_refresh_cycle_seconds",
+    "Duration of a full refresh_all cycle.",
+    buckets=(60.0, 300.0, 600.0, 1800.0, 3600.0, 7200.0, 14400.0, 28800.0, 57600.0),
+)
+TRACKER_SECONDS = Histogram("mwtb_tracker_refresh_seconds", "Time spent processing one tracker in refresh_all.", ("agent",))
+CYCLE_USERS_PENDING = Gauge("mwtb_refresh_users_pending", "Users still waiting to be processed in the current cycle.")
+CLASSIFY_PENDING = Gauge("mwtb_classify_pending", "Items in the classification queue.")
+TRACKERS_PROCESSED = Counter("mwtb_trackers_processed_total", "Trackers processed by refresh_all.", ("agent",))
+
+ERRORS = Counter("mwtb_errors_total", "Exceptions caught in the polling pipeline.", ("stage", "exception"))
+
+
+def record_error(stage: str, e: BaseException) -> None:
+    ERRORS.inc(stage=stage, exception=type(e).__name__)
@@ -0,0 +1,53 @@
+import collections
+
+import attrs
+from world_data.models import ItemClassification
+
+from ap_alert.models.network_item import NetworkItem
+
+# Bumped whenever an item in a game is (re)classified, so rendered inventories for that game go stale.
+CLASSIFICATION_VERSIONS: collections.Counter[str] = collections.Counter()
+
+
+def classification_changed(game: str | None) -> None:
+    CLASSIFICATION_VERSIONS[game] += 1
+
+
+@attrs.define()
+class Inventory:
+    """
+    A slot's received items merged by name, kept up to date as items arrive.
+
+    The rendered pages are cached until another item arrives or an item in the game is classified.
+    """
+
+    counts: dict[tuple[str, ItemClassification], int] = attrs.field(factory=dict)
+    revision: int = 0
+    pages: list[str] | None = attrs.field(default=None, repr=False)
+    unknown: list[NetworkItem] = attrs.field(factory=list, repr=False)
+    rendered: tuple[int, int] | None = None
+
+    def add(self, items: list[NetworkItem]) -> None:
+        if not items:
+            return
+        for item in items:
+            key = (item.name, item.flags)
+            self.counts[key] = self.counts.get(key, 0) + item.quantity
+        self.revision += 1
+
+    def reset(self, items: list[NetworkItem]) -> None:
+        self.counts.clear()
+        self.revision += 1
+        self.add(items)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def items(self, game: str | None) -> list[NetworkItem]:
+        return [NetworkItem(name, game, quantity, flags) for (name, flags), quantity in self.counts.items()]
+
+    def key(self, game: str | None) -> tuple[int, int]:
+        return self.revision, CLASSIFICATION_VERSIONS[game]
+
+    def is_stale(self, game: str | None) -> bool:
+        return self.pages is None or self.rendered != self.key(game)
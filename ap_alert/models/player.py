@@ -1,8 +1,10 @@
 from ap_alert.models.enums import Filters, HintFilters
-from ap_alert.multiworld import MULTIWORLDS_BY_CHEESE, Multiworld
+from ap_alert.multiworld import CHEESE_URL, MULTIWORLDS_BY_CHEESE, Multiworld
 from shared.exceptions import BadAPIKeyException
 
 
+import datetime
+
 import attrs
 import interactions
 
@@ -19,6 +21,8 @@ class Player:
     default_hint_filters: HintFilters = HintFilters.unset
     quiet_mode: bool = False
     dm_channel_id: int | None = None
+    username: str | None = None
+    user_refreshed: datetime.datetime | None = None
 
     @property
     def mention(self) -> str:
@@ -28,20 +32,30 @@ class Player:
         return self.name if self.name else self.mention
 
     async def get_trackers(self) -> list["Multiworld"]:
-        async with make_session() as session:
+        async with make_session("cheese") as session:
             headers = {"Authorization": f"Bearer {self.cheese_api_key}"} if self.cheese_api_key else {}
-            async with session.get("https://cheesetrackers.theincrediblewheelofchee.se/api/dashboard/tracker", headers=headers) as response:
+            async with session.get(f"{CHEESE_URL}/api/dashboard/tracker", headers=headers) as response:
                 if response.status == 401:
                     raise BadAPIKeyException("Invalid API key.")
                 data = await response.json()
         value = []
         for tracker in data:
-            url = f"https://cheesetrackers.theincrediblewheelofchee.se/api/tracker/{tracker['tracker_id']}"
+            url = f"{CHEESE_URL}/api/tracker/{tracker['tracker_id']}"
             if MULTIWORLDS_BY_CHEESE.get(tracker["tracker_id"]) is not None:
                 value.append(MULTIWORLDS_BY_CHEESE[tracker["tracker_id"]])
             else:
                 value.append(Multiworld(url))
         return value
 
-    def update(self, user: interactions.User) -> None:
+    def update(self, user: interactions.User) -> bool:
+        """Copy the user's names, returning whether anything changed."""
+        changed = (self.name, self.username) != (user.global_name, user.username)
         self.name = user.global_name
+        self.username = user.username
+        self.user_refreshed = datetime.datetime.now(tz=datetime.UTC)
+        return changed
+
+    def needs_refresh(self, ttl: datetime.timedelta) -> bool:
+        if self.username is None or self.user_refreshed is None:
+            return True
+        return datetime.datetime.now(tz=datetime.UTC) - self.user_refreshed > ttl
@@ -1,6 +1,7 @@
 from typing import TYPE_CHECKING
 from ap_alert.models.network_item import NetworkItem
 from ap_alert.models.hint import Hint
+from ap_alert.models.inventory import Inventory
 from ap_alert.models.cheese_game import CheeseGame
 from ap_alert.models.enums import Filters, HintClassification, HintFilters, HintUpdate, ProgressionStatus
 from shared.bs_helpers import process_table
@@ -18,7 +19,24 @@ import datetime
 import logging
 
 
-@attrs.define()
+# Runtime bookkeeping that doesn't change what the slot looks like.
+UNVERSIONED_FIELDS = {"version", "revision", "dirty", "state_loaded", "new_items", "notification_queue", "inventory"}
+
+
+def track_changes(instance: "TrackedGame", attribute: attrs.Attribute, value):
+    if attribute.name in UNVERSIONED_FIELDS and not attribute.init:
+        return value
+    if getattr(instance, attribute.name, attrs.NOTHING) == value:
+        return value
+    if attribute.init:
+        # Only fields that are stored need saving.
+        instance.dirty.add(attribute.name)
+    if attribute.name not in UNVERSIONED_FIELDS:
+        instance.version += 1
+    return value
+
+
+@attrs.define(on_setattr=attrs.setters.pipe(attrs.setters.convert, attrs.setters.validate, track_changes))
 class TrackedGame:
     url: str  # https://archipelago.gg/tracker/tracker_id/0/slot_id
     _id: str | None = None
@@ -43,6 +61,7 @@ class TrackedGame:
 
     all_items: list[NetworkItem] = attrs.field(factory=list, init=False, repr=False)
     new_items: list[NetworkItem] = attrs.field(factory=list, init=False)
+    inventory: Inventory = attrs.field(factory=Inventory, init=False, repr=False, eq=False)
 
     checks: dict[str, bool] = attrs.field(factory=dict, repr=False)
 
@@ -52,9 +71,24 @@ class TrackedGame:
 
     notification_queue: list[NetworkItem] = attrs.field(factory=list, repr=False)
 
+    # Incremented by the database on every write, so a cached copy can tell whether it's still current.
+    revision: int = 0
+
+    # Bumped whenever the slot's state changes, so anything rendered from it can be cached until then.
+    version: int = attrs.field(default=0, init=False, repr=False, eq=False)
+    # Stored fields changed since the last save.  Containers mutated in place are marked with mark_dirty.
+    dirty: set[str] = attrs.field(factory=set, init=False, repr=False, eq=False)
+    # False while checks, hints and the notification queue are still in the database; see Database.ensure_state.
+    state_loaded: bool = attrs.field(default=True, init=False, repr=False, eq=False)
+
     def __hash__(self) -> int:
         return hash(self.url)
 
+    def mark_dirty(self, *fields: str) -> None:
+        self.dirty.update(fields)
+        if not UNVERSIONED_FIELDS.issuperset(fields):
+            self.version += 1
+
     @property
     def tracker_id(self) -> str:
         """ID of the multiworld tracker."""
@@ -67,7 +101,7 @@ class TrackedGame:
     async def refresh_metadata(self) -> None:
         logging.info(f"Refreshing metadata for {self.url}")
         multitracker_url = self.multitracker_url
-        async with make_session() as session:
+        async with make_session("webtracker") as session:
             async with session.get(multitracker_url) as response:
                 if response.status != 200:
                     self.failures += 1
@@ -95,7 +129,10 @@ class TrackedGame:
             return
         rows = process_table(table)
         for r in rows:
-            self.checks[r["Location"]] = bool(r["Checked"])
+            checked = bool(r["Checked"])
+            if self.checks.get(r["Location"]) != checked:
+                self.checks[r["Location"]] = checked
+                self.mark_dirty("checks")
 
     def update(self, data: "CheeseGame") -> None:
         self.game = data.game
@@ -120,6 +157,7 @@ class TrackedGame:
             hint.id = str(hint.id)
             if hint.id not in self.finder_hints:
                 self.finder_hints[hint.id] = hint
+                self.mark_dirty("finder_hints")
                 if hint.finder_game_id == hint.receiver_game_id:
                     # Self hint, never notify
                     continue
@@ -129,12 +167,14 @@ class TrackedGame:
                         updated.append(hint)
             elif hint.found and not self.finder_hints[hint.id].found:
                 self.finder_hints[hint.id] = hint
+                self.mark_dirty("finder_hints")
                 self.finder_hints[hint.id].update = HintUpdate.found
                 if not self.finder_hints[hint.id].useless:
                     if filters & HintFilters.finder:
                         updated.append(self.finder_hints[hint.id])
             elif hint.classification != self.finder_hints[hint.id].classification and not hint.found:
                 self.finder_hints[hint.id] = hint
+                self.mark_dirty("finder_hints")
                 self.finder_hints[hint.id].update = HintUpdate.classified
                 if filters & HintFilters.finder and hint.classification != HintClassification.unset:
                     updated.append(self.finder_hints[hint.id])
@@ -146,17 +186,20 @@ class TrackedGame:
             hint.id = str(hint.id)
             if hint.id not in self.receiver_hints:
                 self.receiver_hints[hint.id] = hint
+                self.mark_dirty("receiver_hints")
                 if not hint.found:
                     hint.update = HintUpdate.new
                     if filters & HintFilters.receiver:
                         updated.append(hint)
             elif hint.found and not self.receiver_hints[hint.id].found:
                 self.receiver_hints[hint.id] = hint
+                self.mark_dirty("receiver_hints")
                 self.receiver_hints[hint.id].update = HintUpdate.found
                 if filters & HintFilters.receiver:
                     updated.append(self.receiver_hints[hint.id])
             elif hint.classification != self.receiver_hints[hint.id].classification and not hint.found:
                 self.receiver_hints[hint.id] = hint
+                self.mark_dirty("receiver_hints")
                 self.receiver_hints[hint.id].update = HintUpdate.classified
                 if filters & HintFilters.receiver and hint.classification != HintClassification.unset:
                     updated.append(self.receiver_hints[hint.id])
@@ -1,6 +1,7 @@
 import datetime
 import json
 import logging
+import time
 from typing import Optional
 import urllib.parse
 
@@ -15,12 +16,19 @@ from ap_alert.models.cheese_game import CheeseGame
 from ap_alert.models.enums import Filters
 from ap_alert.models.tracked_game import TrackedGame
 from ap_alert.models.enums import CompletionStatus
+from ap_alert.metrics import AGENT_REFRESH_SECONDS, PARSE_SECONDS
+from ap_alert.tracing import span
 from archipelagopy import netutils
 from archipelagopy.utils import fetch_datapackage_from_webhost
 from shared.bs_helpers import process_table
 from world_data.models import Datapackage, ItemClassification
+from shared import configuration
 from shared.web import make_session
 
+configuration.DEFAULTS["cheese_url"] = "https://cheesetrackers.theincrediblewheelofchee.se"
+
+CHEESE_URL: str = configuration.get_str("cheese_url").rstrip("/")
+
 
 @attrs.define()
 class Multiworld:
@@ -48,14 +56,14 @@ class Multiworld:
     async def refresh(self, force: bool = False) -> None:
         if "cheese" not in self.agents:
             self.agents["cheese"] = CheeseAgent(self)
-        await self.agents["cheese"].refresh(force)
+        await self.agents["cheese"].timed_refresh(force)
         if "api" not in self.agents:
             self.agents["api"] = ApiTrackerAgent(self)
-        await self.agents["api"].refresh(force)
+        await self.agents["api"].timed_refresh(force)
         if not self.agents["cheese"].enabled and not self.agents["api"].enabled:
             if "webtracker" not in self.agents:
                 self.agents["webtracker"] = WebTrackerAgent(self)
-            await self.agents["webtracker"].refresh(force)
+            await self.agents["webtracker"].timed_refresh(force)
 
         self.last_refreshed = datetime.datetime.now(tz=datetime.UTC)
         if self.cheese_tracker_id is not None and MULTIWORLDS_BY_CHEESE.get(self.cheese_tracker_id) is not self:
@@ -65,12 +73,12 @@ class Multiworld:
 
     async def refresh_game(self, slot: TrackedGame) -> bool:
         if "api" in self.agents and self.agents["api"].enabled:
-            return await self.agents["api"].refresh_game(slot)
+            return await self.agents["api"].timed_refresh_game(slot)
 
         if "webtracker" not in self.agents:
             self.agents["webtracker"] = WebTrackerAgent(self)
         if self.agents["webtracker"].enabled:
-            return await self.agents["webtracker"].refresh_game(slot)
+            return await self.agents["webtracker"].timed_refresh_game(slot)
         return False
 
     def last_activity(self) -> datetime.datetime:
@@ -86,7 +94,7 @@ class Multiworld:
         from .converter import converter
 
         game = converter.unstructure(game)  # convert datetime to isoformat
-        async with make_session() as session:
+        async with make_session("cheese") as session:
             async with session.put(f"{self.url}/game/{game['id']}", json=game) as response:
                 if response.status != 200:
                     raise aiohttp.ClientResponseError(
@@ -96,6 +104,15 @@ class Multiworld:
                         history=response.history,
                     )
 
+    @property
+    def game_agent(self) -> str:
+        """
+        Return the name of the agent used by refresh_game.
+        """
+        if "api" in self.agents and self.agents["api"].enabled:
+            return "api"
+        return "webtracker"
+
     @property
     def goaled(self) -> bool:
         return all(g.completion_status in [CompletionStatus.goal, CompletionStatus.done, CompletionStatus.released] for g in self.games.values())
@@ -110,6 +127,16 @@ class Multiworld:
             return uri.hostname or "archipelago.gg"
         return "archipelago.gg"
 
+    @property
+    def ap_webhost(self) -> str:
+        """
+        Return the base URL of the AP server, including any port.
+        """
+        if self.upstream_url:
+            uri = urllib.parse.urlparse(self.upstream_url)
+            return f"{uri.scheme or 'https'}://{uri.netloc or 'archipelago.gg'}"
+        return "https://archipelago.gg"
+
     @property
     def ap_scheme(self) -> str:
         """
@@ -122,6 +149,7 @@ class Multiworld:
 
 
 class BaseAgent:
+    name: str = "base"
     mw: Multiworld
     enabled: bool = True
     last_refreshed: datetime.datetime = datetime.datetime.fromisoformat("1970-01-01T00:00:00Z")
@@ -129,6 +157,20 @@ class BaseAgent:
     def __init__(self, mw: Multiworld) -> None:
         self.mw = mw
 
+    @property
+    def host(self) -> str:
+        return self.mw.ap_hostname
+
+    async def timed_refresh(self, force: bool = False) -> None:
+        with span("agent.refresh", f"{self.name} refresh", agent=self.name, host=self.host, room=self.mw.tracker_id or self.mw.ap_tracker_id):
+            with AGENT_REFRESH_SECONDS.time(agent=self.name, host=self.host, stage="refresh"):
+                await self.refresh(force)
+
+    async def timed_refresh_game(self, slot: TrackedGame) -> bool:
+        with span("agent.refresh_game", f"{self.name} refresh_game", agent=self.name, host=self.host, room=slot.tracker_id):
+            with AGENT_REFRESH_SECONDS.time(agent=self.name, host=self.host, stage="refresh_game"):
+                return await self.refresh_game(slot)
+
     def rate_limit(self, min_interval: datetime.timedelta, force: bool) -> bool:
         if not self.enabled:
             return True
@@ -148,45 +190,58 @@ class BaseAgent:
 
 
 class CheeseAgent(BaseAgent):
+    name = "cheese"
+
+    @property
+    def host(self) -> str:
+        return urllib.parse.urlparse(CHEESE_URL).hostname
+
     async def refresh(self, force: bool = False) -> None:
         if self.rate_limit(datetime.timedelta(hours=1), force):
             return
 
         if self.mw.cheese_url is None:
-            if self.mw.url.startswith("https://cheesetrackers.theincrediblewheelofchee.se/api/tracker/"):
+            if self.mw.url.startswith(f"{CHEESE_URL}/api/tracker/"):
                 self.mw.cheese_url = self.mw.url
             else:
-                async with make_session() as session:
+                async with make_session(self.name) as session:
                     async with session.post(
-                        "https://cheesetrackers.theincrediblewheelofchee.se/api/tracker",
+                        f"{CHEESE_URL}/api/tracker",
                         json={"url": self.mw.url},
                     ) as response:
                         if response.status in [400, 404, 403]:
                             self.enabled = False
                             return
                         ch_id = (await response.json()).get("tracker_id")
-                self.mw.cheese_url = f"https://cheesetrackers.theincrediblewheelofchee.se/api/tracker/{ch_id}"
+                self.mw.cheese_url = f"{CHEESE_URL}/api/tracker/{ch_id}"
 
         logging.info(f"Refreshing {self.mw.cheese_url}")
-        async with make_session() as session:
-            async with session.get(self.mw.cheese_url) as response:
-                txt = await response.text()
-        data = json.loads(txt)
-        self.mw.cheese_tracker_id = data.get("tracker_id")
-        self.mw.title = data.get("title", self.mw.title)
-        self.mw.games = {g["position"]: CheeseGame(g) for g in data.get("games")}
-        GAMES.update({g.id: g for g in self.mw.games.values()})
-        self.mw.last_update = datetime.datetime.fromisoformat(data.get("updated_at"))
-        self.mw.upstream_url = data.get("upstream_url")
-        self.mw.room_link = data.get("room_link")
-        self.mw.last_port = data.get("last_port")
-        self.mw.hints = data.get("hints", [])
-
-        if self.mw.url.startswith("https://cheesetrackers.theincrediblewheelofchee.se/api/tracker/") and self.mw.upstream_url is not None:
+        with span("fetch", self.mw.cheese_url):
+            async with make_session(self.name) as session:
+                async with session.get(self.mw.cheese_url) as response:
+                    txt = await response.text()
+        parse_start = time.perf_counter()
+        with span("decode"):
+            data = json.loads(txt)
+        with span("parse"):
+            self.mw.cheese_tracker_id = data.get("tracker_id")
+            self.mw.title = data.get("title", self.mw.title)
+            self.mw.games = {g["position"]: CheeseGame(g) for g in data.get("games")}
+            GAMES.update({g.id: g for g in self.mw.games.values()})
+            self.mw.last_update = datetime.datetime.fromisoformat(data.get("updated_at"))
+            self.mw.upstream_url = data.get("upstream_url")
+            self.mw.room_link = data.get("room_link")
+            self.mw.last_port = data.get("last_port")
+            self.mw.hints = data.get("hints", [])
+        PARSE_SECONDS.observe(time.perf_counter() - parse_start, agent=self.name)
+
+        if self.mw.url.startswith(f"{CHEESE_URL}/api/tracker/") and self.mw.upstream_url is not None:
             self.mw.url = self.mw.upstream_url
 
 
 class WebTrackerAgent(BaseAgent):
+    name = "webtracker"
+
     async def refresh(self, force: bool = False) -> None:
         if self.rate_limit(datetime.timedelta(hours=1), force):
             return
@@ -200,12 +255,13 @@ class WebTrackerAgent(BaseAgent):
         self.mw.ap_tracker_id = self.mw.url.split("/")[-1]
         logging.info(f"Refreshing cheeseless {self.mw.url}")
         multitracker_url = self.mw.url
-        async with make_session() as session:
+        async with make_session(self.name) as session:
             try:
-                async with session.get(multitracker_url) as response:
-                    if response.status != 200:
-                        return
-                    html = await response.text()
+                with span("fetch", multitracker_url):
+                    async with session.get(multitracker_url) as response:
+                        if response.status != 200:
+                            return
+                        html = await response.text()
             except aiohttp.ClientConnectorError as e:
                 logging.error(f"Connection error occurred while processing tracker {self.mw.url}: {e}")
                 return
@@ -213,12 +269,13 @@ class WebTrackerAgent(BaseAgent):
                 logging.error(f"Connection timeout error occurred while processing tracker {self.mw.url}: {e}")
                 self.last_refreshed = datetime.datetime.now(tz=datetime.UTC) + datetime.timedelta(hours=24)  # back off for a day
                 return
-        soup = BeautifulSoup(html, features="html.parser")
-        title = soup.find("title").string
-        if title == "Page Not Found (404)":
-            self.enabled = False
-            return
-        slots = process_table(soup.find(id="checks-table"))
+        with PARSE_SECONDS.time(agent=self.name), span("parse"):
+            soup = BeautifulSoup(html, features="html.parser")
+            title = soup.find("title").string
+            if title == "Page Not Found (404)":
+                self.enabled = False
+                return
+            slots = process_table(soup.find(id="checks-table"))
         for slot in slots:
             slot_id = slot["#"]
             if slot_id == "Total":
@@ -244,16 +301,17 @@ class WebTrackerAgent(BaseAgent):
             await slot.refresh_metadata()
         logging.info(f"Refreshing {slot.url}")
         try:
-            async with make_session() as session:
-                async with session.get(slot.url) as response:
-                    if response.status == 500 and "/tracker/" in slot.url:
-                        slot.url = slot.url.replace("/tracker/", "/generic_tracker/")
-                        return await self.refresh_game(slot)
-
-                    if response.status != 200:
-                        slot.failures += 1
-                        return False
-                    html = await response.text()
+            async with make_session(self.name) as session:
+                with span("fetch", slot.url):
+                    async with session.get(slot.url) as response:
+                        if response.status == 500 and "/tracker/" in slot.url:
+                            slot.url = slot.url.replace("/tracker/", "/generic_tracker/")
+                            return await self.refresh_game(slot)
+
+                        if response.status != 200:
+                            slot.failures += 1
+                            return False
+                        html = await response.text()
         except aiohttp.InvalidUrlClientError:
             # This is a bad URL, don't try again
             slot.failures = 100
@@ -266,7 +324,9 @@ class WebTrackerAgent(BaseAgent):
             logging.error(f"Connection error occurred while processing tracker {slot.url}: {e}")
             slot.failures += 1
             return False
-        soup = BeautifulSoup(html, features="html.parser")
+        parse_start = time.perf_counter()
+        with span("decode"):
+            soup = BeautifulSoup(html, features="html.parser")
         title = soup.find("title").string
         if title == "Page Not Found (404)":
             slot.failures += 1
@@ -278,8 +338,10 @@ class WebTrackerAgent(BaseAgent):
                 return await self.refresh_game(slot)
         # headers = [i.string for i in recieved.find_all("th")]
         # rows = [[try_int(i.string) for i in r.find_all("td")] for r in recieved.find_all("tr")[1:]]
-        slot.process_locations(soup.find(id="locations-table"))
-        rows = process_table(recieved)
+        with span("parse"):
+            slot.process_locations(soup.find(id="locations-table"))
+            rows = process_table(recieved)
+        PARSE_SECONDS.observe(time.perf_counter() - parse_start, agent=self.name)
         slot.last_refresh = datetime.datetime.now(tz=datetime.timezone.utc)
         if not rows:
             return False
@@ -297,15 +359,20 @@ class WebTrackerAgent(BaseAgent):
             return False
 
         new_items: list[NetworkItem] = []
-        for r in rows:
-            item = NetworkItem(r[index_item], slot.game, r[index_amount])
-            slot.all_items.append(item)
-            if r[index_order] > slot.latest_item:
-                new_items.append(item)
-                if DATAPACKAGES.get(slot.game) is not None:
-                    classification = DATAPACKAGES[slot.game].items.setdefault(r[index_item], ItemClassification.unknown)
-                    if classification in [ItemClassification.progression, ItemClassification.mcguffin]:
-                        slot.last_progression = (r[index_item], datetime.datetime.now(tz=datetime.UTC))
+        all_items: list[NetworkItem] = []
+        with span("diff"):
+            for r in rows:
+                item = NetworkItem(r[index_item], slot.game, r[index_amount])
+                all_items.append(item)
+                if r[index_order] > slot.latest_item:
+                    new_items.append(item)
+                    if DATAPACKAGES.get(slot.game) is not None:
+                        classification = DATAPACKAGES[slot.game].items.setdefault(r[index_item], ItemClassification.unknown)
+                        if classification in [ItemClassification.progression, ItemClassification.mcguffin]:
+                            slot.last_progression = (r[index_item], datetime.datetime.now(tz=datetime.UTC))
+        # Each row is a running total, so the whole table replaces what we had.
+        slot.all_items = all_items
+        slot.inventory.reset(all_items)
 
         if is_up_to_date:
             return False
@@ -322,15 +389,19 @@ class WebTrackerAgent(BaseAgent):
             return False
         if slot.filters in [Filters.unset, Filters.everything]:
             slot.notification_queue.extend(new_items)
+            slot.mark_dirty("notification_queue")
             return True
 
         new_items = [i for i in new_items if i.classification in [ItemClassification.unknown, ItemClassification.bad_name] or slot.filters & Filters(i.classification.value)]
 
         slot.notification_queue.extend(new_items)
+        slot.mark_dirty("notification_queue")
         return bool(new_items)
 
 
 class ApiTrackerAgent(BaseAgent):
+    name = "api"
+
     async def refresh(self, force: bool = False) -> None:
         if self.rate_limit(datetime.timedelta(hours=1), force):
             return
@@ -339,31 +410,34 @@ class ApiTrackerAgent(BaseAgent):
             self.mw.ap_tracker_id = self.mw.url.split("/")[-1]
 
         logging.info(f"Refreshing API multiworld {self.mw.url}")
-        async with make_session() as session:
+        async with make_session(self.name) as session:
             if self.mw.static_tracker_data is None:
-                static_url = f"{self.mw.ap_scheme}://{self.mw.ap_hostname}/api/static_tracker/{self.mw.ap_tracker_id}"
-                async with session.get(static_url) as response:
-                    if response.status != 200:
-                        self.enabled = False
-                        return
-                    self.mw.static_tracker_data = await response.json()
+                static_url = f"{self.mw.ap_webhost}/api/static_tracker/{self.mw.ap_tracker_id}"
+                with span("fetch", static_url):
+                    async with session.get(static_url) as response:
+                        if response.status != 200:
+                            self.enabled = False
+                            return
+                        self.mw.static_tracker_data = await response.json()
             if self.mw.slot_data is None:
-                slot_url = f"{self.mw.ap_scheme}://{self.mw.ap_hostname}/api/slot_data_tracker/{self.mw.ap_tracker_id}"
-                async with session.get(slot_url) as response:
-                    if response.status == 500:
-                        # Temporary hack
-                        self.mw.slot_data = []
-                    elif response.status != 200:
+                slot_url = f"{self.mw.ap_webhost}/api/slot_data_tracker/{self.mw.ap_tracker_id}"
+                with span("fetch", slot_url):
+                    async with session.get(slot_url) as response:
+                        if response.status == 500:
+                            # Temporary hack
+                            self.mw.slot_data = []
+                        elif response.status != 200:
+                            self.enabled = False
+                            return
+                        else:
+                            self.mw.slot_data = await response.json()
+            api_url = f"{self.mw.ap_webhost}/api/tracker/{self.mw.ap_tracker_id}"
+            with span("fetch", api_url):
+                async with session.get(api_url) as response:
+                    if response.status != 200:
                         self.enabled = False
                         return
-                    else:
-                        self.mw.slot_data = await response.json()
-            api_url = f"{self.mw.ap_scheme}://{self.mw.ap_hostname}/api/tracker/{self.mw.ap_tracker_id}"
-            async with session.get(api_url) as response:
-                if response.status != 200:
-                    self.enabled = False
-                    return
-                data = await response.json()
+                    data = await response.json()
         self.mw.player_checks_done = data.get("player_checks_done", [])
         self.mw.player_items_received = data.get("player_items_received", [])
 
@@ -373,7 +447,6 @@ class ApiTrackerAgent(BaseAgent):
             if self.mw.player_items_received is None:
                 return False
         new_items: list[NetworkItem] = []
-        all_items: list[NetworkItem] = []
         api_items: list[netutils.NetworkItem] = next((i["items"] for i in self.mw.player_items_received if i["player"] == slot.slot_id), [])
 
         if len(api_items) - 1 == slot.latest_item and slot.all_items:
@@ -386,7 +459,8 @@ class ApiTrackerAgent(BaseAgent):
         checksum = self.mw.static_tracker_data["datapackage"].get(slot.game, {}).get("checksum")
         if checksum:
             try:
-                ap_datapackage = await fetch_datapackage_from_webhost(slot.game, checksum, f"{self.mw.ap_scheme}://{self.mw.ap_hostname}")
+                with span("fetch", f"datapackage {checksum}"):
+                    ap_datapackage = await fetch_datapackage_from_webhost(slot.game, checksum, self.mw.ap_webhost)
             except ValueError as e:
                 ap_datapackage = None
                 print(e)
@@ -399,24 +473,34 @@ class ApiTrackerAgent(BaseAgent):
         if "item_id_to_name" not in ap_datapackage:
             ap_datapackage["item_id_to_name"] = {v: k for k, v in ap_datapackage.get("item_name_to_id", {}).items()}
 
-        for index, netitem in enumerate(api_items, start=0):
-            item_id = netitem[0]
-            #  location = netitem[1]
-            #  sender = netitem[2]
-            flags = netitem[3] if len(netitem) > 3 else 0
-
-            item_name = ap_datapackage["item_id_to_name"].get(item_id, str(item_id))
-            classification = ItemClassification.from_network_flag(flags)
-            classification = DATAPACKAGES[slot.game].postprocess_item_classification(item_name, classification)
-            item = NetworkItem(item_name, slot.game, 1, classification)
-            all_items.append(item)
-            if index > slot.latest_item:
-                new_items.append(item)
-                if item.classification in [ItemClassification.progression, ItemClassification.mcguffin]:
-                    slot.last_progression = (item_name, datetime.datetime.now(tz=datetime.UTC))
+        # Items are append-only, so only the ones we haven't seen need decoding.  Anything inconsistent is rebuilt.
+        known = len(slot.all_items) if len(slot.all_items) == slot.latest_item + 1 else 0
+        all_items = slot.all_items if known else []
+        parse_start = time.perf_counter()
+        with span("diff"):
+            for index, netitem in enumerate(api_items[known:], start=known):
+                item_id = netitem[0]
+                #  location = netitem[1]
+                #  sender = netitem[2]
+                flags = netitem[3] if len(netitem) > 3 else 0
+
+                item_name = ap_datapackage["item_id_to_name"].get(item_id, str(item_id))
+                classification = ItemClassification.from_network_flag(flags)
+                classification = DATAPACKAGES[slot.game].postprocess_item_classification(item_name, classification)
+                item = NetworkItem(item_name, slot.game, 1, classification)
+                all_items.append(item)
+                if index > slot.latest_item:
+                    new_items.append(item)
+                    if item.classification in [ItemClassification.progression, ItemClassification.mcguffin]:
+                        slot.last_progression = (item_name, datetime.datetime.now(tz=datetime.UTC))
+        PARSE_SECONDS.observe(time.perf_counter() - parse_start, agent=self.name)
 
         slot.last_refresh = datetime.datetime.now(tz=datetime.timezone.utc)
-        slot.all_items = all_items
+        if known:
+            slot.inventory.add(all_items[known:])
+        else:
+            slot.all_items = all_items
+            slot.inventory.reset(all_items)
         if not new_items:
             return False
 
@@ -430,10 +514,12 @@ class ApiTrackerAgent(BaseAgent):
             return False
         if slot.filters in [Filters.unset, Filters.everything]:
             slot.notification_queue.extend(new_items)
+            slot.mark_dirty("notification_queue")
             return True
 
         new_items = [i for i in new_items if i.classification in [ItemClassification.unknown, ItemClassification.bad_name] or slot.filters & Filters(i.classification.value)]
         slot.notification_queue.extend(new_items)
+        slot.mark_dirty("notification_queue")
         return bool(new_items)
 
 
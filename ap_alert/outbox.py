@@ -0,0 +1,235 @@
+"""
+Notification outbox.
+
+The polling loop only enqueues notifications; sender workers deliver them to Discord with retries.  Notifications for
+one user are always delivered in order, by one worker at a time.  A user's queue is held open for
+`notification_coalesce_seconds` after the first notification arrives, then handed to the deliver callback as one batch
+so it can be merged into as few messages as possible.  If a batch fails after some of its messages were sent, the
+callback records that in `Notification.sent` and the same batch is retried without them.  When a store is configured every notification is written
+through to it, so anything still queued when the bot stops is restored at startup.
+"""
+import asyncio
+import collections
+import datetime
+import itertools
+import logging
+import uuid
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+import attrs
+
+from ap_alert.metrics import OUTBOX_DELIVERIES, OUTBOX_DEPTH, record_error
+from ap_alert.models.enums import Filters, HintFilters
+from ap_alert.models.network_item import NetworkItem
+from ap_alert.models.tracked_game import TrackedGame
+from shared import configuration
+
+if TYPE_CHECKING:
+    from ap_alert.database import Database
+
+configuration.DEFAULTS["outbox_workers"] = 4
+configuration.DEFAULTS["outbox_max_attempts"] = 5
+configuration.DEFAULTS["notification_coalesce_seconds"] = 30
+
+outbox_logger = logging.getLogger("ap_alert.outbox")
+
+
+class Undeliverable(Exception):
+    """Raised by the deliver callback when a user can't be reached.  Everything queued for them is dropped."""
+
+
+@attrs.define()
+class Notification:
+    user_id: int
+    kind: str  # items, hints, text or classify
+    tracker_url: str | None = None
+    slot_name: str | None = None
+    game: str | None = None
+    cheese_id: int = -1
+    filters: Filters = Filters.unset
+    hint_filters: HintFilters = HintFilters.unset
+    items: list[NetworkItem] = attrs.field(factory=list)
+    embeds: list[dict] = attrs.field(factory=list)
+    text: str | None = None
+    id: str = attrs.field(factory=lambda: uuid.uuid4().hex)
+    created: datetime.datetime = attrs.field(factory=lambda: datetime.datetime.now(tz=datetime.UTC))
+    attempts: int = 0
+    sent: int = 0  # messages rendered from this notification's batch that were sent before a failure
+
+    @classmethod
+    def for_tracker(cls, kind: str, tracker: TrackedGame, **kwargs) -> "Notification":
+        return cls(
+            tracker.user_id,
+            kind,
+            tracker_url=tracker.url,
+            slot_name=tracker.name,
+            game=tracker.game,
+            cheese_id=tracker.cheese_id,
+            filters=tracker.filters,
+            hint_filters=tracker.hint_filters,
+            **kwargs,
+        )
+
+    def slot(self) -> TrackedGame:
+        """A detached copy of the tracker with just enough state to render the notification."""
+        return TrackedGame(
+            self.tracker_url,
+            user_id=self.user_id,
+            cheese_id=self.cheese_id,
+            name=self.slot_name,
+            game=self.game,
+            filters=self.filters,
+            hint_filters=self.hint_filters,
+        )
+
+
+class Outbox:
+    def __init__(
+        self,
+        deliver: Callable[[list[Notification]], Awaitable[None]],
+        store: "Database | None" = None,
+        workers: int = 4,
+        max_attempts: int = 5,
+        retry_delay: float = 2.0,
+        coalesce_window: float = 0.0,
+        max_batch: int = 100,
+    ) -> None:
+        self.deliver = deliver
+        self.store = store
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+        self.pending: dict[int, collections.deque[Notification]] = {}
+        self.active: set[int] = set()
+        self.depth = 0
+        self._ready: asyncio.Queue[int] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return any(not t.done() for t in self._tasks)
+
+    async def put(self, notification: Notification) -> None:
+        if self.store:
+            try:
+                await self.store.save_notification(notification)
+            except Exception as e:
+                record_error("outbox_store", e)
+                outbox_logger.error(f"Failed to persist notification for {notification.user_id}: {e}")
+        self._append(notification, self.coalesce_window)
+
+    def _append(self, notification: Notification, delay: float = 0.0) -> None:
+        queue = self.pending.setdefault(notification.user_id, collections.deque())
+        queue.append(notification)
+        self.depth += 1
+        OUTBOX_DEPTH.set(self.depth)
+        if len(queue) == 1 and notification.user_id not in self.active:
+            if delay > 0:
+                # Mark the user active while the window is open, so the first notification schedules the only wake-up.
+                self.active.add(notification.user_id)
+                asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, notification.user_id)
+            else:
+                self._ready.put_nowait(notification.user_id)
+
+    async def restore(self) -> int:
+        """Queue everything left in the store by a previous run."""
+        if not self.store:
+            return 0
+        notifications = await self.store.fetch_notifications()
+        for notification in sorted(notifications, key=lambda n: n.created):
+            self._append(notification)
+        if notifications:
+            outbox_logger.info(f"Restored {len(notifications)} queued notifications")
+        return len(notifications)
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._tasks = [asyncio.create_task(self._worker(), name=f"outbox-{i}") for i in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def join(self) -> None:
+        """Wait until everything queued so far has been delivered or given up on."""
+        while self.depth:
+            await asyncio.sleep(0.05)
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            user_id = await self._ready.get()
+            self.active.add(user_id)
+            delay = None
+            try:
+                delay = await self._drain(user_id)
+            except Exception as e:
+                record_error("outbox", e)
+                outbox_logger.error(f"Outbox worker failed for {user_id}", exc_info=e)
+                delay = self.retry_delay
+            finally:
+                if delay is None and self.pending.get(user_id):
+                    # More arrived while we were sending; give it its own coalescing window.
+                    delay = self.coalesce_window
+                if delay is None:
+                    self.active.discard(user_id)
+                    self.pending.pop(user_id, None)
+                elif delay > 0:
+                    # The user stays marked active until the wake-up, so nothing else picks up their queue early.
+                    loop.call_later(delay, self._ready.put_nowait, user_id)
+                else:
+                    self._ready.put_nowait(user_id)
+
+    async def _drain(self, user_id: int) -> float | None:
+        """Deliver a user's queue in order, in batches.  Returns a backoff delay if delivery should be retried later."""
+        queue = self.pending.get(user_id)
+        while queue:
+            if queue[0].sent:
+                # Part of this batch already went out.  Retry exactly that batch, so it renders to the same messages and
+                # the deliver callback can skip the ones that were sent.
+                batch = list(itertools.takewhile(lambda n: n.sent == queue[0].sent, queue))
+            else:
+                batch = list(itertools.islice(queue, self.max_batch))
+            try:
+                await self.deliver(batch)
+            except Undeliverable:
+                dropped = list(queue)
+                queue.clear()
+                for n in dropped:
+                    await self._done(n, "dropped")
+                return None
+            except Exception as e:
+                record_error("deliver", e)
+                attempts = max(n.attempts for n in batch) + 1
+                for n in batch:
+                    n.attempts = attempts
+                if attempts < self.max_attempts:
+                    outbox_logger.warning(f"Delivery to {user_id} failed ({attempts}/{self.max_attempts}): {e}")
+                    if self.store:
+                        for n in batch:
+                            await self.store.save_notification(n)
+                    return self.retry_delay * 2 ** (attempts - 1)
+                outbox_logger.error(f"Giving up on {len(batch)} notifications for {user_id}: {e}")
+                outcome = "failed"
+            else:
+                outcome = "sent"
+            for n in batch:
+                queue.popleft()
+                await self._done(n, outcome)
+        return None
+
+    async def _done(self, notification: Notification, outcome: str) -> None:
+        self.depth -= 1
+        OUTBOX_DEPTH.set(self.depth)
+        OUTBOX_DELIVERIES.inc(kind=notification.kind, outcome=outcome)
+        if self.store:
+            try:
+                await self.store.delete_notification(notification)
+            except Exception as e:
+                record_error("outbox_store", e)
+                outbox_logger.error(f"Failed to remove delivered notification {notification.id}: {e}")
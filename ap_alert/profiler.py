@@ -0,0 +1,116 @@
+"""
+Low overhead sampling profiler for live refresh cycles.
+
+A background thread periodically samples the event loop thread's stack, so nothing is paid while profiling is off.
+Results are written as collapsed stacks, which can be fed directly to flamegraph.pl or speedscope.
+"""
+import collections
+import datetime
+import os
+import sys
+import threading
+import time
+from types import FrameType
+
+import attrs
+
+
+_relative_paths: dict[str, str] = {}  # co_filename -> path shown in the profile
+
+
+def _relative_path(filename: str) -> str:
+    relative = _relative_paths.get(filename)
+    if relative is None:
+        relative = filename
+        for path in sys.path:
+            if path and filename.startswith(path):
+                relative = os.path.relpath(filename, path)
+                break
+        _relative_paths[filename] = relative
+    return relative
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({_relative_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(name: str) -> bool:
+    """The event loop waiting in its selector is idle time, not work."""
+    return name.split(" ", 1)[0].endswith("Selector.select")
+
+
+@attrs.define()
+class ProfileReport:
+    path: str
+    samples: int
+    idle: int
+    duration: float
+    top_self: list[tuple[str, int]]
+
+    def summary(self, limit: int = 15) -> str:
+        lines = [
+            f"Profiled {self.samples} samples over {self.duration:.1f}s ({self.idle / max(self.samples, 1):.0%} idle), written to `{self.path}`",
+            "Top functions by self time:",
+        ]
+        for name, count in self.top_self[:limit]:
+            lines.append(f"`{count / max(self.samples, 1):6.1%}` {name}")
+        return "\n".join(lines)
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.005, thread_id: int | None = None) -> None:
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks: collections.Counter[tuple[str, ...]] = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._started = 0.0
+        self._stopped = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._stopped = time.perf_counter()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+            self.samples += 1
+
+    def self_time(self) -> list[tuple[str, int]]:
+        leaves: collections.Counter[str] = collections.Counter()
+        for stack, count in self.stacks.items():
+            if stack and not _is_idle(stack[-1]):
+                leaves[stack[-1]] += count
+        return leaves.most_common()
+
+    def idle_samples(self) -> int:
+        return sum(count for stack, count in self.stacks.items() if stack and _is_idle(stack[-1]))
+
+    def write(self, directory: str = ".", label: str = "refresh") -> ProfileReport:
+        stamp = datetime.datetime.now(tz=datetime.UTC).strftime("%Y%m%dT%H%M%S")
+        path = os.path.join(directory, f"profile-{label}-{stamp}.folded")
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(";".join(s.replace(";", ":") for s in stack) + f" {count}\n")
+        return ProfileReport(path, self.samples, self.idle_samples(), (self._stopped or time.perf_counter()) - self._started, self.self_time())
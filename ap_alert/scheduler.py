@@ -0,0 +1,171 @@
+"""
+Priority scheduler for messages we send to Discord.
+
+Interaction responses, new item DMs and everything else share one global rate limit.  Lower priority sends wait while
+anything more important is queued, and everything is paced by a global token bucket plus one bucket per route (channel),
+so the bulk DMs from `refresh_all` never starve a button click.  Commands send their follow-ups at interaction priority;
+their first response goes through the interaction webhook and isn't scheduled.
+"""
+import asyncio
+import enum
+import math
+import time
+
+import attrs
+
+from ap_alert.metrics import SCHEDULER_WAIT_SECONDS
+from shared import configuration
+
+configuration.DEFAULTS["discord_global_rate"] = 40
+configuration.DEFAULTS["discord_route_rate"] = 1.0
+configuration.DEFAULTS["discord_route_burst"] = 5
+configuration.DEFAULTS["interaction_grace_seconds"] = 2.0
+
+# An interaction that never reports back stops holding up bulk sends after this long.
+INTERACTION_TIMEOUT = 15.0
+
+
+class Priority(enum.IntEnum):
+    interaction = 0
+    items = 1
+    bulk = 2
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    @property
+    def full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+@attrs.define(eq=False)
+class Waiter:
+    priority: Priority
+    bucket: TokenBucket | None
+    event: asyncio.Event = attrs.field(factory=asyncio.Event)
+    wake_at: float = math.inf  # when the waiter will look again by itself
+
+
+class SendScheduler:
+    def __init__(self, global_rate: float = 40, route_rate: float = 1.0, route_burst: float = 5, interaction_grace: float = 2.0) -> None:
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.route_rate = route_rate
+        self.route_burst = route_burst
+        self.interaction_grace = interaction_grace
+        self.routes: dict[str, TokenBucket] = {}
+        self.waiting: dict[Priority, int] = {p: 0 for p in Priority}
+        self.waiters: dict[Waiter, None] = {}  # in arrival order
+        self.interactions = 0
+        self.interaction_until = 0.0
+
+    @classmethod
+    def from_config(cls) -> "SendScheduler":
+        return cls(
+            configuration.get_float("discord_global_rate"),
+            configuration.get_float("discord_route_rate"),
+            configuration.get_float("discord_route_burst"),
+            configuration.get_float("interaction_grace_seconds"),
+        )
+
+    def _wake(self) -> None:
+        """
+        Wake the waiters that can send now, and set timers for the ones that can send sooner than they'll look again.
+
+        Waiters that are still blocked are left alone, and no more are woken than there are global tokens to go round.
+        """
+        now = time.monotonic()
+        self.global_bucket._refill(now)
+        tokens = self.global_bucket.tokens
+        for waiter in sorted(self.waiters, key=lambda w: w.priority):
+            delay = self._delay(waiter.priority, waiter.bucket, now)
+            if delay is None or now + delay >= waiter.wake_at:
+                continue
+            if delay == 0.0:
+                if tokens < 1:
+                    continue
+                tokens -= 1
+                waiter.event.set()
+            else:
+                asyncio.get_running_loop().call_later(delay, waiter.event.set)
+            waiter.wake_at = now + delay
+
+    def interaction_started(self) -> None:
+        self.interactions += 1
+        self.interaction_until = max(self.interaction_until, time.monotonic() + INTERACTION_TIMEOUT)
+
+    def interaction_finished(self) -> None:
+        self.interactions = max(0, self.interactions - 1)
+        if not self.interactions:
+            self.interaction_until = time.monotonic() + self.interaction_grace
+            self._wake()
+
+    def _route(self, route: str | None) -> TokenBucket | None:
+        if route is None:
+            return None
+        bucket = self.routes.get(route)
+        if bucket is None:
+            if len(self.routes) > 10_000:
+                self.routes = {k: v for k, v in self.routes.items() if not v.full}
+            bucket = self.routes[route] = TokenBucket(self.route_rate, self.route_burst)
+        return bucket
+
+    def _blocked(self, priority: Priority, now: float) -> float | None:
+        """How long to wait before `priority` may send, or None to wait until something changes."""
+        if any(self.waiting[p] for p in Priority if p < priority):
+            return None
+        if priority > Priority.interaction and now < self.interaction_until:
+            return self.interaction_until - now
+        return 0.0
+
+    def _delay(self, priority: Priority, bucket: TokenBucket | None, now: float) -> float | None:
+        delay = self._blocked(priority, now)
+        if delay == 0.0:
+            delay = max(self.global_bucket.delay(now), bucket.delay(now) if bucket else 0.0)
+        return delay
+
+    async def acquire(self, priority: Priority, route: str | None = None) -> None:
+        """Wait for permission to send one message on `route`."""
+        start = time.monotonic()
+        waiter = Waiter(priority, self._route(route))
+        self.waiters[waiter] = None
+        self.waiting[priority] += 1
+        try:
+            while True:
+                now = time.monotonic()
+                delay = self._delay(priority, waiter.bucket, now)
+                if delay == 0.0:
+                    self.global_bucket.take()
+                    if waiter.bucket:
+                        waiter.bucket.take()
+                    return
+                waiter.event.clear()
+                waiter.wake_at = math.inf if delay is None else now + delay
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), timeout=delay)
+                except TimeoutError:
+                    pass
+        finally:
+            del self.waiters[waiter]
+            self.waiting[priority] -= 1
+            self._wake()
+            SCHEDULER_WAIT_SECONDS.observe(time.monotonic() - start, priority=priority.name)
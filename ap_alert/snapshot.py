@@ -0,0 +1,285 @@
+"""
+Binary snapshots of trackers, multiworlds and players, loaded lazily.
+
+A snapshot is a single file: a header, an index giving the position of every record, and then the records.  A record
+is one user's trackers, one multiworld or one player.  Each record is packed with msgpack on its own.  If
+`snapshot_compression` is "zstd" and `zstandard` is installed, each record is also compressed on its own.
+
+Loading only reads the index.  `LazyMapping` unpacks and structures a record the first time it's looked up, so
+startup time doesn't grow with the amount of state.  Records that were never looked up are copied byte for byte into
+the next snapshot.
+
+The JSON files (`trackers.json`, `cheese.json`, `players.json`) are still read if they're newer than the snapshot,
+which is how existing installs migrate.  They're also what gets written with `snapshot_format` set to "json".
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections.abc import MutableMapping
+from typing import Any, Callable, Iterator
+
+import attrs
+import msgpack
+import sentry_sdk
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from ap_alert.converter import converter
+from shared import configuration
+
+configuration.DEFAULTS["snapshot_format"] = "msgpack"  # or "json"
+configuration.DEFAULTS["snapshot_compression"] = "zstd"  # only used if zstandard is installed; "none" to turn it off
+
+SNAPSHOT = "state.snapshot"
+JSON_FILES = {"trackers": "trackers.json", "multiworlds": "cheese.json", "players": "players.json"}
+KINDS = tuple(JSON_FILES)
+
+MAGIC = b"MWTB"
+VERSION = 1
+HEADER = struct.Struct("<4sBBQQ")  # magic, version, compression, index offset, index length
+UNCOMPRESSED, ZSTD = 0, 1
+
+_codecs = threading.local()  # zstandard contexts can't be shared between threads
+
+
+def compression() -> int:
+    if zstandard is not None and configuration.get_str("snapshot_compression") == "zstd":
+        return ZSTD
+    return UNCOMPRESSED
+
+
+def pack(document: Any, method: int) -> bytes:
+    data = msgpack.packb(document)
+    if method == ZSTD:
+        if not hasattr(_codecs, "compressor"):
+            _codecs.compressor = zstandard.ZstdCompressor()
+        data = _codecs.compressor.compress(data)
+    return data
+
+
+def unpack(data: bytes, method: int) -> Any:
+    if method == ZSTD:
+        if not hasattr(_codecs, "decompressor"):
+            _codecs.decompressor = zstandard.ZstdDecompressor()
+        data = _codecs.decompressor.decompress(data)
+    return msgpack.unpackb(data, strict_map_key=False)
+
+
+class Snapshot:
+    """A snapshot file mapped into memory.  Only the index is read when it's opened."""
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            # The mapping outlives the file being replaced by the next snapshot.
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.compression, index_offset, index_length = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} snapshot")
+        if self.compression == ZSTD and zstandard is None:
+            raise ValueError(f"{path} is compressed with zstd, but zstandard isn't installed")
+        index = msgpack.unpackb(self.data[index_offset : index_offset + index_length])
+        self.index: dict[str, dict[str, tuple[int, int]]] = {kind: {key: (offset, length) for key, offset, length in entries} for kind, entries in index.items()}
+
+    @classmethod
+    def open(cls, path: str = SNAPSHOT) -> "Snapshot | None":
+        if not os.path.exists(path) or not os.path.getsize(path):
+            return None
+        return cls(path)
+
+    def packed(self, location: tuple[int, int]) -> bytes:
+        offset, length = location
+        return self.data[offset : offset + length]
+
+    def unpack(self, location: tuple[int, int]) -> Any:
+        return unpack(self.packed(location), self.compression)
+
+
+@attrs.frozen()
+class Stored:
+    """A record still in a snapshot, copied as is when the compression matches."""
+
+    snapshot: Snapshot
+    location: tuple[int, int]
+
+    def packed(self, method: int) -> bytes:
+        if self.snapshot.compression == method:
+            return self.snapshot.packed(self.location)
+        return pack(self.snapshot.unpack(self.location), method)
+
+
+class RawRecords(MutableMapping):
+    """The raw documents of one kind of record, unpacked on first access.  Changes are kept in memory."""
+
+    def __init__(self, snapshot: Snapshot | None, kind: str) -> None:
+        self.snapshot = snapshot
+        self.kind = kind
+        self.stored: dict[str, tuple[int, int]] = dict(snapshot.index.get(kind, {})) if snapshot else {}
+        self.changed: dict[str, Any] = {}
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.changed:
+            return self.changed[key]
+        location = self.stored.pop(key)
+        # Moved over, so changes made to the document in place are kept.
+        document = self.changed[key] = self.snapshot.unpack(location)
+        return document
+
+    def __setitem__(self, key: str, document: Any) -> None:
+        self.stored.pop(key, None)
+        self.changed[key] = document
+
+    def __delitem__(self, key: str) -> None:
+        if self.changed.pop(key, attrs.NOTHING) is attrs.NOTHING:
+            del self.stored[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.changed or key in self.stored
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.changed) + list(self.stored))
+
+    def __len__(self) -> int:
+        return len(self.changed) + len(self.stored)
+
+    def entries(self) -> dict[str, Any]:
+        """Every record, as a document or as `Stored`, ready for `write`."""
+        entries: dict[str, Any] = {key: Stored(self.snapshot, location) for key, location in self.stored.items()}
+        entries.update(self.changed)
+        return entries
+
+    def rebase(self, snapshot: Snapshot) -> None:
+        """Point records that haven't been loaded at a newer snapshot, so the old file can be released."""
+        index = snapshot.index.get(self.kind, {})
+        self.stored = {key: index[key] for key in self.stored if key in index}
+        self.snapshot = snapshot
+
+
+class LazyMapping(MutableMapping):
+    """
+    Structured objects backed by `RawRecords`, each one structured the first time it's looked up.
+
+    Iterating over the values structures everything, so code that only needs some of them should look them up by key.
+    """
+
+    def __init__(self, records: RawRecords, key_type: type, value_type: Any, on_load: Callable[[Any], None] | None = None) -> None:
+        self.records = records
+        self.value_type = value_type
+        self.on_load = on_load
+        self.loaded: dict[Any, Any] = {}
+        self.unloaded: dict[Any, str] = {key_type(key): key for key in records}  # key -> key in records
+        self.deleted: set = set()  # removed before they were ever loaded; drained by the journal
+
+    def __getitem__(self, key: Any) -> Any:
+        try:
+            return self.loaded[key]
+        except KeyError:
+            pass
+        record_key = self.unloaded[key]
+        value = converter.structure(self.records[record_key], self.value_type)
+        del self.unloaded[key], self.records[record_key]
+        self.loaded[key] = value
+        if self.on_load:
+            self.on_load(value)
+        return value
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        if key in self.unloaded:
+            self.records.pop(self.unloaded.pop(key), None)
+        self.loaded[key] = value
+
+    def __delitem__(self, key: Any) -> None:
+        if key in self.unloaded:
+            self.records.pop(self.unloaded.pop(key), None)
+            self.deleted.add(key)
+        else:
+            del self.loaded[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.loaded or key in self.unloaded
+
+    def __iter__(self) -> Iterator:
+        return iter(list(self.loaded) + list(self.unloaded))
+
+    def __len__(self) -> int:
+        return len(self.loaded) + len(self.unloaded)
+
+    def entries(self) -> dict[str, Any]:
+        """Unstructured documents for what's loaded, and the records as they are for everything else."""
+        entries = self.records.entries()
+        entries.update({str(key): converter.unstructure(value, unstructure_as=self.value_type) for key, value in self.loaded.items()})
+        return entries
+
+
+def read_json(kind: str) -> dict:
+    path = JSON_FILES[kind]
+    for candidate in (path, path + ".bak"):
+        if not os.path.exists(candidate):
+            continue
+        try:
+            with open(candidate) as f:
+                return json.loads(f.read())
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+            logging.error(f"Failed to read {candidate}: {e}")
+    return {}
+
+
+def read() -> dict[str, MutableMapping]:
+    """The raw records of each kind, from the snapshot or from the JSON files, whichever was written last."""
+    snapshot = None
+    try:
+        snapshot = Snapshot.open()
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        logging.error(f"Failed to open {SNAPSHOT}: {e}")
+    json_mtime = max((os.path.getmtime(path) for path in JSON_FILES.values() if os.path.exists(path)), default=0)
+    if snapshot is not None and os.path.getmtime(SNAPSHOT) >= json_mtime:
+        return {kind: RawRecords(snapshot, kind) for kind in KINDS}
+    return {kind: read_json(kind) for kind in KINDS}
+
+
+def write_json(kind: str, document: dict) -> None:
+    path = JSON_FILES[kind]
+    with open(path + ".tmp", "w") as f:
+        f.write(json.dumps(document, separators=(",", ":")))
+    os.replace(path + ".tmp", path)
+
+
+def entries(mapping: MutableMapping, value_type: Any = None) -> dict[str, Any]:
+    """What `write` needs for `mapping`: structured objects are unstructured as `value_type`, raw documents kept."""
+    if isinstance(mapping, (LazyMapping, RawRecords)):
+        return mapping.entries()
+    if value_type is None:
+        return {str(key): document for key, document in mapping.items()}
+    return {str(key): converter.unstructure(value, unstructure_as=value_type) for key, value in mapping.items()}
+
+
+def write(state: dict[str, dict[str, Any]], path: str = SNAPSHOT) -> None:
+    """
+    Write a snapshot from `entries()` of each kind.
+
+    Packing and compressing happens here, so this is the part to run in a thread.
+    """
+    method = compression()
+    index: dict[str, list] = {}
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, method, 0, 0))
+        offset = HEADER.size
+        for kind, records in state.items():
+            index[kind] = []
+            for key, record in records.items():
+                data = record.packed(method) if isinstance(record, Stored) else pack(record, method)
+                f.write(data)
+                index[kind].append((key, offset, len(data)))
+                offset += len(data)
+        packed_index = msgpack.packb(index)
+        f.write(packed_index)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, method, offset, len(packed_index)))
+    os.replace(path + ".tmp", path)
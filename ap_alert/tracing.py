@@ -0,0 +1,159 @@
+"""
+Stage-level tracing for the polling pipeline.
+
+Spans are sent to Sentry, and optionally appended to a local JSON lines file for offline analysis.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Iterator
+
+import attrs
+import sentry_sdk
+
+from shared import configuration
+
+configuration.DEFAULTS["trace_file"] = ""
+configuration.DEFAULTS["trace_file_sample_rate"] = 0.05
+
+
+@attrs.define()
+class SpanRecord:
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    op: str
+    name: str
+    tags: dict[str, Any]
+    start: float
+    duration: float = 0.0
+    error: str | None = None
+    children: list["SpanRecord"] = attrs.field(factory=list, repr=False)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "op": self.op,
+            "name": self.name,
+            "tags": self.tags,
+            "start": self.start,
+            "duration": self.duration,
+            "error": self.error,
+        }
+
+
+class Span:
+    """Handle yielded by `span` and `transaction`; tags are applied to both Sentry and the local record."""
+
+    def __init__(self, sentry_span: Any, record: SpanRecord | None) -> None:
+        self.sentry_span = sentry_span
+        self.record = record
+
+    def set_tag(self, key: str, value: Any) -> None:
+        if value is None:
+            return
+        self.sentry_span.set_tag(key, value)
+        if self.record is not None:
+            self.record.tags[key] = value
+
+
+_current: contextvars.ContextVar[SpanRecord | None] = contextvars.ContextVar("current_span", default=None)
+_trace_file: str | None = None
+_file_sample_rate: float = 0.0
+
+
+def configure() -> None:
+    """Read the local export settings.  Called once at startup, so lookups stay off the hot path."""
+    global _trace_file, _file_sample_rate
+    _trace_file = configuration.get("trace_file") or None
+    _file_sample_rate = configuration.get_float("trace_file_sample_rate")
+
+
+def _new_id() -> str:
+    return os.urandom(8).hex()
+
+
+def _flatten(record: SpanRecord) -> Iterator[SpanRecord]:
+    yield record
+    for child in record.children:
+        yield from _flatten(child)
+
+
+def _export(root: SpanRecord) -> None:
+    if not _trace_file:
+        return
+    try:
+        with open(_trace_file, "a") as f:
+            for record in _flatten(root):
+                f.write(json.dumps(record.as_dict(), default=str) + "\n")
+    except OSError as e:
+        logging.error(f"Failed to write spans to {_trace_file}: {e}")
+
+
+@contextlib.contextmanager
+def _run(sentry_cm: Any, record: SpanRecord | None) -> Iterator[Span]:
+    token = _current.set(record) if record is not None else None
+    start = time.perf_counter()
+    try:
+        with sentry_cm as sentry_span:
+            handle = Span(sentry_span, record)
+            for k, v in (record.tags if record else {}).items():
+                sentry_span.set_tag(k, v)
+            yield handle
+    except BaseException as e:
+        if record is not None:
+            record.error = type(e).__name__
+        raise
+    finally:
+        if record is not None:
+            record.duration = time.perf_counter() - start
+            _current.reset(token)
+
+
+def set_tags(**tags: Any) -> None:
+    """Tag the innermost active span."""
+    sentry_span = sentry_sdk.get_current_span()
+    record = _current.get()
+    for k, v in tags.items():
+        if v is None:
+            continue
+        if sentry_span is not None:
+            sentry_span.set_tag(k, v)
+        if record is not None:
+            record.tags[k] = v
+
+
+@contextlib.contextmanager
+def transaction(op: str, name: str, **tags: Any) -> Iterator[Span]:
+    """Start a root span.  Sentry sampling is decided by the SDK, local export by `trace_file_sample_rate`."""
+    record = None
+    if _trace_file and random.random() < _file_sample_rate:
+        record = SpanRecord(_new_id(), _new_id(), None, op, name, {k: v for k, v in tags.items() if v is not None}, time.time())
+    try:
+        with _run(sentry_sdk.start_transaction(op=op, name=name), record) as handle:
+            yield handle
+    finally:
+        if record is not None:
+            _export(record)
+
+
+@contextlib.contextmanager
+def span(op: str, name: str | None = None, **tags: Any) -> Iterator[Span]:
+    """Start a child span of the current span."""
+    parent = _current.get()
+    record = None
+    if parent is not None:
+        merged = dict(parent.tags)
+        merged.update({k: v for k, v in tags.items() if v is not None})
+        record = SpanRecord(parent.trace_id, _new_id(), parent.span_id, op, name or op, merged, time.time())
+        parent.children.append(record)
+    with _run(sentry_sdk.start_span(op=op, name=name or op), record) as handle:
+        for k, v in tags.items():
+            handle.set_tag(k, v)
+        yield handle
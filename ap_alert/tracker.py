@@ -8,6 +8,8 @@ import random
 import re
 import itertools
 import shutil
+import time
+from typing import AsyncIterator
 
 import aiofiles
 import sentry_sdk
@@ -16,8 +18,10 @@ from interactions import (
     Activity,
     ActivityType,
     BaseTrigger,
+    ChannelType,
     Client,
     ComponentContext,
+    DM,
     Extension,
     InteractionContext,
     SlashContext,
@@ -28,7 +32,8 @@ from interactions import (
     spread_to_rows,
 )
 from interactions.client.errors import Forbidden, NotFound
-from interactions.ext.paginators import Paginator
+from interactions.client.smart_cache import TTLCache
+from interactions.ext.paginators import Page, Paginator
 from interactions.models.discord import User, Embed, Message, Member
 from interactions.models.discord.components import Button, ContainerComponent, TextDisplayComponent
 from interactions.models.discord.enums import ButtonStyle
@@ -39,15 +44,28 @@ from requests.structures import CaseInsensitiveDict
 from .models.network_item import NetworkItem
 
 from .models.tracked_game import TrackedGame
+from .models.inventory import CLASSIFICATION_VERSIONS, classification_changed
 
 from .models.enums import CompletionStatus, Filters, HintFilters, ProgressionStatus
 
 from .models.player import Player
-from ap_alert.converter import converter
+from ap_alert.converter import MULTIWORLDS, PLAYERS, TRACKERS, converter
+from shared import configuration, metrics as shared_metrics, startup
 from shared.exceptions import BadAPIKeyException
 
 from . import external_data
+from . import journal
+from . import snapshot
+from . import tracing
+from .profiler import SamplingProfiler
+from .tracing import set_tags, span, transaction
+from .outbox import Notification, Outbox, Undeliverable
+from .scheduler import Priority, SendScheduler
+from .classification import ClassificationQueue
+from .tracker_index import TrackerIndex
+from .metrics import CYCLE_SECONDS, CYCLE_USERS_PENDING, DISCORD_SEND_SECONDS, TRACKER_SECONDS, TRACKERS_PROCESSED, record_error
 from .multiworld import (
+    CHEESE_URL,
     GAMES,
     Datapackage,
     ItemClassification,
@@ -58,6 +76,14 @@ from .worlds import TRACKERS
 task_logger = logging.getLogger("ap_alert.tasks")
 task_logger.setLevel(logging.INFO)
 
+configuration.DEFAULTS["profile_trackers"] = 0
+configuration.DEFAULTS["user_refresh_hours"] = 24
+configuration.DEFAULTS["refresh_batch_size"] = 100
+configuration.DEFAULTS["tracker_index_seconds"] = 600
+configuration.DEFAULTS["tracker_index_limit"] = 1000
+configuration.DEFAULTS["dashboard_cache_seconds"] = 600
+configuration.DEFAULTS["dashboard_cache_limit"] = 1000
+
 regex_dash = re.compile(r"dash:(-?\d+)")
 regex_unblock = re.compile(r"unblock:(\d+)")
 regex_remove = re.compile(r"remove:(-?\d+)")
@@ -67,6 +93,8 @@ regex_inv = re.compile(r"inv:(-?\d+)")
 regex_settings = re.compile(r"settings:(-?\d+)")
 regex_filter = re.compile(r"filter:(\d+|default):(-?\d+)")
 regex_hint_filter = re.compile(r"hint_filter:(\d+|default):(-?\d+)")
+regex_classify = re.compile(r"classify:(\w+):([0-9a-f]+)")
+regex_classify_prompt = re.compile(r"^\[(.+?)\] What kind of item is (.+)\?$", re.DOTALL)
 
 
 class APTracker(Extension):
@@ -78,7 +106,26 @@ class APTracker(Extension):
         self.cheese: dict[str, Multiworld] = CaseInsensitiveDict()
         self.datapackages: dict[str, Datapackage] = CaseInsensitiveDict()
         self.players: dict[int, Player] = {}
-        self.load()
+        # Indexes hold their trackers, so only recently used ones are kept.  Evicted ones are rebuilt from the database.
+        self.indexes: TTLCache[int, TrackerIndex] = TTLCache(
+            ttl=max(1, configuration.get_int("tracker_index_seconds")),
+            soft_limit=0,
+            hard_limit=configuration.get_int("tracker_index_limit"),
+        )
+        # Rendered dashboards, keyed by (url, viewer).  Only recently viewed ones are kept.
+        self.dashboards: TTLCache[tuple[str, int], tuple[tuple, list[Embed], list[ActionRow]]] = TTLCache(
+            ttl=max(1, configuration.get_int("dashboard_cache_seconds")),
+            soft_limit=0,
+            hard_limit=configuration.get_int("dashboard_cache_limit"),
+        )
+        self.metrics_server = None
+        self.profiler: SamplingProfiler | None = None
+        self.profile_remaining = 0  # trackers left to profile, -1 for the rest of the cycle
+        self.profile_requested_by: User | None = None
+        self.journal = journal.Journal(self.rebase_snapshot) if configuration.get_str("persistence_mode") == "journal" else None
+        self.warm_up_task: asyncio.Task | None = None
+        with startup.phase("state_load"):
+            self.load()
         try:
             from ap_alert.database import DATABASE
 
@@ -87,6 +134,28 @@ class APTracker(Extension):
             logging.error(f"Failed to initialize database: {e}")
             sentry_sdk.capture_exception(e)
             self.database = None
+        self.outbox = Outbox(
+            self.deliver,
+            store=self.database,
+            workers=configuration.get_int("outbox_workers"),
+            max_attempts=configuration.get_int("outbox_max_attempts"),
+            coalesce_window=configuration.get_float("notification_coalesce_seconds"),
+        )
+        self.scheduler = SendScheduler.from_config()
+        self.classifications = ClassificationQueue(self.ask_classification, self.retract_classification)
+        self.add_extension_prerun(self.interaction_started)
+        self.add_extension_postrun(self.interaction_finished)
+
+    async def interaction_started(self, _ctx, *_args, **_kwargs) -> None:
+        self.scheduler.interaction_started()
+
+    async def interaction_finished(self, _ctx, *_args, **_kwargs) -> None:
+        self.scheduler.interaction_finished()
+
+    async def follow_up(self, target: InteractionContext | User | Member) -> None:
+        """Wait for a slot to send a message in answer to a command, ahead of item DMs and bulk sends."""
+        route = f"dm:{target.id}" if isinstance(target, (User, Member)) else f"interaction:{target.channel_id}"
+        await self.scheduler.acquire(Priority.interaction, route)
 
     async def get_player_settings(self, id: int) -> Player:
         if self.database:
@@ -103,21 +172,41 @@ class APTracker(Extension):
         return player
 
     async def get_trackers(self, discord_id: int) -> list[TrackedGame]:
-        all_trackers = []
+        return list(await self.tracker_index(discord_id))
+
+    async def tracker_index(self, discord_id: int) -> TrackerIndex:
+        """The user's trackers.  Loaded from the database on first use, then kept up to date in memory."""
+        index = self.indexes.get(discord_id)
+        if index is not None:
+            return index
 
+        all_trackers = []
+        complete = True
         if self.database:
             try:
                 all_trackers.extend(await self.database.fetch_trackers_for_user(discord_id))
             except Exception as e:
                 task_logger.error(f"Failed to fetch trackers for user {discord_id}: {e}")
+                complete = False
         urls = set(t.url for t in all_trackers)
-        for tracker in self.trackers.get(discord_id, []):
+        for tracker in self.trackers.get(discord_id, []).copy():
             if tracker.url not in urls:
                 all_trackers.append(tracker)
                 urls.add(tracker.url)
             else:
                 self.trackers[discord_id].remove(tracker)
-        return all_trackers
+        index = TrackerIndex(all_trackers)
+        if complete:
+            self.indexes[discord_id] = index
+        return index
+
+    async def find_tracker(self, discord_id: int, cheese_id: int) -> TrackedGame | None:
+        return (await self.tracker_index(discord_id)).find(cheese_id)
+
+    async def load_state(self, *trackers: TrackedGame) -> None:
+        """Make sure checks, hints and the notification queue are in memory before they're used."""
+        if self.database:
+            await self.database.ensure_state(*trackers)
 
     @property
     def user_count(self):
@@ -137,16 +226,170 @@ class APTracker(Extension):
 
     @listen()
     async def on_startup(self) -> None:
-        await external_data.load_all(self.datapackages)
-        for _user, trackers in self.trackers.items():
-            for tracker in trackers:
-                await self.check_for_dp(tracker)
+        tracing.configure()
+        await self.start_metrics_server()
+        self.expire_classifications.start()
+        activity = Activity(name=f"{self.tracker_count} slots across {self.user_count} users", type=ActivityType.WATCHING)
+        await self.bot.change_presence(activity=activity)
+        # Commands work from here on.  Everything slow happens in the background.
+        startup.mark("ready")
+        self.stats["startup"] = startup.timeline()
+        self.warm_up_task = asyncio.create_task(self.warm_up())
+
+    async def warm_up(self) -> None:
+        """The slow part of startup: the database, world_data and datapackages, and then the first poll."""
+        for result in await asyncio.gather(self.connect_database(), self.load_datapackages(), return_exceptions=True):
+            if isinstance(result, Exception):
+                logging.error(f"Startup step failed: {result}")
+                sentry_sdk.capture_exception(result)
         self.refresh_all.start()
+        with startup.phase("first_poll"):
+            await self.refresh_all()
+        self.stats["startup"] = startup.timeline()
+        startup.report()
+
+    async def connect_database(self) -> None:
+        with startup.phase("db_connect"):
+            if self.database:
+                try:
+                    await self.database.ensure_indexes()
+                except Exception as e:
+                    logging.error(f"Failed to create database indexes: {e}")
+                    sentry_sdk.capture_exception(e)
+            try:
+                await self.outbox.restore()
+            except Exception as e:
+                logging.error(f"Failed to restore queued notifications: {e}")
+                sentry_sdk.capture_exception(e)
+        self.outbox.start()
+
+    async def load_datapackages(self) -> None:
+        with startup.phase("world_data_sync"):
+            await external_data.clone_repo()
+        with startup.phase("datapackage_load"):
+            await external_data.load_all(self.datapackages, sync=False)
+            for _user, trackers in self.trackers.items():
+                for tracker in trackers:
+                    await self.check_for_dp(tracker)
         # external_data.update_datapackage.start()
         await external_data.update_datapackage()
-        activity = Activity(name=f"{self.tracker_count} slots across {self.user_count} users", type=ActivityType.WATCHING)
-        await self.bot.change_presence(activity=activity)
-        await self.refresh_all()
+
+    async def start_metrics_server(self) -> None:
+        port = configuration.get_int("metrics_port")
+        if not port or self.metrics_server is not None:
+            return
+        try:
+            self.metrics_server = await shared_metrics.start_server(configuration.get("metrics_host"), port)
+        except OSError as e:
+            logging.error(f"Failed to start metrics server on port {port}: {e}")
+
+    async def notify(self, user_id: int, text: str) -> None:
+        await self.outbox.put(Notification(user_id, "text", text=text))
+
+    async def deliver(self, notifications: list[Notification]) -> None:
+        """
+        Send a batch of notifications for one user from the outbox, merged into as few messages as possible.
+
+        If sending fails part way, the number of messages already sent is recorded on the notifications, and the outbox
+        retries the same batch, so only the rest are sent.
+        """
+        settings = await self.get_player_settings(notifications[0].user_id)
+        kind = "digest" if len(notifications) > 1 else notifications[0].kind
+        priority = Priority.items if any(n.kind == "items" for n in notifications) else Priority.bulk
+        sent = notifications[0].sent
+        try:
+            channel = await self.dm_channel(settings)
+            for message in self.render_notifications(notifications)[sent:]:
+                await self.scheduler.acquire(priority, f"dm:{channel.id}")
+                with DISCORD_SEND_SECONDS.time(kind=kind), span("dm.send", kind=kind, notifications=len(notifications)):
+                    try:
+                        await channel.send(**message)
+                    except NotFound:
+                        # The stored channel is stale, so ask Discord for the current one.
+                        channel = await self.dm_channel(settings, force=True)
+                        await channel.send(**message)
+                sent += 1
+        except Forbidden as e:
+            record_error("deliver", e)
+            task_logger.error(f"Failed to send message to {settings} ({settings.id}) - DMs are closed")
+            await self.set_quiet_mode(settings, True)
+            raise Undeliverable() from e
+        except NotFound as e:
+            record_error("deliver", e)
+            task_logger.error(f"Failed to open a DM with {settings} ({settings.id})")
+            raise Undeliverable() from e
+        finally:
+            for notification in notifications:
+                notification.sent = sent
+        for notification in notifications:
+            if notification.kind == "classify":
+                try:
+                    await self.try_classify(settings.id, notification.slot(), notification.items)
+                except Exception as e:
+                    record_error("classify", e)
+                    task_logger.error(f"Failed to queue classifications for {notification.slot_name}", exc_info=e)
+
+    async def dm_channel(self, settings: Player, force: bool = False) -> DM:
+        """The player's DM channel.  Built from the stored channel id when we have one, which needs no REST calls."""
+        if settings.dm_channel_id and not force:
+            channel = self.bot.cache.get_channel(settings.dm_channel_id)
+            if channel is None:
+                channel = self.bot.cache.place_channel_data({"id": settings.dm_channel_id, "type": ChannelType.DM})
+                self.bot.cache.place_dm_channel_id(settings.id, settings.dm_channel_id)
+            return channel
+        channel = await self.bot.cache.fetch_dm_channel(settings.id, force=force)
+        if settings.dm_channel_id != channel.id:
+            settings.dm_channel_id = channel.id
+            if self.database:
+                await self.database.save_player(settings)
+        return channel
+
+    def render_notifications(self, notifications: list[Notification]) -> list[dict]:
+        """
+        Merge notifications into message payloads, grouped per slot.
+
+        Text is packed into as few messages as the 2000 character limit allows, and hint embeds ride along ten at a time.
+        """
+        slots: dict[str | None, Notification] = {}
+        items: dict[str | None, list[NetworkItem]] = defaultdict(list)
+        hints: dict[str | None, list[dict]] = defaultdict(list)
+        texts: list[str] = []
+        buttons: dict[str, Button] = {}
+        for n in notifications:
+            slots.setdefault(n.tracker_url, n)
+            if n.kind == "items":
+                items[n.tracker_url].extend(n.items)
+            elif n.kind == "hints":
+                hints[n.tracker_url].extend(n.embeds)
+            elif n.kind == "text" and n.text:
+                texts.append(n.text)
+        multiple_slots = len(set(items) | set(hints)) > 1
+        for url, slot_items in items.items():
+            slot = slots[url].slot()
+            texts.append(self.format_items(slot, slot_items))
+            if slot.filters == Filters.unset:
+                label = f"Filters: {plain_name(slot)}" if multiple_slots else "Configure Filters"
+                buttons[f"settings:{slot.cheese_id}"] = Button(style=ButtonStyle.GREY, label=label[:80], emoji="⚙️", custom_id=f"settings:{slot.cheese_id}")
+        embeds = []
+        for url, slot_embeds in hints.items():
+            slot = slots[url].slot()
+            for embed in slot_embeds:
+                embeds.append({**embed, "author": {"name": plain_name(slot)[:256]}} if multiple_slots else embed)
+            if slot.hint_filters == HintFilters.unset and f"settings:{slot.cheese_id}" not in buttons:
+                label = f"Hint Filters: {plain_name(slot)}" if multiple_slots else "Configure Hint Filters"
+                buttons[f"settings:{slot.cheese_id}"] = Button(style=ButtonStyle.GREY, label=label[:80], emoji="⚙️", custom_id=f"settings:{slot.cheese_id}")
+
+        contents = pack_text(texts)
+        embed_pages = [list(page) for page in chunk(embeds, 10)]
+        if embed_pages and not contents:
+            first = next(n for n in notifications if n.kind == "hints")
+            contents = ["New hints:" if multiple_slots else first.text or "New hints:"]
+        messages = []
+        for content, page in itertools.zip_longest(contents, embed_pages):
+            messages.append({"content": content, "embeds": page or []})
+        if messages and buttons:
+            messages[-1]["components"] = spread_to_rows(*list(buttons.values())[:25])
+        return messages
 
     @listen()
     async def on_disconnect(self) -> None:
@@ -175,7 +418,8 @@ class APTracker(Extension):
             return
 
         player_settings = await self.get_player_settings(ctx.author_id)
-        if player_settings.dm_channel_id != dm_channel.id:
+        changed = player_settings.update(ctx.author)
+        if player_settings.dm_channel_id != dm_channel.id or changed:
             player_settings.dm_channel_id = dm_channel.id
             if self.database:
                 await self.database.save_player(player_settings)
@@ -189,11 +433,9 @@ class APTracker(Extension):
 
         if url.split("/")[-1].isnumeric():
             # Track slot
-            for t in await self.get_trackers(ctx.author_id):
-                if t.url == url:
-                    tracker = t
-                    tracker.disabled = False
-                    break
+            tracker = (await self.tracker_index(ctx.author_id)).get(url)
+            if tracker is not None:
+                tracker.disabled = False
             else:
                 tracker = TrackedGame(url)
                 self.add_tracker(ctx.author_id, tracker)
@@ -203,7 +445,7 @@ class APTracker(Extension):
             if multiworld is None:
                 await ctx.send(f"An error has occurred.  Could not set up `{room}` with {url}", ephemeral=True)
                 return
-            await ctx.send(f"Setting up tracker for https://{multiworld.ap_hostname}/tracker/{room}...", ephemeral=ephemeral)
+            await ctx.send(f"Setting up tracker for {multiworld.ap_webhost}/tracker/{room}...", ephemeral=ephemeral)
             await multiworld.refresh()
             slot = multiworld.games[int(url.split("/")[-1])]
             tracker.game = slot["game"]
@@ -247,7 +489,9 @@ class APTracker(Extension):
         ephemeral = await defer_ephemeral_if_guild(ctx)
 
         games = {}
-        for tracker in await self.get_trackers(ctx.author_id):
+        trackers = await self.get_trackers(ctx.author_id)
+        await self.load_state(*trackers)
+        for tracker in trackers:
             _room, multiworld = await self.url_to_multiworld(tracker.multitracker_url)
             new_items = await multiworld.refresh_game(tracker)
             if new_items:
@@ -256,15 +500,19 @@ class APTracker(Extension):
                 await self.database.save_tracker(tracker)
             if tracker.failures >= 3:
                 await self.remove_tracker(ctx.author, tracker)
+                await self.follow_up(ctx.author)
                 await ctx.author.send(f"Tracker {tracker.url} has been removed due to errors")
                 await self.save()
 
         if not games:
+            await self.follow_up(ctx)
             await ctx.send("No new items", ephemeral=True)
             return
 
+        author_id = ctx.author_id
         n = 0
         for tracker, items in games.items():
+            await self.follow_up(ctx)
             await self.send_new_items(ctx, tracker, ephemeral=ephemeral)
             if self.database:
                 await self.database.save_tracker(tracker)
@@ -274,7 +522,46 @@ class APTracker(Extension):
                 ephemeral = False
 
         for tracker, items in games.items():
-            await self.try_classify(ctx, tracker, items, ephemeral=ephemeral)
+            await self.try_classify(author_id, tracker, items)
+
+    @ap.subcommand("profile")
+    @slash_option("trackers", "Number of trackers to profile (0 for the whole next cycle)", OptionType.INTEGER, required=False, min_value=0)
+    async def ap_profile(self, ctx: SlashContext, trackers: int = 0) -> None:
+        """Owner only: profile the next refresh cycle."""
+        if ctx.author_id not in configuration.get("owners"):
+            await ctx.send("This command is only available to the bot owners.", ephemeral=True)
+            return
+        self.profile_remaining = trackers or -1
+        self.profile_requested_by = ctx.author
+        target = f"the next {trackers} trackers" if trackers else "the next full cycle"
+        await ctx.send(f"Profiling {target}. I'll DM you the report.", ephemeral=True)
+
+    def start_profiler(self) -> None:
+        if self.profile_remaining and self.profiler is None:
+            task_logger.info("Starting sampling profiler")
+            self.profiler = SamplingProfiler()
+            self.profiler.start()
+
+    async def stop_profiler(self, tracker_done: bool = False) -> None:
+        if self.profiler is None:
+            return
+        if tracker_done:
+            if self.profile_remaining < 0:
+                return
+            self.profile_remaining -= 1
+            if self.profile_remaining > 0:
+                return
+        self.profile_remaining = 0
+        profiler, self.profiler = self.profiler, None
+        profiler.stop()
+        report = profiler.write(os.path.dirname(os.path.abspath("stats.json")))
+        task_logger.info(report.summary())
+        if self.profile_requested_by is not None:
+            try:
+                await self.profile_requested_by.send(report.summary()[:2000])
+            except Forbidden:
+                pass
+            self.profile_requested_by = None
 
     @ap.subcommand("authenticate")
     @slash_option("api_key", "Your Cheese Tracker API key", OptionType.STRING, required=True)
@@ -288,7 +575,7 @@ class APTracker(Extension):
         try:
             cheese_dash = await player.get_trackers()
         except BadAPIKeyException:
-            await ctx.send("That's not a valid API Key...  Please copy it directly from https://cheesetrackers.theincrediblewheelofchee.se/settings", ephemeral=True)
+            await ctx.send(f"That's not a valid API Key...  Please copy it directly from {CHEESE_URL}/settings", ephemeral=True)
             player.cheese_api_key = None
             if self.database:
                 await self.database.save_player(player)
@@ -297,65 +584,76 @@ class APTracker(Extension):
         for multiworld in cheese_dash:
             await self.sync_cheese(ctx.author, multiworld)
 
-    async def try_classify(self, ctx: SlashContext | User, tracker: TrackedGame, new_items: list[NetworkItem], ephemeral: bool = False) -> None:
+    async def try_classify(self, user_id: int, tracker: TrackedGame, new_items: list[NetworkItem]) -> None:
+        """Queue unclassified items so that someone who has them is asked about each one."""
         if tracker.game is None:
             return
-        unclassified = [i.name for i in new_items if i.classification in [ItemClassification.unknown, ItemClassification.bad_name]]
-        n = 0
+        unclassified = {i.name for i in new_items if i.classification in [ItemClassification.unknown, ItemClassification.bad_name]}
         for item in unclassified:
             if TRACKERS.get(tracker.game) and (classification := await TRACKERS[tracker.game].classify(tracker, item)):
                 if self.datapackages[tracker.game].set_classification(item, classification):
+                    classification_changed(tracker.game)
                     continue
+            await self.classifications.request(user_id, tracker.game, item)
+
+    async def ask_classification(self, user_id: int, game: str, item: str, key: str) -> tuple[int, int]:
+        trap = Button(style=ButtonStyle.RED, label="Trap", emoji=":x:", custom_id=f"classify:trap:{key}")
+        filler = Button(style=ButtonStyle.GREY, label="Filler", emoji="<:filler:1277502385459171338>", custom_id=f"classify:filler:{key}")
+        useful = Button(style=ButtonStyle.GREEN, label="Useful", emoji="<:useful:1277502389729103913>", custom_id=f"classify:useful:{key}")
+        progression = Button(style=ButtonStyle.BLUE, label="Progression", emoji="<:progression:1277502382682542143>", custom_id=f"classify:progression:{key}")
+        mcguffin = Button(style=ButtonStyle.BLUE, label="McGuffin", emoji=":sparkles:", custom_id=f"classify:mcguffin:{key}")
+        skip = Button(style=ButtonStyle.GREY, label="Skip", emoji=":track_next:", custom_id=f"classify:skip:{key}")
+        channel = await self.dm_channel(await self.get_player_settings(user_id))
+        await self.scheduler.acquire(Priority.bulk, f"dm:{channel.id}")
+        msg = await channel.send(
+            f"[{game}] What kind of item is {item}?",
+            components=spread_to_rows(trap, filler, useful, progression, mcguffin, skip),
+        )
+        return channel.id, msg.id
+
+    async def retract_classification(self, prompt: tuple[int, int]) -> None:
+        channel_id, message_id = prompt
+        channel = self.bot.cache.get_channel(channel_id) or self.bot.cache.place_channel_data({"id": channel_id, "type": ChannelType.DM})
+        try:
+            await channel.delete_message(message_id)
+        except (NotFound, Forbidden):
+            pass
+
+    @component_callback(regex_classify)
+    async def classify(self, ctx: ComponentContext) -> None:
+        choice, key = regex_classify.match(ctx.custom_id).groups()
+        entry = self.classifications.pending.get(key)
+        if entry is not None:
+            game, item = entry.game, entry.item
+        elif match := regex_classify_prompt.match(ctx.message.content or ""):
+            # Prompts outlive restarts; the message itself says what it was asking about.
+            game, item = match.groups()
+        else:
+            await ctx.send("This question has expired.", ephemeral=True)
+            return
 
-            trap = Button(style=ButtonStyle.RED, label="Trap", emoji=":x:")
-            filler = Button(style=ButtonStyle.GREY, label="Filler", emoji="<:filler:1277502385459171338>")
-            useful = Button(style=ButtonStyle.GREEN, label="Useful", emoji="<:useful:1277502389729103913>")
-            progression = Button(style=ButtonStyle.BLUE, label="Progression", emoji="<:progression:1277502382682542143>")
-            mcguffin = Button(style=ButtonStyle.BLUE, label="McGuffin", emoji=":sparkles:")
-            skip = Button(style=ButtonStyle.GREY, label="Skip", emoji=":track_next:")
-            msg = await ctx.send(
-                f"[{tracker.game}] What kind of item is {item}?",
-                ephemeral=ephemeral,
-                components=spread_to_rows(trap, filler, useful, progression, mcguffin, skip),
-            )
-            try:
-                chosen = await self.bot.wait_for_component(msg, timeout=3600)
-                if chosen is None:
-                    classification = ItemClassification.unknown
-                elif chosen.ctx.custom_id == filler.custom_id:
-                    classification = ItemClassification.filler
-                elif chosen.ctx.custom_id == useful.custom_id:
-                    classification = ItemClassification.useful
-                elif chosen.ctx.custom_id == progression.custom_id:
-                    classification = ItemClassification.progression
-                elif chosen.ctx.custom_id == trap.custom_id:
-                    classification = ItemClassification.trap
-                elif chosen.ctx.custom_id == mcguffin.custom_id:
-                    classification = ItemClassification.mcguffin
-                elif chosen.ctx.custom_id == skip.custom_id:
-                    classification = ItemClassification.unknown
-                else:
-                    print(f"wat: {chosen.ctx.custom_id}")
-                if tracker.game not in self.datapackages:
-                    self.datapackages[tracker.game] = Datapackage(items={})
-                self.datapackages[tracker.game].set_classification(item, classification)
-                await chosen.ctx.send(f"✅{item} is {classification}", ephemeral=True)
-                n += 1
-                if n > 3 and isinstance(ctx, InteractionContext):
-                    ctx = ctx.author
-                    ephemeral = False
-
-            except TimeoutError:
-                if not ephemeral:
-                    await msg.channel.delete_message(msg)
-                break
-            try:
-                if not ephemeral:
-                    await msg.channel.delete_message(msg)
-            except NotFound:
-                pass
-            except Forbidden:
-                pass
+        clicked = (ctx.channel_id, ctx.message.id)
+        if choice == "skip":
+            await ctx.send("Skipped", ephemeral=True)
+            if entry is None or entry.prompt != clicked:
+                await self.retract_classification(clicked)
+            if entry is not None:
+                await self.classifications.decline(key, ctx.author_id)
+            return
+
+        classification = ItemClassification[choice]
+        if game not in self.datapackages:
+            self.datapackages[game] = Datapackage(items={})
+        self.datapackages[game].set_classification(item, classification)
+        classification_changed(game)
+        await ctx.send(f"✅{item} is {classification}", ephemeral=True)
+        if entry is None or entry.prompt != clicked:
+            await self.retract_classification(clicked)
+        await self.classifications.resolve(key)
+
+    @Task.create(IntervalTrigger(minutes=5))
+    async def expire_classifications(self) -> None:
+        await self.classifications.expire()
 
     async def send_new_items(
         self,
@@ -363,47 +661,12 @@ class APTracker(Extension):
         tracker: TrackedGame,
         *,
         ephemeral: bool = False,
-        inventory: bool = False,
     ) -> Message | None:
-        async def icon(item: NetworkItem) -> str:
-            emoji = "❓"
-
-            classification = item.classification
-            if classification == ItemClassification.unknown and tracker.game in self.datapackages:
-                classification = self.datapackages[tracker.game].items.setdefault(item.name, ItemClassification.unknown)
-            if inventory and classification == ItemClassification.unknown:
-                await self.try_classify(ctx_or_user, tracker, new_items)
-                classification = self.datapackages[tracker.game].items[item.name]
-            if classification == ItemClassification.mcguffin:
-                emoji = ":sparkles:"
-            if classification == ItemClassification.filler:
-                emoji = "<:filler:1277502385459171338>"
-            if classification == ItemClassification.useful:
-                emoji = "<:useful:1277502389729103913>"
-            if classification == ItemClassification.progression or classification == ItemClassification.progression | ItemClassification.useful:
-                emoji = "<:progression:1277502382682542143>"
-            if classification == ItemClassification.trap:
-                emoji = ":x:"
-            if classification == ItemClassification.progression | ItemClassification.trap:
-                emoji = "<:prog_trap:1428702147435954237>"
-
-            if inventory or item.quantity > 1:
-                return f"{emoji} {item.name} x{item.quantity}"
-            return f"{emoji} {item.name}"
-
-        if inventory:
-            new_items = tracker.all_items.copy()
-            merged = Counter()
-            for item in new_items:
-                merged[(item.name, item.classification)] += item.quantity
-            new_items = [NetworkItem(name=k[0], game=tracker.game, quantity=v, flags=k[1]) for (k, v) in merged.items()]
-
-        else:
-            new_items = tracker.notification_queue.copy()
-
+        new_items = tracker.notification_queue.copy()
         tracker.notification_queue.clear()
+        tracker.mark_dirty("notification_queue")
 
-        names = [await icon(i) for i in new_items]
+        names = [self.item_label(tracker, i) for i in new_items]
         slot_name = tracker.name or tracker.url
 
         if len(names) == 1:
@@ -412,27 +675,7 @@ class APTracker(Extension):
                 components.append(Button(style=ButtonStyle.GREY, label="Configure Filters", emoji="⚙️", custom_id=f"settings:{tracker.cheese_id}"))
             await ctx_or_user.send(f"{slot_name}: {names[0]}", ephemeral=ephemeral, components=components)
         elif len(names) > 10:
-            text = f"{slot_name}:\n"
-            classes: dict[ItemClassification, list[NetworkItem]] = defaultdict(list)
-            classes.update(
-                {  # presort the keys
-                    ItemClassification.mcguffin: [],
-                    ItemClassification.progression: [],
-                    ItemClassification.unknown: [],
-                    ItemClassification.useful: [],
-                    ItemClassification.filler: [],
-                    ItemClassification.trap: [],
-                }
-            )
-
-            for item in new_items:
-                classification = item.classification
-                classes[classification].append(item)
-            for classification, items in classes.items():
-                if items:
-                    text += f"## {classification.name}:\n"
-                    text += "\n".join([await icon(i) for i in items]) + "\n"
-
+            text = self.format_items(tracker, new_items, names)
             if len(text) > 1900:
                 paginator = Paginator.create_from_string(self.bot, text)
                 if isinstance(ctx_or_user, (User, Member)):
@@ -443,9 +686,85 @@ class APTracker(Extension):
             else:
                 return await ctx_or_user.send(text, ephemeral=ephemeral)
         else:
-            return await ctx_or_user.send(f"{slot_name}: {', '.join(names)}", ephemeral=ephemeral)
+            return await ctx_or_user.send(self.format_items(tracker, new_items, names), ephemeral=ephemeral)
         return None
 
+    async def send_inventory(self, ctx: ComponentContext, tracker: TrackedGame) -> Message | None:
+        pages = self.inventory_pages(tracker)
+        if tracker.inventory.unknown:
+            await self.try_classify(ctx.author.id, tracker, tracker.inventory.unknown)
+        if len(pages) > 1:
+            paginator = Paginator(self.bot, pages=[Page(p) for p in pages])
+            return await paginator.send(ctx, ephemeral=True)
+        return await ctx.send(pages[0], ephemeral=True)
+
+    def inventory_pages(self, tracker: TrackedGame) -> list[str]:
+        """The slot's rendered inventory, re-rendered only after new items or classifications."""
+        inventory = tracker.inventory
+        if not inventory.is_stale(tracker.game):
+            return inventory.pages
+        items = inventory.items(tracker.game)
+        labels = [self.item_label(tracker, i, show_quantity=True) for i in items]
+        text = self.format_items(tracker, items, labels) if items else f"{tracker.name or tracker.url}: Nothing yet"
+        inventory.pages = [text] if len(text) <= 1900 else pack_text([text], 4000)
+        inventory.unknown = [i for i in items if self.item_classification(tracker, i) == ItemClassification.unknown]
+        inventory.rendered = inventory.key(tracker.game)
+        return inventory.pages
+
+    def item_classification(self, tracker: TrackedGame, item: NetworkItem) -> ItemClassification:
+        classification = item.classification
+        if classification == ItemClassification.unknown and tracker.game in self.datapackages:
+            classification = self.datapackages[tracker.game].items.setdefault(item.name, ItemClassification.unknown)
+        return classification
+
+    def item_label(self, tracker: TrackedGame, item: NetworkItem, show_quantity: bool = False) -> str:
+        emoji = "❓"
+        classification = self.item_classification(tracker, item)
+        if classification == ItemClassification.mcguffin:
+            emoji = ":sparkles:"
+        if classification == ItemClassification.filler:
+            emoji = "<:filler:1277502385459171338>"
+        if classification == ItemClassification.useful:
+            emoji = "<:useful:1277502389729103913>"
+        if classification == ItemClassification.progression or classification == ItemClassification.progression | ItemClassification.useful:
+            emoji = "<:progression:1277502382682542143>"
+        if classification == ItemClassification.trap:
+            emoji = ":x:"
+        if classification == ItemClassification.progression | ItemClassification.trap:
+            emoji = "<:prog_trap:1428702147435954237>"
+
+        if show_quantity or item.quantity > 1:
+            return f"{emoji} {item.name} x{item.quantity}"
+        return f"{emoji} {item.name}"
+
+    def format_items(self, tracker: TrackedGame, items: list[NetworkItem], labels: list[str] | None = None) -> str:
+        """A slot's items as one line, or grouped by classification when there are more than ten."""
+        if labels is None:
+            labels = [self.item_label(tracker, i) for i in items]
+        slot_name = tracker.name or tracker.url
+        if len(items) <= 10:
+            return f"{slot_name}: {', '.join(labels)}"
+
+        text = f"{slot_name}:\n"
+        classes: dict[ItemClassification, list[str]] = defaultdict(list)
+        classes.update(
+            {  # presort the keys
+                ItemClassification.mcguffin: [],
+                ItemClassification.progression: [],
+                ItemClassification.unknown: [],
+                ItemClassification.useful: [],
+                ItemClassification.filler: [],
+                ItemClassification.trap: [],
+            }
+        )
+        for item, label in zip(items, labels):
+            classes[item.classification].append(label)
+        for classification, group in classes.items():
+            if group:
+                text += f"## {classification.name}:\n"
+                text += "\n".join(group) + "\n"
+        return text
+
     @ap.subcommand("dashboard")
     async def ap_dashboard(self, ctx: SlashContext) -> None:
         await ctx.defer(ephemeral=True)
@@ -488,12 +807,36 @@ class APTracker(Extension):
     async def dashboard_embed(self, ctx: ComponentContext) -> Embed:
         await ctx.defer(ephemeral=True)
         m = regex_dash.match(ctx.custom_id)
-        tracker = next((t for t in await self.get_trackers(ctx.author_id) if t.cheese_id == int(m.group(1))), None)
+        tracker = await self.find_tracker(ctx.author_id, int(m.group(1)))
         if tracker is None:
             return Embed(title="Game not found")
 
         multiworld = self.cheese.get(tracker.tracker_id)
+        if multiworld:
+            is_owner = multiworld.games[tracker.slot_id].get("effective_discord_username") == ctx.author.username
+            only_game = len([g for g in multiworld.games.values() if g.get("effective_discord_username") == ctx.author.username]) == 1
+        else:
+            is_owner = False
+            only_game = True
 
+        # version restarts at 0 whenever the tracker is loaded again, so revision tells those loads apart.
+        key = (
+            tracker.revision,
+            tracker.version,
+            tracker.inventory.revision,
+            CLASSIFICATION_VERSIONS[tracker.game],
+            multiworld and (multiworld.last_port, multiworld.room_link),
+            is_owner,
+            only_game,
+        )
+        cached = self.dashboards.get((tracker.url, ctx.author_id))
+        if cached is None or cached[0] != key:
+            embeds, components = await self.render_dashboard(tracker, multiworld, is_owner, only_game)
+            cached = self.dashboards[(tracker.url, ctx.author_id)] = (key, embeds, components)
+        _key, embeds, components = cached
+        return await ctx.send(embeds=embeds, components=components, ephemeral=True)
+
+    async def render_dashboard(self, tracker: TrackedGame, multiworld: Multiworld | None, is_owner: bool, only_game: bool) -> tuple[list[Embed], list[ActionRow]]:
         name = tracker.name
         if multiworld:
             port = f" ({multiworld.last_port})" if multiworld.last_port else ""
@@ -527,13 +870,6 @@ class APTracker(Extension):
         if multiworld and multiworld.room_link:
             components.append(Button(style=ButtonStyle.URL, label="Open Room", url=multiworld.room_link))
 
-        if multiworld:
-            is_owner = multiworld.games[tracker.slot_id].get("effective_discord_username") == ctx.author.username
-            only_game = len([g for g in multiworld.games.values() if g.get("effective_discord_username") == ctx.author.username]) == 1
-        else:
-            is_owner = False
-            only_game = True
-
         # aged = check_time < datetime.datetime.now(tz=datetime.UTC) - datetime.timedelta(days=1)
         if is_owner:
             if tracker.progression_status == ProgressionStatus.bk:
@@ -551,15 +887,17 @@ class APTracker(Extension):
         else:
             components.append(Button(style=ButtonStyle.GREY, label="Remove", emoji=":wastebasket:", custom_id=f"disable:{tracker.cheese_id}"))
         embeds = [embed]
+        if TRACKERS.get(tracker.game):
+            await self.load_state(tracker)
         if TRACKERS.get(tracker.game) and (dash := await TRACKERS[tracker.game].build_dashboard(tracker)):
             embeds.append(dash)
-        return await ctx.send(embeds=embeds, components=spread_to_rows(*components), ephemeral=True)
+        return embeds, spread_to_rows(*components)
 
     @component_callback(regex_remove)
     async def remove(self, ctx: ComponentContext) -> None:
         await ctx.defer(ephemeral=True)
         m = regex_remove.match(ctx.custom_id)
-        tracker = next((t for t in await self.get_trackers(ctx.author_id) if t.cheese_id == int(m.group(1))), None)
+        tracker = await self.find_tracker(ctx.author_id, int(m.group(1)))
         if tracker is None:
             return
         await self.remove_tracker(ctx.author_id, tracker)
@@ -569,7 +907,7 @@ class APTracker(Extension):
     async def disable(self, ctx: ComponentContext) -> None:
         await ctx.defer(ephemeral=True)
         m = regex_disable.match(ctx.custom_id)
-        tracker = next((t for t in await self.get_trackers(ctx.author_id) if t.cheese_id == int(m.group(1))), None)
+        tracker = await self.find_tracker(ctx.author_id, int(m.group(1)))
         if tracker is None:
             return
         tracker.disabled = True
@@ -579,7 +917,7 @@ class APTracker(Extension):
     async def unblock(self, ctx: ComponentContext) -> None:
         await ctx.defer(ephemeral=True)
         m = regex_unblock.match(ctx.custom_id)
-        tracker = next((t for t in await self.get_trackers(ctx.author_id) if t.cheese_id == int(m.group(1))), None)
+        tracker = await self.find_tracker(ctx.author_id, int(m.group(1)))
         if tracker is None:
             return
         multiworld = self.cheese[tracker.tracker_id]
@@ -596,7 +934,7 @@ class APTracker(Extension):
     async def still_bk(self, ctx: ComponentContext) -> None:
         await ctx.defer(ephemeral=True)
         m = regex_bk.match(ctx.custom_id)
-        tracker = next((t for t in await self.get_trackers(ctx.author_id) if t.cheese_id == int(m.group(1))), None)
+        tracker = await self.find_tracker(ctx.author_id, int(m.group(1)))
         if tracker is None:
             return
         multiworld = self.cheese[tracker.tracker_id]
@@ -612,19 +950,20 @@ class APTracker(Extension):
     async def inventory(self, ctx: ComponentContext) -> None:
         await ctx.defer(ephemeral=True)
         m = regex_inv.match(ctx.custom_id)
-        tracker = next((t for t in await self.get_trackers(ctx.author_id) if t.cheese_id == int(m.group(1))), None)
+        tracker = await self.find_tracker(ctx.author_id, int(m.group(1)))
         if tracker is None:
             return
         if not tracker.all_items:
+            await self.load_state(tracker)
             _room, multiworld = await self.url_to_multiworld(tracker.multitracker_url)
             await multiworld.refresh_game(tracker)
-        await self.send_new_items(ctx, tracker, ephemeral=True, inventory=True)
+        await self.send_inventory(ctx, tracker)
 
     @component_callback(regex_settings)
     async def settings(self, ctx: ComponentContext) -> None:
         await ctx.defer(ephemeral=True, edit_origin=False)
         m = regex_settings.match(ctx.custom_id)
-        tracker = next((t for t in await self.get_trackers(ctx.author_id) if t.cheese_id == int(m.group(1))), None)
+        tracker = await self.find_tracker(ctx.author_id, int(m.group(1)))
         if tracker is None:
             return
         multiworld = self.cheese[tracker.tracker_id]
@@ -686,7 +1025,7 @@ class APTracker(Extension):
             await ctx.send("Default filter updated", ephemeral=True)
             return
 
-        tracker = next((t for t in await self.get_trackers(ctx.author_id) if t.cheese_id == int(m.group(1))), None)
+        tracker = await self.find_tracker(ctx.author_id, int(m.group(1)))
         if tracker is None:
             return
         tracker.filters = Filters(int(m.group(2)))
@@ -704,7 +1043,7 @@ class APTracker(Extension):
             await ctx.send("Default hint filter updated", ephemeral=True)
             return
 
-        tracker = next((t for t in await self.get_trackers(ctx.author_id) if t.cheese_id == int(m.group(1))), None)
+        tracker = await self.find_tracker(ctx.author_id, int(m.group(1)))
         if tracker is None:
             return
         tracker.hint_filters = HintFilters(int(m.group(2)))
@@ -758,7 +1097,7 @@ class APTracker(Extension):
             components.append(Button(style=ButtonStyle.GREY, label="Quiet Mode: On", custom_id="quiet_mode:off", disabled=True))
         await ctx.send(components=components, ephemeral=True)
 
-    async def sync_cheese(self, player: User, room: str | Multiworld) -> tuple[Multiworld, bool]:
+    async def sync_cheese(self, player: User | Player, room: str | Multiworld) -> tuple[Multiworld, bool]:
         room, multiworld = await self.url_to_multiworld(room)
         if multiworld is None:
             return None, False
@@ -771,14 +1110,9 @@ class APTracker(Extension):
         is_mw_abandoned = multiworld.last_activity() < datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(days=30)
 
         for game in multiworld.games.values():
-            game["url"] = f'{multiworld.ap_scheme}://{multiworld.ap_hostname}/tracker/{room}/0/{game["position"]}'
+            game["url"] = f'{multiworld.ap_webhost}/tracker/{room}/0/{game["position"]}'
 
-            for t in await self.get_trackers(player.id):
-                if t.url == game["url"] or t.url == game["url"].replace("/tracker/", "/generic_tracker/"):
-                    tracker = t
-                    break
-            else:
-                tracker = None
+            tracker = (await self.tracker_index(player.id)).get(game["url"])
 
             if game.get("effective_discord_username") == player.username and tracker is None:
                 is_game_done = game["checks_done"] == game["checks_total"] or game.completion_status in [CompletionStatus.done, CompletionStatus.released]
@@ -804,13 +1138,7 @@ class APTracker(Extension):
                 if (game["checks_done"] == game["checks_total"] and game.completion_status == CompletionStatus.done) or game.completion_status == CompletionStatus.released:
                     # Removing needs an and, because 100% no goal can happen.
                     await self.remove_tracker(player, tracker)
-
-                    try:
-                        await player.send(f"Game {tracker.name} is complete")
-                    except Forbidden:
-                        print(f"Failed to send message to player {player} about completed game {tracker.name}")
-                        settings = await self.get_player_settings(player.id)
-                        await self.set_quiet_mode(settings, True)
+                    await self.notify(player.id, f"Game {tracker.name} is complete")
                     if self.database:
                         await self.database.save_tracker(tracker)
                     continue
@@ -818,11 +1146,11 @@ class APTracker(Extension):
                 if is_mw_abandoned:
                     last_check = format_relative_time(multiworld.last_activity())
                     await self.remove_tracker(player, tracker)
-                    await player.send(f"Game {tracker.name} has stalled, the last check in the multiworld was {last_check}. Removing tracker.")
+                    await self.notify(player.id, f"Game {tracker.name} has stalled, the last check in the multiworld was {last_check}. Removing tracker.")
                     continue
                 elif multiworld.goaled:
                     await self.remove_tracker(player, tracker)
-                    await player.send(f"{multiworld.title} is complete, removing {tracker.name}")
+                    await self.notify(player.id, f"{multiworld.title} is complete, removing {tracker.name}")
                     continue
                 found_tracker = True
 
@@ -837,9 +1165,9 @@ class APTracker(Extension):
             room = multiworld.upstream_url.split("/")[-1]
             return room, multiworld
 
-        if "cheesetrackers" in room:
+        if "cheesetrackers" in room or room.startswith(CHEESE_URL):
             ch_id = room.split("/")[-1]
-            multiworld = Multiworld(f"https://cheesetrackers.theincrediblewheelofchee.se/api/tracker/{ch_id}")
+            multiworld = Multiworld(f"{CHEESE_URL}/api/tracker/{ch_id}")
             await multiworld.refresh()
             if multiworld.upstream_url is None:
                 logging.warning(f"Failed to get upstream URL for {room}")
@@ -871,6 +1199,11 @@ class APTracker(Extension):
                 await self.database.save_tracker(tracker)
 
         player_id = player.id if isinstance(player, (User, Member, Player)) else player
+        url = tracker.url if isinstance(tracker, TrackedGame) else tracker
+        self.dashboards.pop((url, player_id), None)
+        if not self.database and player_id in self.indexes:
+            # With a database the tracker is only disabled, and stays listed.
+            self.indexes[player_id].remove(url)
         if player_id not in self.trackers:
             return
 
@@ -885,6 +1218,8 @@ class APTracker(Extension):
         if tracker.user_id == -1:
             tracker.user_id = player_id
         self.trackers.setdefault(player_id, []).append(tracker)
+        if player_id in self.indexes:
+            self.indexes[player_id].add(tracker)
 
     def get_all_players(self) -> list[int]:
         return list(self.trackers.keys())
@@ -894,6 +1229,176 @@ class APTracker(Extension):
         if self.database:
             await self.database.save_player(player)
 
+    async def refresh_tracker(self, user: Player, player: User | Player, tracker: TrackedGame, urls: set[str], ids: set[int]) -> tuple[Multiworld, bool] | None:
+        """
+        Refresh a single tracker for the polling loop.
+
+        Returns the multiworld and whether the slot was checked, or None if the tracker was skipped.
+        """
+        if tracker.failures >= 10:
+            await self.remove_tracker(player, tracker)
+            await self.notify(player.id, f"Tracker {tracker.url} has been removed due to errors")
+            return None
+
+        if tracker.url in urls:
+            await self.remove_tracker(player, tracker)
+            return None
+        if tracker.cheese_id in ids:
+            await self.remove_tracker(player, tracker)
+            await self.save()
+            return None
+        urls.add(tracker.url)
+        if tracker.cheese_id:
+            ids.add(tracker.cheese_id)
+        try:
+            with span("sync_cheese"):
+                multiworld, _found = await self.sync_cheese(player, tracker.multitracker_url)
+        except IndexError as e:
+            record_error("sync_cheese", e)
+            tracker.failures += 1
+            return None
+        if multiworld is not None:
+            set_tags(host=multiworld.ap_hostname, agent=multiworld.game_agent)
+        if multiworld is None:
+            tracker.failures += 1
+            if tracker.failures >= 3:
+                await self.remove_tracker(player, tracker)
+                await self.notify(player.id, f"Tracker {tracker.url} has been removed due to errors")
+            if self.database:
+                await self.database.save_tracker(tracker, defer=True)
+            return None
+
+        if tracker.filters == Filters.unset and user.default_filters != Filters.unset:
+            tracker.filters = user.default_filters
+        if tracker.hint_filters == HintFilters.unset and user.default_hint_filters != HintFilters.unset:
+            tracker.hint_filters = user.default_hint_filters
+
+        should_check = (
+            tracker.last_refresh is None
+            or tracker.last_refresh.tzinfo is None
+            or multiworld.last_activity() > tracker.last_refresh
+            or datetime.datetime.now(tz=datetime.UTC) - tracker.last_checked > datetime.timedelta(hours=3)
+        )
+        if tracker.disabled:
+            should_check = False
+
+        await self.load_state(tracker)
+        if should_check:
+            new_items = await multiworld.refresh_game(tracker)
+        else:
+            new_items = False
+
+        ### DEBUG
+        if not user.quiet_mode:
+            if not new_items and tracker.failures > 10:
+                await self.remove_tracker(player, tracker)
+                await self.notify(player.id, f"Tracker {tracker.url} has been removed due to errors")
+                if self.database:
+                    await self.database.save_tracker(tracker, defer=True)
+                return None
+            if new_items:
+                items = tracker.notification_queue.copy()
+                tracker.notification_queue.clear()
+                tracker.mark_dirty("notification_queue")
+                with span("outbox.put", kind="items"):
+                    await self.outbox.put(Notification.for_tracker("items", tracker, items=items))
+                    if any(i.classification in [ItemClassification.unknown, ItemClassification.bad_name] for i in items):
+                        await self.outbox.put(Notification.for_tracker("classify", tracker, items=items))
+
+            hints = []
+            try:
+                if not tracker.disabled:
+                    with span("hint_scan"):
+                        hints = tracker.refresh_hints(multiworld)
+            except Exception as e:
+                record_error("refresh_hints", e)
+                sentry_sdk.capture_exception(e)
+                task_logger.error(f"Failed to get hints for {tracker.name}", exc_info=e)
+            if hints:
+                with span("outbox.put", kind="hints"):
+                    await self.outbox.put(Notification.for_tracker("hints", tracker, text=f"New hints for {tracker.name}:", embeds=[h.embed() for h in hints]))
+
+        if self.database:
+            await self.database.save_tracker(tracker, defer=True)
+        used_agents = ", ".join(k for k in multiworld.agents if multiworld.agents[k].enabled)
+        task_logger.debug(f"Finished processing tracker {tracker.url} for user {user} (using agents: {used_agents})")
+        return multiworld, should_check
+
+    async def refresh_queue(self) -> AsyncIterator[tuple[Player, list[TrackedGame]]]:
+        """
+        Every player with their trackers, streamed from the database in batches when there is one.
+
+        The stream starts at a random player and wraps around, so nobody is always last.  If it fails part way, it's
+        resumed after the last batch that was finished, skipping players that were already yielded.
+        """
+        if self.database:
+            streamed = 0
+            try:
+                start = await self.database.random_player_id()
+                segments = [{"_id": {"$gte": start}}, {"_id": {"$lt": start}}] if start is not None else [{}]
+                batch_size = configuration.get_int("refresh_batch_size")
+                for segment in segments:
+                    after = None
+                    done: set[int] = set()  # players yielded from the batch in progress
+                    failures = 0
+                    while True:
+                        query = segment if after is None else {"$and": [segment, {"_id": {"$gt": after}}]}
+                        try:
+                            async for last_id, batch in self.database.iter_player_batches(query, batch_size):
+                                for player, trackers in batch:
+                                    if player.id in done:
+                                        continue
+                                    done.add(player.id)
+                                    streamed += 1
+                                    yield player, self.with_indexed_trackers(player, trackers)
+                                after = last_id
+                                done = set()
+                            break
+                        except Exception as e:
+                            record_error("players", e)
+                            failures += 1
+                            if failures >= 3:
+                                raise
+                            task_logger.warning(f"Streaming players failed, resuming after {after}: {e}")
+            except Exception as e:
+                record_error("players", e)
+                if streamed:
+                    try:
+                        skipped = str(max(0, await self.database.count_players() - streamed))
+                    except Exception:
+                        skipped = "the remaining"
+                    task_logger.error(f"Failed to stream players, skipping {skipped} players this cycle: {e}")
+                    return
+                task_logger.error(f"Failed to stream players: {e}")
+            else:
+                return
+
+        player_ids = self.get_all_players()
+        random.shuffle(player_ids)
+        for player_id in player_ids:
+            yield await self.get_player_settings(player_id), await self.get_trackers(player_id)
+
+    def with_indexed_trackers(self, player: Player, trackers: list[TrackedGame]) -> list[TrackedGame]:
+        # Doesn't count as using the index, so the refresh loop alone doesn't keep every user's index alive.
+        index = self.indexes.get(player.id, reset_expiration=False)
+        if index is not None:
+            return list(index)
+        # Trackers that only exist in trackers.json aren't in the database.
+        urls = {t.url for t in trackers}
+        return trackers + [t for t in self.trackers.get(player.id, []) if t.url not in urls]
+
+    async def pace(self, multiworld: Multiworld, should_check: bool) -> None:
+        """Be polite to the upstream servers between trackers."""
+        if should_check:
+            if "webtracker" in multiworld.agents:
+                await asyncio.sleep(3)  # Webtrackers are slow
+            else:
+                await asyncio.sleep(0.5)
+        elif "webtracker" in multiworld.agents:
+            await asyncio.sleep(2)
+        else:
+            await asyncio.sleep(0)
+
     @Task.create(IntervalTrigger(hours=4))
     async def refresh_all(self) -> BaseTrigger | None:
         task_id = self.refresh_all.iteration
@@ -903,50 +1408,55 @@ class APTracker(Extension):
         }
 
         task_logger.info(f"Starting refresh_all task {task_id}")
+        if not self.profile_remaining:
+            self.profile_remaining = configuration.get_int("profile_trackers")
         user_count = 0
         tracker_count = 0
         progress = 0
         games: dict[str, int] = {}
 
-        queue: list[Player] = []
+        total_users = len(self.get_all_players())
         if self.database:
             try:
-                queue = await self.database.fetch_all_players()
+                total_users = await self.database.count_players()
             except Exception as e:
-                task_logger.error(f"Failed to fetch all players: {e}")
-
-        if not queue:
-            queue = [await self.get_player_settings(p) for p in self.get_all_players()]
+                task_logger.error(f"Failed to count players: {e}")
 
-        random.shuffle(queue)
-        for i, user in enumerate(queue):
-            task_logger.info(f"{task_id}: Processing user {user.name} ({user.id}) [{i}/{len(queue)}]")
-            trackers = await self.get_trackers(user.id)
+        i = 0
+        async for user, trackers in self.refresh_queue():
+            CYCLE_USERS_PENDING.set(max(0, total_users - i))
+            task_logger.info(f"{task_id}: Processing user {user.name} ({user.id}) [{i}/{total_users}]")
+            i += 1
 
             try:
-                player = await self.bot.fetch_user(user.id)
-                if not player:
-                    task_logger.warning(f"Failed to fetch user {user.id} ({user.name})")
-                    continue
-
-                old_name = user.name
-                user.update(player)
-                if old_name != user.name and self.database:
-                    await self.database.save_player(user)
+                # Names only matter for matching Cheese Tracker slots, so the Discord user is only fetched occasionally.
+                if user.needs_refresh(datetime.timedelta(hours=configuration.get_float("user_refresh_hours"))):
+                    discord_user = await self.bot.fetch_user(user.id)
+                    if not discord_user:
+                        task_logger.warning(f"Failed to fetch user {user.id} ({user.name})")
+                        continue
+                    user.update(discord_user)
+                    if self.database:
+                        await self.database.save_player(user)
+                player = user
 
                 if user.cheese_api_key:
                     try:
-                        cheese_dash = await user.get_trackers()
-                        for multiworld in cheese_dash:
-                            await self.sync_cheese(player, multiworld)
-                    except BadAPIKeyException:
+                        with transaction("user.sync_cheese", "cheese dashboard", user=user.id):
+                            cheese_dash = await user.get_trackers()
+                            for multiworld in cheese_dash:
+                                with span("sync_cheese"):
+                                    await self.sync_cheese(player, multiworld)
+                    except BadAPIKeyException as e:
+                        record_error("cheese_dashboard", e)
                         user.cheese_api_key = None
-                        await player.send("Failed to authenticate with Cheese Tracker.  Please reauthenticate with `/ap authenticate`")
+                        await self.notify(user.id, "Failed to authenticate with Cheese Tracker.  Please reauthenticate with `/ap authenticate`")
                         if self.database:
                             await self.database.save_player(user)
 
                 cheese_dash = []
 
+                await self.load_state(*(t for t in trackers if not t.disabled))
                 urls = set()
                 ids = set()
                 for tracker in trackers:
@@ -955,131 +1465,58 @@ class APTracker(Extension):
                     task_logger.debug(f"Processing tracker {tracker.url} for user {user}")
                     if tracker.user_id == -1:
                         tracker.user_id = user.id
+                    tracker_start = time.perf_counter()
                     try:
-                        if tracker.failures >= 10:
-                            await self.remove_tracker(player, tracker)
-                            await player.send(f"Tracker {tracker.url} has been removed due to errors")
-                            continue
-
-                        if tracker.url in urls:
-                            await self.remove_tracker(player, tracker)
-                            continue
-                        if tracker.cheese_id in ids:
-                            await self.remove_tracker(player, tracker)
-                            await self.save()
-                            continue
-                        urls.add(tracker.url)
-                        if tracker.cheese_id:
-                            ids.add(tracker.cheese_id)
+                        self.start_profiler()
                         try:
-                            multiworld, _found = await self.sync_cheese(player, tracker.multitracker_url)
-                        except IndexError:
-                            tracker.failures += 1
+                            with transaction("tracker.refresh", tracker.url, room=tracker.tracker_id, user=user.id):
+                                result = await self.refresh_tracker(user, player, tracker, urls, ids)
+                        finally:
+                            # A tracker that fails still counts, or the profile would carry on into the next one.
+                            await self.stop_profiler(tracker_done=True)
+                        if result is None:
                             continue
-                        if multiworld is None:
-                            tracker.failures += 1
-                            if tracker.failures >= 3:
-                                await self.remove_tracker(player, tracker)
-                                await player.send(f"Tracker {tracker.url} has been removed due to errors")
-                            if self.database:
-                                await self.database.save_tracker(tracker)
-                            continue
-
-                        if tracker.filters == Filters.unset and user.default_filters != Filters.unset:
-                            tracker.filters = user.default_filters
-                        if tracker.hint_filters == HintFilters.unset and user.default_hint_filters != HintFilters.unset:
-                            tracker.hint_filters = user.default_hint_filters
-
-                        should_check = (
-                            tracker.last_refresh is None
-                            or tracker.last_refresh.tzinfo is None
-                            or multiworld.last_activity() > tracker.last_refresh
-                            or datetime.datetime.now(tz=datetime.UTC) - tracker.last_checked > datetime.timedelta(hours=3)
-                        )
-                        if tracker.disabled:
-                            should_check = False
-
-                        if should_check:
-                            new_items = await multiworld.refresh_game(tracker)
-                        else:
-                            new_items = False
-
-                        ### DEBUG
-                        if not user.quiet_mode:
-                            try:
-                                if not new_items and tracker.failures > 10:
-                                    await self.remove_tracker(player, tracker)
-                                    await player.send(f"Tracker {tracker.url} has been removed due to errors")
-                                    if self.database:
-                                        await self.database.save_tracker(tracker)
-                                    continue
-                                if new_items:
-                                    items = tracker.notification_queue.copy()
-                                    await self.send_new_items(player, tracker)
-                                    asyncio.create_task(self.try_classify(player, tracker, items))
-                            except Forbidden:
-                                task_logger.error(f"Failed to send message to {player.global_name} ({player.id}) - DMs are closed")
-                                tracker.failures += 1
-                                await self.set_quiet_mode(user, True)
-                                continue
-
-                            hints = []
-                            try:
-                                if not tracker.disabled:
-                                    hints = tracker.refresh_hints(multiworld)
-                            except Exception as e:
-                                sentry_sdk.capture_exception(e)
-                                task_logger.error(f"Failed to get hints for {tracker.name}", exc_info=e)
-                            try:
-                                if hints:
-                                    components = []
-                                    if tracker.hint_filters == HintFilters.unset:
-                                        components.append(Button(style=ButtonStyle.GREY, label="Configure Hint Filters", emoji="⚙️", custom_id=f"settings:{tracker.cheese_id}"))
-                                    await player.send(f"New hints for {tracker.name}:", embeds=[h.embed() for h in hints], components=components)
-                            except Forbidden:
-                                task_logger.error(f"Failed to send message to {player.global_name} ({player.id}) - DMs are closed")
-                                tracker.failures += 1
-                                await self.set_quiet_mode(user, True)
-                                continue
-
-                        if self.database:
-                            await self.database.save_tracker(tracker)
+                        multiworld, should_check = result
                         tracker_count += 1
                         progress += 1
                         games[tracker.game] = games.get(tracker.game, 0) + 1
-                        used_agents = ", ".join(k for k in multiworld.agents if multiworld.agents[k].enabled)
-                        task_logger.debug(f"Finished processing tracker {tracker.url} for user {user} (using agents: {used_agents})")
-                        if should_check:
-                            if "webtracker" in multiworld.agents:
-                                await asyncio.sleep(3)  # Webtrackers are slow
-                            else:
-                                await asyncio.sleep(0.5)
-                        elif "webtracker" in multiworld.agents:
-                            await asyncio.sleep(2)
-                        else:
-                            await asyncio.sleep(0)
+                        TRACKER_SECONDS.observe(time.perf_counter() - tracker_start, agent=multiworld.game_agent)
+                        TRACKERS_PROCESSED.inc(agent=multiworld.game_agent)
+                        await self.pace(multiworld, should_check)
                     except Exception as e:
+                        record_error("tracker", e)
                         task_logger.error(f"Error occurred while processing tracker {tracker.cheese_id} for user {user}: {e}")
                         sentry_sdk.capture_exception(e)
 
+                if self.database:
+                    await self.database.flush_trackers()
                 if trackers:
                     user_count += 1
                 if progress > 500:
                     self.stats["running_refresh"] = {
                         "task_id": task_id,
                         "current_user": user_count,
-                        "total_users": len(queue),
+                        "total_users": total_users,
                         "current_tracker_count": tracker_count,
                         "stats_written": datetime.datetime.now(tz=datetime.UTC).isoformat(),
                     }
                     await self.save()
                     progress = 0
             except Exception as e:
+                record_error("user", e)
                 sentry_sdk.capture_exception(e)
                 task_logger.error(f"Failed to refresh trackers for {user}")
                 print(e)
                 await asyncio.sleep(5)
 
+        CYCLE_USERS_PENDING.set(0)
+        if self.database:
+            try:
+                await self.database.flush_trackers()
+            except Exception as e:
+                record_error("flush_trackers", e)
+                task_logger.error(f"Failed to write trackers: {e}")
+        await self.stop_profiler()
         agents: Counter[str] = Counter()
         to_delete = []
         for room_id, multiworld in self.cheese.items():
@@ -1111,6 +1548,7 @@ class APTracker(Extension):
         activity = Activity(name=f"{tracker_count} slots across {user_count} users", type=ActivityType.WATCHING)
         await self.bot.change_presence(activity=activity)
         time_taken = datetime.datetime.now(tz=datetime.UTC) - start_time
+        CYCLE_SECONDS.observe(time_taken.total_seconds())
         task_logger.info(f"Completed refresh_all task {task_id}: {tracker_count} trackers for {user_count} users in {time_taken}")
         trigger = self.refresh_all.trigger
 
@@ -1132,68 +1570,117 @@ class APTracker(Extension):
         if datetime.datetime.now(tz=datetime.UTC) - self.last_save < datetime.timedelta(seconds=60):
             return
         self.last_save = datetime.datetime.now(tz=datetime.UTC)
+        if self.journal is not None:
+            records = await self.journal.save(self.trackers, self.cheese, self.players)
+            task_logger.debug(f"Journaled {records} changed records")
+        else:
+            await self.save_snapshots()
+
+        stats = json.dumps(self.stats, indent=2)
+        async with aiofiles.open("stats.json", "w") as f:
+            await f.write(stats)
+        task_logger.debug("Finished saving tracker data to disk")
+
+    async def save_snapshots(self):
+        if configuration.get_str("snapshot_format") == "json":
+            await self.save_json()
+        else:
+            # Unstructured here, since the objects can change under a thread; packed and written in one.
+            state = {
+                "trackers": snapshot.entries(self.trackers, list[TrackedGame]),
+                "multiworlds": snapshot.entries(self.cheese, Multiworld),
+                "players": snapshot.entries(self.players, Player),
+            }
+            await asyncio.to_thread(snapshot.write, state)
+            self.rebase_snapshot()
+        # Everything is in the snapshot now; left over from running in journal mode.
+        journal.discard()
+
+    def rebase_snapshot(self) -> None:
+        mappings = [m for m in (self.trackers, self.cheese, self.players) if isinstance(m, snapshot.LazyMapping)]
+        if not mappings:
+            return
+        try:
+            latest = snapshot.Snapshot.open()
+        except Exception as e:
+            logging.error(f"Failed to reopen {snapshot.SNAPSHOT}: {e}")
+            return
+        if latest is not None:
+            for mapping in mappings:
+                mapping.records.rebase(latest)
+
+    async def save_json(self):
         if self.trackers:
             task_logger.debug("Saving tracker data to disk")
-            trackers = json.dumps(converter.unstructure(self.trackers), indent=2)
+            trackers = json.dumps(converter.unstructure(self.trackers, unstructure_as=TRACKERS), indent=2)
             if os.path.exists("trackers.json"):
                 shutil.copyfile("trackers.json", "trackers.json.bak")
             async with aiofiles.open("trackers.tmp", "w") as f:
                 await f.write(trackers)
             os.replace("trackers.tmp", "trackers.json")
         if self.cheese:
-            cheese = json.dumps(converter.unstructure(self.cheese), indent=2)
+            cheese = json.dumps(converter.unstructure(self.cheese, unstructure_as=MULTIWORLDS), indent=2)
             async with aiofiles.open("cheese.json", "w") as f:
                 await f.write(cheese)
         if self.players:
-            players = json.dumps(converter.unstructure(self.players), indent=2)
+            players = json.dumps(converter.unstructure(self.players, unstructure_as=PLAYERS), indent=2)
             async with aiofiles.open("players.json", "w") as f:
                 await f.write(players)
 
-        stats = json.dumps(self.stats, indent=2)
-        async with aiofiles.open("stats.json", "w") as f:
-            await f.write(stats)
-        task_logger.debug("Finished saving tracker data to disk")
-
     def load(self):
+        state = journal.read_state()
+        if isinstance(state["trackers"], snapshot.RawRecords):
+            # Records are only structured when they're first used, so this doesn't depend on how many there are.
+            self.trackers = snapshot.LazyMapping(state["trackers"], int, list[TrackedGame])
+            self.cheese = snapshot.LazyMapping(state["multiworlds"], str, Multiworld, on_load=register_games)
+            self.players = snapshot.LazyMapping(state["players"], int, Player)
+        else:
+            self.load_json(state)
+        if self.journal is not None:
+            # Everything loaded is already on disk.
+            self.journal.changes(self.trackers, self.cheese, self.players)
         try:
-            if os.path.exists("trackers.json"):
-                with open("trackers.json") as f:
-                    self.trackers = converter.structure(json.loads(f.read()), dict[int, list[TrackedGame]])
+            if os.path.exists("stats.json"):
+                with open("stats.json") as f:
+                    stats = json.loads(f.read())
+                    self.stats = stats
         except Exception as e:
             sentry_sdk.capture_exception(e)
             print(e)
-            if os.path.exists("trackers.json.bak"):
-                with open("trackers.json.bak") as f:
-                    self.trackers = converter.structure(json.loads(f.read()), dict[int, list[TrackedGame]])
+        self.last_save = datetime.datetime.min.replace(tzinfo=datetime.UTC)
+
+    def load_json(self, state: dict[str, dict]):
         try:
-            if os.path.exists("cheese.json"):
-                with open("cheese.json") as f:
-                    self.cheese = converter.structure(json.loads(f.read()), dict[str, Multiworld])
+            if state["trackers"]:
+                self.trackers = converter.structure(state["trackers"], TRACKERS)
         except Exception as e:
             sentry_sdk.capture_exception(e)
             print(e)
+            if os.path.exists("trackers.json.bak"):
+                with open("trackers.json.bak") as f:
+                    self.trackers = converter.structure(json.loads(f.read()), TRACKERS)
         try:
-            if os.path.exists("players.json"):
-                with open("players.json") as f:
-                    self.players = converter.structure(json.loads(f.read()), dict[int, Player])
+            if state["multiworlds"]:
+                self.cheese = converter.structure(state["multiworlds"], MULTIWORLDS)
         except Exception as e:
             sentry_sdk.capture_exception(e)
             print(e)
         try:
-            for mw in self.cheese.values():
-                GAMES.update({g.id: g for g in mw.games.values()})
+            if state["players"]:
+                self.players = converter.structure(state["players"], PLAYERS)
         except Exception as e:
             sentry_sdk.capture_exception(e)
             print(e)
         try:
-            if os.path.exists("stats.json"):
-                with open("stats.json") as f:
-                    stats = json.loads(f.read())
-                    self.stats = stats
+            for mw in self.cheese.values():
+                register_games(mw)
         except Exception as e:
             sentry_sdk.capture_exception(e)
             print(e)
-        self.last_save = datetime.datetime.min.replace(tzinfo=datetime.UTC)
+
+
+def register_games(multiworld: Multiworld) -> None:
+    GAMES.update({g.id: g for g in multiworld.games.values()})
 
 
 def recolour_buttons(components: list[ActionRow]) -> list[Button]:
@@ -1220,6 +1707,27 @@ def chunk(arr_range, arr_size):
     return iter(lambda: tuple(itertools.islice(arr_range, arr_size)), ())
 
 
+def plain_name(tracker: TrackedGame) -> str:
+    return (tracker.name or tracker.url).replace("*", "")
+
+
+def pack_text(blocks: list[str], limit: int = 2000) -> list[str]:
+    """Join blocks into as few messages as possible, splitting oversized blocks on line breaks."""
+    messages: list[str] = []
+    current = ""
+    for block in blocks:
+        lines = block.rstrip("\n").split("\n") if len(block) > limit else [block.rstrip("\n")]
+        for line in lines:
+            line = line[:limit]
+            if current and len(current) + 1 + len(line) > limit:
+                messages.append(current)
+                current = ""
+            current = f"{current}\n{line}" if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
 def format_relative_time(dt):
     if dt is None or dt == datetime.datetime.min:
         return ""
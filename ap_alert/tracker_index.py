@@ -0,0 +1,57 @@
+"""
+In-memory index of each user's trackers.
+
+Component callbacks carry a cheese_id and commands carry a URL; both resolve through here without a database round trip.
+The cheese_id of a tracker can change after it's indexed (sync_cheese, set_cheese_id), so lookups by cheese_id are
+verified and the user's index is rebuilt on a mismatch.
+"""
+from typing import Iterator
+
+from ap_alert.models.tracked_game import TrackedGame
+
+
+def canonical_url(url: str) -> str:
+    return url.rstrip("/").replace("/generic_tracker/", "/tracker/")
+
+
+class TrackerIndex:
+    def __init__(self, trackers: list[TrackedGame] = ()) -> None:
+        self.by_url: dict[str, TrackedGame] = {}
+        self.by_cheese_id: dict[int, TrackedGame] = {}
+        for tracker in trackers:
+            self.add(tracker)
+
+    def __iter__(self) -> Iterator[TrackedGame]:
+        return iter(list(self.by_url.values()))
+
+    def __len__(self) -> int:
+        return len(self.by_url)
+
+    def __bool__(self) -> bool:
+        return bool(self.by_url)
+
+    def add(self, tracker: TrackedGame) -> None:
+        self.by_url.setdefault(canonical_url(tracker.url), tracker)
+        self.by_cheese_id.setdefault(tracker.cheese_id, tracker)
+
+    def remove(self, tracker: TrackedGame | str) -> TrackedGame | None:
+        url = canonical_url(tracker if isinstance(tracker, str) else tracker.url)
+        removed = self.by_url.pop(url, None)
+        if removed is not None and self.by_cheese_id.get(removed.cheese_id) is removed:
+            self.reindex()
+        return removed
+
+    def get(self, url: str) -> TrackedGame | None:
+        return self.by_url.get(canonical_url(url))
+
+    def find(self, cheese_id: int) -> TrackedGame | None:
+        tracker = self.by_cheese_id.get(cheese_id)
+        if tracker is None or tracker.cheese_id != cheese_id:
+            self.reindex()
+            tracker = self.by_cheese_id.get(cheese_id)
+        return tracker
+
+    def reindex(self) -> None:
+        self.by_cheese_id = {}
+        for tracker in self.by_url.values():
+            self.by_cheese_id.setdefault(tracker.cheese_id, tracker)
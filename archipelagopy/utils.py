@@ -61,7 +61,7 @@ async def fetch_datapackage_from_webhost(game: str, checksum: str, webhost: str
         return data
 
     url = f"{webhost}/api/datapackage/{checksum}"
-    async with make_session() as session:
+    async with make_session("datapackage") as session:
         async with session.get(url) as response:
             if response.status != 200:
                 raise ValueError(f"Could not fetch datapackage from {url}, status code {response.status}")
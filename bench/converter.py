@@ -0,0 +1,136 @@
+"""
+Startup load and snapshot save through the shared converter, against the converter it replaced.
+
+The baseline is configured the way `ap_alert/converter.py` used to be: cattrs defaults, lambda datetime hooks, and
+`unstructure` dispatching on each value's runtime type.  Both converters must produce the same documents, including for
+a tracker whose hints were built from Cheese Tracker JSON by `refresh_hints`, which hold raw strings in enum fields.
+
+    pipenv run python -m bench.converter
+    pipenv run python -m bench.converter --users 2000 --rounds 5
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+import types
+
+import cattrs
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from ap_alert.converter import MULTIWORLDS, PLAYERS, TRACKERS, converter  # noqa: E402
+from ap_alert.models.tracked_game import TrackedGame  # noqa: E402
+from bench import synthetic  # noqa: E402
+
+
+def baseline_converter() -> cattrs.Converter:
+    baseline = cattrs.Converter()
+    baseline.register_structure_hook(datetime.datetime, lambda x, *_: datetime.datetime.fromisoformat(x) if x else None)
+    baseline.register_unstructure_hook(datetime.datetime, lambda x, *_: x.isoformat() if x else None)
+    return baseline
+
+
+def documents(seed: int, users: int, per_user: int, items: int, locations: int, hints: int) -> dict[str, tuple[object, dict]]:
+    trackers = synthetic.trackers_json(seed, users, per_user, items, locations, hints)
+    rooms = synthetic.make_rooms(seed, max(1, users // 4), 8, 10, 10)
+    multiworlds = {}
+    for room in rooms:
+        url = f"https://cheesetrackers.theincrediblewheelofchee.se/api/tracker/{room.room_id}"
+        cheese = synthetic.cheese_tracker(room, f"https://archipelago.gg/tracker/{room.room_id}")
+        multiworlds[url] = {
+            "url": url,
+            "tracker_id": room.room_id,
+            "cheese_tracker_id": room.room_id,
+            "ap_tracker_id": room.room_id,
+            "title": cheese["title"],
+            "games": {str(game["id"]): game for game in cheese["games"]},
+            "last_refreshed": cheese["updated_at"],
+            "last_update": cheese["updated_at"],
+            "upstream_url": cheese["upstream_url"],
+            "last_port": cheese["last_port"],
+            "hints": cheese["hints"],
+        }
+    players = {
+        str(user): {"id": user, "name": f"Player{user}", "default_filters": 32, "default_hint_filters": 4, "dm_channel_id": user, "user_refreshed": None}
+        for user in range(users)
+    }
+    # Round-tripped through JSON so the documents are what load() reads from disk.
+    return {
+        "trackers": (TRACKERS, json.loads(json.dumps(trackers))),
+        "multiworlds": (MULTIWORLDS, json.loads(json.dumps(multiworlds))),
+        "players": (PLAYERS, json.loads(json.dumps(players))),
+    }
+
+
+def raw_hints_round_trip(baseline: cattrs.Converter, seed: int) -> str | None:
+    """Why a tracker with hints from `refresh_hints` doesn't round-trip the same through both converters, if it doesn't."""
+    room = synthetic.make_rooms(seed, 1, 4, 1, 1, hints=50)[0]
+    slot = room.slots[0]
+    tracker = TrackedGame(url=f"https://archipelago.gg/tracker/{room.room_id}/0/1", cheese_id=slot.cheese_id, name=slot.name, game=slot.game)
+    tracker.refresh_hints(types.SimpleNamespace(hints=room.hints))
+    if not tracker.finder_hints and not tracker.receiver_hints:
+        return "the fixture has no hints for the tracker"
+    document = converter.unstructure(tracker, unstructure_as=TrackedGame)
+    if document != baseline.unstructure(tracker):
+        return "the converters disagree"
+    if converter.unstructure(converter.structure(document, TrackedGame), unstructure_as=TrackedGame) != document:
+        return "structuring the document doesn't give it back"
+    return None
+
+
+def median_ms(func, rounds: int) -> float:
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--per-user", type=int, default=5)
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--locations", type=int, default=300)
+    parser.add_argument("--hints", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    baseline = baseline_converter()
+    if problem := raw_hints_round_trip(baseline, args.seed):
+        print(f"raw hints: {problem}", file=sys.stderr)
+        return 1
+    results = {}
+    print(f"{'':<24} {'baseline':>10} {'shared':>10} {'speed-up':>9}")
+    for name, (cl, document) in documents(args.seed, args.users, args.per_user, args.items, args.locations, args.hints).items():
+        old_value = baseline.structure(document, cl)
+        new_value = converter.structure(document, cl)
+        if baseline.unstructure(old_value) != converter.unstructure(new_value, unstructure_as=cl):
+            print(f"{name}: the converters disagree", file=sys.stderr)
+            return 1
+        timings = {
+            "structure": (
+                median_ms(lambda: baseline.structure(document, cl), args.rounds),
+                median_ms(lambda: converter.structure(document, cl), args.rounds),
+            ),
+            "unstructure": (
+                median_ms(lambda: baseline.unstructure(old_value), args.rounds),
+                median_ms(lambda: converter.unstructure(new_value, unstructure_as=cl), args.rounds),
+            ),
+        }
+        for op, (old, new) in timings.items():
+            print(f"{name + '.' + op:<24} {old:>8.1f}ms {new:>8.1f}ms {old / new:>8.2f}x")
+            results[f"{name}.{op}"] = {"baseline_ms": round(old, 3), "shared_ms": round(new, 3)}
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""
+End-to-end load test for the polling pipeline.
+
+Starts local stand-ins for the Archipelago webhost and the Cheese Tracker, points an `APTracker` at them with a fake
+Discord client, and runs `refresh_all` cycles.  Requires the `world_data` checkout next to `run.py`.
+
+    pipenv run python -m bench.loadtest --rooms 50 --slots 8 --items 300 --churn 5 --cycles 3 --agent api
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+import attrs
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from bench import synthetic  # noqa: E402
+from bench.standins import StandIns  # noqa: E402
+
+
+@attrs.define()
+class FakeChannel:
+    deleted: int = 0
+
+    async def delete_message(self, _message) -> None:
+        self.deleted += 1
+
+
+@attrs.define()
+class FakeMessage:
+    content: str | None
+    channel: FakeChannel
+    id: int = attrs.field(factory=lambda: random.getrandbits(63))
+
+
+@attrs.define()
+class FakeUser:
+    """Stands in for `interactions.User` and its DM channel; records everything sent to it."""
+
+    id: int
+    username: str
+    global_name: str
+    sent: list[str] = attrs.field(factory=list)
+    channel: FakeChannel = attrs.field(factory=FakeChannel)
+
+    async def send(self, content: str | None = None, **_kwargs) -> FakeMessage:
+        self.sent.append(content or "")
+        return FakeMessage(content, self.channel)
+
+    async def fetch_dm(self, *_args, **_kwargs) -> FakeChannel:
+        return self.channel
+
+    async def delete_message(self, message) -> None:
+        await self.channel.delete_message(message)
+
+
+class FakeCache:
+    """Wraps the client's `GlobalCache`, which is slotted and can't be patched, to hand out `FakeUser`s as channels."""
+
+    def __init__(self, cache, discord: "FakeDiscord") -> None:
+        self._cache = cache
+        self.get_channel = discord.get_channel
+        self.fetch_dm_channel = discord.fetch_user
+
+    def __getattr__(self, name: str):
+        return getattr(self._cache, name)
+
+
+class FakeDiscord:
+    """Patches an unstarted `interactions.Client` so nothing reaches Discord."""
+
+    def __init__(self, client) -> None:
+        self.client = client
+        self.users: dict[int, FakeUser] = {}
+        client.fetch_user = self.fetch_user
+        client.change_presence = self.change_presence
+        client.cache = FakeCache(client.cache, self)
+
+    def get_channel(self, channel_id: int) -> FakeUser:
+        return self.user(int(channel_id))
+
+    def user(self, user_id: int) -> FakeUser:
+        if user_id not in self.users:
+            self.users[user_id] = FakeUser(user_id, f"bench{user_id}", f"Bench User {user_id}")
+        return self.users[user_id]
+
+    async def fetch_user(self, user_id: int, *_args, **_kwargs) -> FakeUser:
+        return self.user(int(user_id))
+
+    async def change_presence(self, *_args, **_kwargs) -> None:
+        pass
+
+    @property
+    def messages_sent(self) -> int:
+        return sum(len(u.sent) for u in self.users.values())
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+async def run(args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    rooms = synthetic.make_rooms(args.seed, args.rooms, args.slots, args.items, args.locations, args.hints)
+    standins = StandIns(rooms, mode=args.agent, latency=args.latency / 1000)
+    await standins.start()
+
+    workdir = tempfile.mkdtemp(prefix="mwtb-loadtest-")
+    os.chdir(workdir)
+    os.environ["cheese_url"] = standins.cheese_url
+    os.environ["metrics_port"] = "0"
+
+    import interactions
+
+    from ap_alert.models.player import Player
+    from ap_alert.models.tracked_game import TrackedGame
+    from ap_alert.tracker import APTracker
+
+    client = interactions.Client()
+    discord = FakeDiscord(client)
+    ext = APTracker(client)
+    ext.database = None
+    ext.outbox.store = None
+    ext.outbox.coalesce_window = args.coalesce
+    ext.outbox.start()
+    if not args.pacing:
+
+        async def no_pacing(*_args) -> None:
+            await asyncio.sleep(0)
+
+        ext.pace = no_pacing
+
+    latencies: list[float] = []
+    refresh_tracker = ext.refresh_tracker
+
+    async def timed_refresh_tracker(*a, **kw):
+        start = time.perf_counter()
+        try:
+            return await refresh_tracker(*a, **kw)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    ext.refresh_tracker = timed_refresh_tracker
+
+    slots = [(room, slot) for room in rooms for slot in room.slots]
+    rng.shuffle(slots)
+    user_id = 1
+    while slots:
+        ext.players[user_id] = Player(user_id, name=f"Bench User {user_id}", dm_channel_id=user_id)
+        for room, slot in slots[: args.slots_per_user]:
+            # With the default cheese_id of -1, refresh_tracker would remove all but one tracker per user as duplicates.
+            ext.add_tracker(user_id, TrackedGame(f"{standins.ap_url}/tracker/{room.room_id}/0/{slot.position}", cheese_id=slot.cheese_id))
+        slots = slots[args.slots_per_user :]
+        user_id += 1
+
+    cycles = []
+    for cycle in range(args.cycles):
+        if cycle:
+            for room in rooms:
+                room.churn(rng, args.churn)
+            for multiworld in ext.cheese.values():
+                for agent in multiworld.agents.values():
+                    agent.last_refreshed = datetime.datetime.fromisoformat("1970-01-01T00:00:00Z")
+        latencies.clear()
+        requests_before = sum(standins.requests.values())
+        messages_before = discord.messages_sent
+        start = time.perf_counter()
+        await ext.refresh_all()
+        elapsed = time.perf_counter() - start
+        await ext.outbox.join()
+        drained = time.perf_counter() - start
+        processed = len(latencies)
+        cycles.append(
+            {
+                "cycle": cycle,
+                "seconds": round(elapsed, 3),
+                "drain_seconds": round(drained - elapsed, 3),
+                "trackers": processed,
+                "trackers_per_sec": round(processed / elapsed, 2) if elapsed else 0,
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+                "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0,
+                "requests": sum(standins.requests.values()) - requests_before,
+                "messages": discord.messages_sent - messages_before,
+            }
+        )
+
+    await ext.outbox.stop()
+    await standins.stop()
+    return {
+        "parameters": vars(args),
+        "cycles": cycles,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "requests_by_route": dict(standins.requests),
+        "bytes_served": standins.bytes_sent,
+        "workdir": workdir,
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"{'cycle':>5} {'seconds':>9} {'trackers':>8} {'trk/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'requests':>8} {'messages':>8}")
+    for c in report["cycles"]:
+        print(f"{c['cycle']:>5} {c['seconds']:>9} {c['trackers']:>8} {c['trackers_per_sec']:>8} {c['p50_ms']:>8} {c['p99_ms']:>8} {c['requests']:>8} {c['messages']:>8}")
+    print(f"peak RSS: {report['peak_rss_mb']} MB, bytes served: {report['bytes_served']}")
+    for route, count in sorted(report["requests_by_route"].items()):
+        print(f"  {count:>7} {route}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--slots", type=int, default=8, help="slots per room")
+    parser.add_argument("--items", type=int, default=200, help="items already received per slot")
+    parser.add_argument("--locations", type=int, default=300, help="locations per slot")
+    parser.add_argument("--hints", type=int, default=20, help="hints per room")
+    parser.add_argument("--churn", type=int, default=5, help="new items per slot between cycles")
+    parser.add_argument("--cycles", type=int, default=2)
+    parser.add_argument("--slots-per-user", type=int, default=4)
+    parser.add_argument("--agent", choices=("api", "cheese", "webtracker"), default="api")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated server latency in ms")
+    parser.add_argument("--coalesce", type=float, default=1.0, help="notification coalescing window in seconds")
+    parser.add_argument("--pacing", action="store_true", help="keep the polite sleeps between trackers")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Micro-benchmarks for the CPU hot spots, with per-function budgets.
+
+Fixtures are generated from a seed, so runs are comparable.  Each benchmark is timed with the garbage collector off,
+and its fastest round is compared against `bench/budgets.json`; the minimum is the statistic least disturbed by
+whatever else the machine is doing.  The run fails if any benchmark is over budget.  Budgets are the minimum times
+`HEADROOM`, but never less than `SLACK_MS` above it, and benchmarks faster than `MIN_BUDGETED_MS` get no budget at all,
+since timer and scheduler noise is bigger than any regression they'd catch.
+
+    pipenv run python -m bench.micro                   # run everything and check budgets
+    pipenv run python -m bench.micro -k hints          # only benchmarks whose name contains "hints"
+    pipenv run python -m bench.micro --update-budgets  # record the current timings (with headroom) as the new budgets
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Callable
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from bench import synthetic  # noqa: E402
+
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "budgets.json")
+HEADROOM = 2.5
+SLACK_MS = 1.0
+MIN_BUDGETED_MS = 0.1
+
+BENCHMARKS: dict[str, Callable[[int], Callable[[], object]]] = {}
+
+
+def benchmark(name: str):
+    """Register a fixture factory.  The factory takes the seed and returns the callable to time."""
+
+    def decorator(factory):
+        BENCHMARKS[name] = factory
+        return factory
+
+    return decorator
+
+
+@benchmark("process_table.received_3000")
+def bench_process_table(seed: int):
+    from bs4 import BeautifulSoup
+
+    from shared.bs_helpers import process_table
+
+    room = synthetic.make_rooms(seed, 1, 1, 3000, 10, item_pool=3000)[0]
+    soup = BeautifulSoup(synthetic.slot_tracker_html(room, room.slots[0]), features="html.parser")
+    table = soup.find(id="received-table")
+    return lambda: process_table(table)
+
+
+@benchmark("process_table.locations_2000")
+def bench_process_locations(seed: int):
+    from bs4 import BeautifulSoup
+
+    from shared.bs_helpers import process_table
+
+    room = synthetic.make_rooms(seed, 1, 1, 10, 2000)[0]
+    soup = BeautifulSoup(synthetic.slot_tracker_html(room, room.slots[0]), features="html.parser")
+    table = soup.find(id="locations-table")
+    return lambda: process_table(table)
+
+
+@benchmark("cheese_game.properties_1000")
+def bench_cheese_game(seed: int):
+    from ap_alert.models.cheese_game import CheeseGame
+
+    room = synthetic.make_rooms(seed, 1, 1000, 0, 1)[0]
+    games = [CheeseGame(g) for g in synthetic.cheese_tracker(room, "")["games"]]
+
+    def run():
+        for g in games:
+            g.last_activity
+            g.last_checked
+            g.progression_status
+            g.completion_status
+            g.tracker_status
+
+    return run
+
+
+@benchmark("tracked_game.refresh_hints_5000_new")
+def bench_refresh_hints_new(seed: int):
+    from ap_alert.models.tracked_game import TrackedGame
+    from ap_alert.multiworld import Multiworld
+
+    room = synthetic.make_rooms(seed, 1, 2, 0, 1, hints=5000)[0]
+    for h in room.hints:
+        h["finder_game_id"] = room.slots[0].cheese_id
+    multiworld = Multiworld("https://archipelago.gg/tracker/bench", hints=room.hints)
+
+    def run():
+        tracker = TrackedGame(f"https://archipelago.gg/tracker/{room.room_id}/0/1", cheese_id=room.slots[0].cheese_id)
+        tracker.refresh_hints(multiworld)
+
+    return run
+
+
+@benchmark("tracked_game.refresh_hints_5000_steady")
+def bench_refresh_hints_steady(seed: int):
+    from ap_alert.models.tracked_game import TrackedGame
+    from ap_alert.multiworld import Multiworld
+
+    room = synthetic.make_rooms(seed, 1, 2, 0, 1, hints=5000)[0]
+    multiworld = Multiworld("https://archipelago.gg/tracker/bench", hints=room.hints)
+    tracker = TrackedGame(f"https://archipelago.gg/tracker/{room.room_id}/0/1", cheese_id=room.slots[0].cheese_id)
+    tracker.refresh_hints(multiworld)
+    return lambda: tracker.refresh_hints(multiworld)
+
+
+def _large_tracker(seed: int):
+    from ap_alert.converter import converter
+    from ap_alert.models.tracked_game import TrackedGame
+
+    document = synthetic.trackers_json(seed, 1, 1, 3000, 2000, 500)
+    return converter.structure(document["0"][0], TrackedGame)
+
+
+@benchmark("automongocache.to_dict_large_tracker")
+def bench_to_dict(seed: int):
+    from shared.automongocache import to_dict
+
+    tracker = _large_tracker(seed)
+    return lambda: to_dict(tracker)
+
+
+@benchmark("automongocache.diff_dict_large_tracker")
+def bench_diff_dict(seed: int):
+    from shared.automongocache import diff_dict, to_dict
+
+    tracker = _large_tracker(seed)
+    old = to_dict(tracker)
+    tracker.failures += 1
+    tracker.checks[synthetic.location_name(1)] = not tracker.checks[synthetic.location_name(1)]
+    new = to_dict(tracker)
+    return lambda: diff_dict(new, old)
+
+
+@benchmark("automongocache.dirty_diff_large_tracker")
+def bench_dirty_diff(seed: int):
+    from shared.automongocache import DiffableTTLItem, to_dict
+
+    tracker = _large_tracker(seed)
+    item = DiffableTTLItem(tracker, 0, to_dict(tracker))
+    tracker.failures += 1
+    return item.diff
+
+
+@benchmark("converter.structure_trackers_json")
+def bench_structure(seed: int):
+    from ap_alert.converter import TRACKERS, converter
+
+    document = json.loads(json.dumps(synthetic.trackers_json(seed, 200, 5, 200, 300, 20)))
+    return lambda: converter.structure(document, TRACKERS)
+
+
+@benchmark("converter.unstructure_trackers_json")
+def bench_unstructure(seed: int):
+    from ap_alert.converter import TRACKERS, converter
+
+    trackers = converter.structure(synthetic.trackers_json(seed, 200, 5, 200, 300, 20), TRACKERS)
+    return lambda: converter.unstructure(trackers, unstructure_as=TRACKERS)
+
+
+@benchmark("api_agent.refresh_game_3000_items")
+def bench_api_refresh_game(seed: int):
+    from ap_alert import multiworld as mw_module
+    from ap_alert.models.network_item import NetworkItem
+    from ap_alert.models.tracked_game import TrackedGame
+
+    room = synthetic.make_rooms(seed, 1, 1, 3000, 10, item_pool=3000)[0]
+    dp = synthetic.datapackage(3000, 10)
+
+    async def fetch_datapackage(*_args, **_kwargs) -> dict:
+        return dp
+
+    mw_module.fetch_datapackage_from_webhost = fetch_datapackage
+    multiworld = mw_module.Multiworld(f"https://archipelago.gg/tracker/{room.room_id}", upstream_url=f"https://archipelago.gg/tracker/{room.room_id}")
+    multiworld.static_tracker_data = synthetic.static_tracker(room)
+    multiworld.player_items_received = synthetic.api_tracker(room)["player_items_received"]
+    agent = mw_module.ApiTrackerAgent(multiworld)
+    loop = asyncio.new_event_loop()
+
+    def run():
+        tracker = TrackedGame(f"https://archipelago.gg/tracker/{room.room_id}/0/1", game=synthetic.GAME)
+        tracker.all_items = [NetworkItem("placeholder", synthetic.GAME, 1)]
+        loop.run_until_complete(agent.refresh_game(tracker))
+
+    return run
+
+
+def measure(func: Callable[[], object], min_time: float, min_rounds: int) -> list[float]:
+    func()  # warm up
+    timings = []
+    gc.collect()
+    gc.disable()
+    try:
+        deadline = time.perf_counter() + min_time
+        while len(timings) < min_rounds or time.perf_counter() < deadline:
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return timings
+
+
+def budget_for(fastest: float) -> float | None:
+    if fastest < MIN_BUDGETED_MS:
+        return None
+    return round(max(fastest * HEADROOM, fastest + SLACK_MS), 3)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--min-time", type=float, default=1.0, help="minimum seconds to spend on each benchmark")
+    parser.add_argument("--min-rounds", type=int, default=5)
+    parser.add_argument("--update-budgets", action="store_true", help=f"write the current minimums x{HEADROOM} as the new budgets")
+    args = parser.parse_args()
+
+    budgets: dict[str, float] = {}
+    if os.path.exists(BUDGETS_PATH):
+        with open(BUDGETS_PATH) as f:
+            budgets = json.load(f)
+
+    failures = []
+    print(f"{'benchmark':<45} {'min ms':>10} {'median ms':>10} {'budget ms':>10} {'rounds':>7}")
+    for name, factory in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        timings = measure(factory(args.seed), args.min_time, args.min_rounds)
+        fastest = min(timings) * 1000
+        median = statistics.median(timings) * 1000
+        budget = budgets.get(name)
+        status = ""
+        if args.update_budgets:
+            budget = budget_for(fastest)
+            if budget is None:
+                budgets.pop(name, None)
+            else:
+                budgets[name] = budget
+        elif budget is not None and fastest > budget:
+            status = "  OVER BUDGET"
+            failures.append(name)
+        budget_text = f"{budget:.3f}" if budget is not None else "-"
+        print(f"{name:<45} {fastest:>10.3f} {median:>10.3f} {budget_text:>10} {len(timings):>7}{status}")
+
+    if args.update_budgets:
+        with open(BUDGETS_PATH, "w") as f:
+            json.dump(dict(sorted(budgets.items())), f, indent=2)
+            f.write("\n")
+        print(f"Budgets written to {BUDGETS_PATH}")
+        return 0
+
+    if failures:
+        print(f"{len(failures)} benchmark(s) over budget: {', '.join(failures)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Query cost of the database access patterns, with and without the indexes from `ap_alert.database.INDEXES`.
+
+Needs a MongoDB server.  A scratch database is filled with synthetic tracker and player documents, every lookup the
+bot makes is timed and explained, then the indexes are created and everything is measured again.  The scratch
+database is dropped afterwards.
+
+    pipenv run python -m bench.mongo_indexes                         # 100k trackers on mongodb://localhost:27017/
+    pipenv run python -m bench.mongo_indexes --trackers 10000 --uri mongodb://db:27017/
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import pymongo
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from ap_alert.database import HEAVY_FIELDS, INDEXES  # noqa: E402
+from bench import synthetic  # noqa: E402
+
+
+def populate(db, seed: int, trackers: int, per_user: int, locations: int, hints: int) -> list[dict]:
+    users = max(1, trackers // per_user)
+    document = synthetic.trackers_json(seed, users, per_user, 100, locations, hints)
+    docs = []
+    for trackers_for_user in document.values():
+        for tracker in trackers_for_user:
+            del tracker["_id"]
+            docs.append(tracker)
+    for start in range(0, len(docs), 5000):
+        db.trackers.insert_many(docs[start : start + 5000])
+    db.players.insert_many([{"id": user, "name": f"Player{user}"} for user in range(users)])
+    return docs
+
+
+def time_query(func, rounds: int) -> float:
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def measure(db, tracker: dict, rounds: int) -> dict[str, dict]:
+    queries = {
+        "trackers.user_id": (db.trackers, {"user_id": tracker["user_id"]}, None),
+        "trackers.user_id (light)": (db.trackers, {"user_id": tracker["user_id"]}, {f: 0 for f in HEAVY_FIELDS}),
+        "trackers.user_id (ids)": (db.trackers, {"user_id": tracker["user_id"]}, {"_id": 1, "revision": 1}),
+        "trackers.url": (db.trackers, {"url": tracker["url"]}, None),
+        "trackers.cheese_id": (db.trackers, {"cheese_id": tracker["cheese_id"]}, None),
+        "players.id": (db.players, {"id": tracker["user_id"]}, None),
+    }
+    results = {}
+    for name, (collection, query, projection) in queries.items():
+        plan = collection.find(query, projection).explain()
+        stats = plan.get("executionStats", {})
+        results[name] = {
+            "median_ms": round(time_query(lambda: list(collection.find(query, projection)), rounds), 3),
+            "docs_examined": stats.get("totalDocsExamined"),
+            "keys_examined": stats.get("totalKeysExamined"),
+            "bytes": sum(len(json.dumps(d, default=str)) for d in collection.find(query, projection)),
+        }
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--database", default="mwtb_bench_indexes", help="scratch database, dropped when finished")
+    parser.add_argument("--trackers", type=int, default=100_000)
+    parser.add_argument("--per-user", type=int, default=5)
+    parser.add_argument("--locations", type=int, default=50)
+    parser.add_argument("--hints", type=int, default=2)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.uri)
+    client.drop_database(args.database)
+    db = client[args.database]
+    try:
+        start = time.perf_counter()
+        docs = populate(db, args.seed, args.trackers, args.per_user, args.locations, args.hints)
+        print(f"Inserted {len(docs)} trackers in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        sample = random.Random(args.seed).choice(docs)
+
+        before = measure(db, sample, args.rounds)
+        for collection, key in INDEXES:
+            db[collection.name].create_index(key)
+        after = measure(db, sample, args.rounds)
+    finally:
+        client.drop_database(args.database)
+
+    print(f"{'query':<28} {'no index':>10} {'indexed':>10} {'examined':>16} {'bytes':>10}")
+    for name in before:
+        examined = f"{before[name]['docs_examined']} -> {after[name]['docs_examined']}"
+        print(f"{name:<28} {before[name]['median_ms']:>8.2f}ms {after[name]['median_ms']:>8.2f}ms {examined:>16} {after[name]['bytes']:>10}")
+    print(json.dumps({"trackers": len(docs), "without_indexes": before, "with_indexes": after}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
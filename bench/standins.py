@@ -0,0 +1,133 @@
+"""
+Local aiohttp stand-ins for the Archipelago webhost and the Cheese Tracker API.
+"""
+import asyncio
+import collections
+import json
+
+from aiohttp import web
+
+from . import synthetic
+
+
+class StandIns:
+    """
+    Serves synthetic rooms.
+
+    `mode` selects which agent the bot will end up using:
+    * "api": every endpoint is available, so the API agent is used.
+    * "cheese": the AP API endpoints return 404, so rooms are found through the Cheese Tracker and slots are scraped.
+    * "webtracker": both the AP API and the Cheese Tracker return 404, so everything is scraped.
+    """
+
+    def __init__(self, rooms: list[synthetic.SyntheticRoom], mode: str = "api", latency: float = 0.0, host: str = "127.0.0.1") -> None:
+        self.rooms = {r.room_id: r for r in rooms}
+        self.mode = mode
+        self.latency = latency
+        self.host = host
+        self.requests: collections.Counter[str] = collections.Counter()
+        self.bytes_sent = 0
+        self._runners: list[web.AppRunner] = []
+        self.ap_url = ""
+        self.cheese_url = ""
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else "unmatched"
+        self.requests[f"{request.method} {route}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        response = await handler(request)
+        if isinstance(response, web.Response) and response.body is not None:
+            self.bytes_sent += len(response.body)
+        return response
+
+    def _room(self, request: web.Request) -> synthetic.SyntheticRoom:
+        room = self.rooms.get(request.match_info["room"])
+        if room is None:
+            raise web.HTTPNotFound()
+        return room
+
+    def _json(self, data) -> web.Response:
+        return web.Response(body=json.dumps(data).encode(), content_type="application/json")
+
+    async def multitracker(self, request: web.Request) -> web.Response:
+        return web.Response(text=synthetic.multitracker_html(self._room(request)), content_type="text/html")
+
+    async def slot_tracker(self, request: web.Request) -> web.Response:
+        room = self._room(request)
+        position = int(request.match_info["slot"])
+        slot = next((s for s in room.slots if s.position == position), None)
+        if slot is None:
+            raise web.HTTPNotFound()
+        return web.Response(text=synthetic.slot_tracker_html(room, slot), content_type="text/html")
+
+    async def api_tracker(self, request: web.Request) -> web.Response:
+        if self.mode != "api":
+            raise web.HTTPNotFound()
+        return self._json(synthetic.api_tracker(self._room(request)))
+
+    async def static_tracker(self, request: web.Request) -> web.Response:
+        if self.mode != "api":
+            raise web.HTTPNotFound()
+        return self._json(synthetic.static_tracker(self._room(request)))
+
+    async def slot_data_tracker(self, request: web.Request) -> web.Response:
+        if self.mode != "api":
+            raise web.HTTPNotFound()
+        return self._json(synthetic.slot_data_tracker(self._room(request)))
+
+    async def datapackage(self, request: web.Request) -> web.Response:
+        if request.match_info["checksum"] != synthetic.CHECKSUM:
+            raise web.HTTPNotFound()
+        room = next(iter(self.rooms.values()))
+        return self._json(synthetic.datapackage(room.item_pool, 10_000))
+
+    async def cheese_create(self, request: web.Request) -> web.Response:
+        if self.mode == "webtracker":
+            raise web.HTTPNotFound()
+        url = (await request.json())["url"]
+        room_id = url.rstrip("/").split("/")[-1]
+        if room_id not in self.rooms:
+            raise web.HTTPNotFound()
+        return self._json({"tracker_id": room_id})
+
+    async def cheese_tracker(self, request: web.Request) -> web.Response:
+        if self.mode == "webtracker":
+            raise web.HTTPNotFound()
+        room = self._room(request)
+        return self._json(synthetic.cheese_tracker(room, f"{self.ap_url}/tracker/{room.room_id}"))
+
+    async def cheese_dashboard(self, _request: web.Request) -> web.Response:
+        return self._json([])
+
+    async def _serve(self, app: web.Application) -> str:
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, 0)
+        await site.start()
+        self._runners.append(runner)
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{self.host}:{port}"
+
+    async def start(self) -> None:
+        ap = web.Application(middlewares=[self._middleware])
+        ap.router.add_get("/tracker/{room}", self.multitracker)
+        ap.router.add_get("/tracker/{room}/{team}/{slot}", self.slot_tracker)
+        ap.router.add_get("/generic_tracker/{room}/{team}/{slot}", self.slot_tracker)
+        ap.router.add_get("/api/tracker/{room}", self.api_tracker)
+        ap.router.add_get("/api/static_tracker/{room}", self.static_tracker)
+        ap.router.add_get("/api/slot_data_tracker/{room}", self.slot_data_tracker)
+        ap.router.add_get("/api/datapackage/{checksum}", self.datapackage)
+        self.ap_url = await self._serve(ap)
+
+        cheese = web.Application(middlewares=[self._middleware])
+        cheese.router.add_post("/api/tracker", self.cheese_create)
+        cheese.router.add_get("/api/tracker/{room}", self.cheese_tracker)
+        cheese.router.add_get("/api/dashboard/tracker", self.cheese_dashboard)
+        self.cheese_url = await self._serve(cheese)
+
+    async def stop(self) -> None:
+        for runner in self._runners:
+            await runner.cleanup()
+        self._runners.clear()
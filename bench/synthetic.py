@@ -0,0 +1,239 @@
+"""
+Seeded synthetic multiworlds for the benchmarks.
+
+Everything here is generated from a `random.Random`, so a given seed always produces the same rooms.
+"""
+import datetime
+import random
+import string
+
+import attrs
+
+GAME = "Benchmark Game"
+CHECKSUM = "benchmark0000000000000000000000000000000"
+
+
+def item_name(item_id: int) -> str:
+    return f"Benchmark Item {item_id}"
+
+
+def location_name(location_id: int) -> str:
+    return f"Benchmark Location {location_id}"
+
+
+def datapackage(item_count: int, location_count: int) -> dict:
+    return {
+        "item_name_to_id": {item_name(i): i for i in range(1, item_count + 1)},
+        "location_name_to_id": {location_name(i): i for i in range(1, location_count + 1)},
+        "checksum": CHECKSUM,
+    }
+
+
+@attrs.define()
+class SyntheticSlot:
+    position: int
+    name: str
+    game: str
+    cheese_id: int
+    items: list[list[int]] = attrs.field(factory=list)  # [item_id, location, sender, flags]
+    checks: dict[str, bool] = attrs.field(factory=dict)
+    last_activity: datetime.datetime = attrs.field(factory=lambda: datetime.datetime.now(tz=datetime.UTC))
+
+
+@attrs.define()
+class SyntheticRoom:
+    room_id: str
+    title: str
+    slots: list[SyntheticSlot]
+    hints: list[dict] = attrs.field(factory=list)
+    item_pool: int = 500
+    updated_at: datetime.datetime = attrs.field(factory=lambda: datetime.datetime.now(tz=datetime.UTC))
+
+    def churn(self, rng: random.Random, items_per_slot: int) -> None:
+        """Give every slot some new items and check off some locations."""
+        now = datetime.datetime.now(tz=datetime.UTC)
+        for slot in self.slots:
+            for _ in range(items_per_slot):
+                slot.items.append(random_item(rng, self, slot))
+            unchecked = [loc for loc, done in slot.checks.items() if not done]
+            for loc in rng.sample(unchecked, min(items_per_slot, len(unchecked))):
+                slot.checks[loc] = True
+            slot.last_activity = now
+        self.updated_at = now
+
+
+def random_item(rng: random.Random, room: SyntheticRoom, slot: SyntheticSlot) -> list[int]:
+    sender = rng.randint(1, len(room.slots))
+    flags = rng.choice((0, 0, 0, 1, 2, 4))
+    return [rng.randint(1, room.item_pool), rng.randint(1, 10_000), sender, flags]
+
+
+def make_hint(rng: random.Random, hint_id: int, room: SyntheticRoom) -> dict:
+    finder = rng.choice(room.slots)
+    receiver = rng.choice(room.slots)
+    return {
+        "id": hint_id,
+        "item": item_name(rng.randint(1, room.item_pool)),
+        "location": location_name(rng.randint(1, 10_000)),
+        "entrance": "Vanilla",
+        "found": rng.random() < 0.3,
+        "classification": rng.choice(("unset", "critical", "progression", "qol", "trash")),
+        "finder_game_id": finder.cheese_id,
+        "receiver_game_id": receiver.cheese_id,
+        "item_link_name": None,
+    }
+
+
+def make_rooms(
+    seed: int,
+    rooms: int,
+    slots: int,
+    items: int,
+    locations: int,
+    hints: int = 0,
+    item_pool: int = 500,
+) -> list[SyntheticRoom]:
+    rng = random.Random(seed)
+    result = []
+    cheese_id = 1
+    for r in range(rooms):
+        room_id = "".join(rng.choices(string.ascii_letters + string.digits, k=22))
+        room = SyntheticRoom(room_id, f"Benchmark Room {r}", [], item_pool=item_pool)
+        for position in range(1, slots + 1):
+            slot = SyntheticSlot(position, f"Player{r}_{position}", GAME, cheese_id)
+            cheese_id += 1
+            slot.checks = {location_name(i): rng.random() < 0.5 for i in range(1, locations + 1)}
+            room.slots.append(slot)
+        for slot in room.slots:
+            slot.items = [random_item(rng, room, slot) for _ in range(items)]
+        room.hints = [make_hint(rng, r * 100_000 + h, room) for h in range(hints)]
+        result.append(room)
+    return result
+
+
+def _table(table_id: str, headers: list[str], rows: list[list]) -> str:
+    head = "".join(f"<th>{h}</th>" for h in headers)
+    body = "".join("<tr>" + "".join(f"<td>{c}</td>" for c in row) + "</tr>" for row in rows)
+    return f'<table id="{table_id}"><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>'
+
+
+def multitracker_html(room: SyntheticRoom) -> str:
+    rows = []
+    for slot in room.slots:
+        done = sum(slot.checks.values())
+        rows.append([slot.position, slot.name, slot.game, "Playing", f"{done}/{len(slot.checks)}", slot.last_activity.isoformat()])
+    rows.append(["Total", "", "", "", "", ""])
+    table = _table("checks-table", ["#", "Name", "Game", "Status", "Checks", "Last Activity"], rows)
+    return f"<html><head><title>Multiworld Tracker</title></head><body>{table}</body></html>"
+
+
+def slot_tracker_html(room: SyntheticRoom, slot: SyntheticSlot) -> str:
+    received: dict[int, list[int]] = {}
+    for order, item in enumerate(slot.items, start=1):
+        amount, _last = received.get(item[0], [0, 0])
+        received[item[0]] = [amount + 1, order]
+    received_rows = [[item_name(item_id), amount, order] for item_id, (amount, order) in received.items()]
+    location_rows = [[loc, "✔" if done else ""] for loc, done in slot.checks.items()]
+    tables = _table("received-table", ["Item", "Amount", "Last Order Received"], received_rows)
+    tables += _table("locations-table", ["Location", "Checked"], location_rows)
+    return f"<html><head><title>{slot.name}'s Tracker</title></head><body>{tables}</body></html>"
+
+
+def api_tracker(room: SyntheticRoom) -> dict:
+    return {
+        "player_checks_done": [{"team": 0, "player": s.position, "locations": [i for i, done in enumerate(s.checks.values(), 1) if done]} for s in room.slots],
+        "player_items_received": [{"team": 0, "player": s.position, "items": s.items} for s in room.slots],
+    }
+
+
+def static_tracker(room: SyntheticRoom) -> dict:
+    return {"datapackage": {GAME: {"checksum": CHECKSUM}}}
+
+
+def slot_data_tracker(room: SyntheticRoom) -> list[dict]:
+    return [{"player": s.position, "slot_data": {}} for s in room.slots]
+
+
+def cheese_tracker(room: SyntheticRoom, upstream_url: str) -> dict:
+    return {
+        "tracker_id": room.room_id,
+        "title": room.title,
+        "updated_at": room.updated_at.isoformat(),
+        "upstream_url": upstream_url,
+        "room_link": None,
+        "last_port": 38281,
+        "games": [
+            {
+                "id": s.cheese_id,
+                "position": s.position,
+                "name": s.name,
+                "game": s.game,
+                "checks_done": sum(s.checks.values()),
+                "checks_total": len(s.checks),
+                "last_activity": s.last_activity.isoformat(),
+                "last_checked": s.last_activity.isoformat(),
+                "progression_status": "unknown",
+                "tracker_status": "playing",
+                "completion_status": "incomplete",
+                "effective_discord_username": None,
+            }
+            for s in room.slots
+        ],
+        "hints": room.hints,
+    }
+
+
+def trackers_json(seed: int, users: int, trackers_per_user: int, items: int, locations: int, hints: int) -> dict[str, list[dict]]:
+    """A `trackers.json` shaped document, as written by `APTracker.save`."""
+    rng = random.Random(seed)
+    epoch = "1970-01-01T00:00:00+00:00"
+    now = datetime.datetime.now(tz=datetime.UTC).isoformat()
+    document = {}
+    for user in range(users):
+        trackers = []
+        for t in range(trackers_per_user):
+            room_id = "".join(rng.choices(string.ascii_letters + string.digits, k=22))
+            slot = rng.randint(1, 30)
+            trackers.append(
+                {
+                    "url": f"https://archipelago.gg/tracker/{room_id}/0/{slot}",
+                    "_id": None,
+                    "user_id": user,
+                    "cheese_id": user * trackers_per_user + t,
+                    "latest_item": items - 1,
+                    "disabled": False,
+                    "name": f"{room_id} - **Player{slot}**",
+                    "game": GAME,
+                    "last_refresh": now,
+                    "last_recieved": now,
+                    "failures": 0,
+                    "filters": 32,
+                    "hint_filters": 4,
+                    "last_progression": [item_name(1), now],
+                    "last_item": [item_name(2), now],
+                    "progression_status": "unknown",
+                    "last_checked": epoch,
+                    "last_activity": now,
+                    "checks": {location_name(i): rng.random() < 0.5 for i in range(1, locations + 1)},
+                    "finder_hints": {
+                        str(h): {
+                            "id": str(h),
+                            "item": item_name(rng.randint(1, 500)),
+                            "location": location_name(rng.randint(1, locations)),
+                            "entrance": "Vanilla",
+                            "found": False,
+                            "classification": "unset",
+                            "finder_game_id": t,
+                            "receiver_game_id": t + 1,
+                            "item_link_name": None,
+                            "update": "none",
+                            "is_finder": True,
+                        }
+                        for h in range(hints)
+                    },
+                    "receiver_hints": {},
+                    "notification_queue": [],
+                }
+            )
+        document[str(user)] = trackers
+    return document
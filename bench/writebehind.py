@@ -0,0 +1,107 @@
+"""
+Write-behind flushing of `ExternalTTLCache` against a slow, unreliable store.
+
+Items are queued while flushes are in flight and some writes fail.  The write-behind task alone has to empty the queue
+within `--timeout`, and after a final `flush()` of what's still cached every item must be stored with its latest value.
+Exits non-zero otherwise.
+
+    pipenv run python -m bench.writebehind
+    pipenv run python -m bench.writebehind --items 5000 --latency 50 --fail-every 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import attrs
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from shared import automongocache  # noqa: E402
+from shared.automongocache import DiffableTTLItem, ExternalTTLCache  # noqa: E402
+
+
+@attrs.define()
+class Record:
+    value: int
+
+
+class SlowCache(ExternalTTLCache):
+    """Writes to a dict after `latency` seconds, failing every `fail_every`th write."""
+
+    def __init__(self, latency: float, fail_every: int, **kwargs) -> None:
+        super().__init__(Record, **kwargs)
+        self.latency = latency
+        self.fail_every = fail_every
+        self.store: dict[int, int] = {}
+        self.writes = 0
+        self.failures = 0
+
+    async def write_items(self, items: dict[int, DiffableTTLItem[Record]]) -> None:
+        self.writes += 1
+        await asyncio.sleep(self.latency)
+        if self.fail_every and self.writes % self.fail_every == 0:
+            self.failures += 1
+            raise ConnectionError("injected failure")
+        for key, item in items.items():
+            self.store[key] = item.value.value
+
+
+async def run(args: argparse.Namespace) -> dict:
+    # Retries back off from write_delay; keep them short so the run settles quickly.
+    automongocache.MAX_RETRY_DELAY = args.delay * 4
+    cache = SlowCache(args.latency / 1000, args.fail_every, soft_limit=0, hard_limit=args.cached, write_batch=args.batch, write_delay=args.delay)
+    expected: dict[int, int] = {}
+    start = time.perf_counter()
+    for i in range(args.items):
+        key = i % args.keys
+        cache[key] = Record(i)
+        expected[key] = i
+        if i % (args.batch // 4 or 1) == 0:
+            # Spread out, so items keep being queued while a flush is in flight.
+            await asyncio.sleep(args.latency / 4000)
+    queued = time.perf_counter() - start
+    deadline = time.monotonic() + args.timeout
+    while (cache.pending or cache.writing) and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    left_pending = len(cache.pending)
+    # Whatever is still cached hasn't been evicted, so it was never queued.
+    await cache.flush()
+    missing = {key: value for key, value in expected.items() if cache.store.get(key) != value}
+    return {
+        "items": args.items,
+        "queue_seconds": round(queued, 3),
+        "settle_seconds": round(time.perf_counter() - start, 3),
+        "writes": cache.writes,
+        "failed_writes": cache.failures,
+        "left_pending": left_pending,
+        "wrong_or_missing": len(missing),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--keys", type=int, default=500)
+    parser.add_argument("--cached", type=int, default=50, help="hard limit of the cache; evictions are what get queued")
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--delay", type=float, default=0.05, help="write_delay in seconds")
+    parser.add_argument("--latency", type=float, default=20, help="milliseconds per write")
+    parser.add_argument("--fail-every", type=int, default=4, help="fail every Nth write, 0 for never")
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    if report["left_pending"] or report["wrong_or_missing"]:
+        print("write-behind lost items", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,5 @@
+from shared import startup  # first, so the timeline includes the imports below
+
 import asyncio
 import sys
 
@@ -8,6 +10,8 @@ from redis import asyncio as aioredis
 
 from shared import configuration
 
+configuration.DEFAULTS["sentry_traces_sample_rate"] = 0.05
+
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
@@ -22,13 +26,17 @@ class Bot(interactions.Client):
             send_command_tracebacks=False,
             dm_channels={},
         )
-        super().load_extension(
-            "interactions.ext.sentry",
-            dsn=configuration.get("sentry_dsn"),
-            enable_tracing=True,
-        )
-        super().load_extension("ap_alert")
-        super().load_extension("interactions.ext.jurigged")
+        startup.mark("imported")
+        with startup.phase("sentry"):
+            super().load_extension(
+                "interactions.ext.sentry",
+                dsn=configuration.get("sentry_dsn"),
+                traces_sample_rate=configuration.get_float("sentry_traces_sample_rate"),
+            )
+        with startup.phase("ap_alert"):
+            super().load_extension("ap_alert")
+        with startup.phase("jurigged"):
+            super().load_extension("interactions.ext.jurigged")
 
     def init(self) -> None:
         prefixed.setup(self)
@@ -36,6 +44,7 @@ class Bot(interactions.Client):
         self.start(configuration.get("token"))
 
     async def on_ready(self) -> None:
+        startup.mark("connected")
         self.redis = await aioredis.create_redis_pool("redis://localhost", minsize=5, maxsize=10)  # type: ignore
         print("Logged in as {username} ({id})".format(username=self.user.global_name, id=self.user.id))
         print("Connected to {0}".format(", ".join([server.name for server in self.guilds])))
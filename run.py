@@ -1,8 +1,11 @@
+from shared import startup  # first, so the timeline starts before anything else is imported
+
 import os
 import subprocess
 
 if not os.path.exists("world_data"):
-    subprocess.run(["git", "clone", "git@github.com:silasary/world_data.git"])
+    with startup.phase("world_data_clone"):
+        subprocess.run(["git", "clone", "git@github.com:silasary/world_data.git"])
 
 from discordbot import main
 
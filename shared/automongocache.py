@@ -1,4 +1,5 @@
-import datetime
+import asyncio
+import logging
 import time
 from collections import OrderedDict
 from collections.abc import ItemsView, ValuesView
@@ -6,16 +7,13 @@ from typing import Any, Callable, Optional, Tuple, Type
 
 import attrs
 from bson import ObjectId
-import cattrs
 
 from interactions.client.utils.cache import KT, VT, TTLItem, _CacheValuesView, _CacheItemsView
 from interactions.client.mixins.serialization import DictSerializationMixin
-from pymongo.collection import Collection
+from pymongo import UpdateOne
+from pymongo.asynchronous.collection import AsyncCollection
 
-converter = cattrs.Converter()
-
-converter.register_structure_hook(datetime.datetime, lambda x, *_: datetime.datetime.fromisoformat(x) if x else None)
-converter.register_unstructure_hook(datetime.datetime, lambda x, *_: x.isoformat() if x else None)
+from shared.converter import converter
 
 
 def stringify_keys(d: dict, *_) -> dict:
@@ -63,15 +61,114 @@ def diff_dict(new: dict, old: dict) -> dict:
     return diff
 
 
+def set_paths(new: Any, old: Any, path: str, update: dict) -> None:
+    """Add the `$set` entries that turn `old` into `new` to `update`, using dotted paths where Mongo allows."""
+    if isinstance(new, dict) and isinstance(old, dict):
+        if old.keys() <= new.keys() and all(isinstance(k, str) and k and "." not in k and k[0] != "$" for k in new):
+            for k, v in new.items():
+                if k in old:
+                    set_paths(v, old[k], f"{path}.{k}", update)
+                else:
+                    update[f"{path}.{k}"] = v
+            return
+        changed = new != old
+    elif isinstance(new, (list, tuple)) and isinstance(old, (list, tuple)):
+        changed = list(new) != list(old)
+    elif isinstance(new, str) and isinstance(old, ObjectId):
+        changed = new != str(old)
+    else:
+        changed = new != old
+    if changed:
+        update[path] = new
+
+
+def unstructure_fields(value: Any, names: set[str]) -> dict:
+    fields = attrs.fields_dict(type(value))
+    return {name: converter.unstructure(getattr(value, name), unstructure_as=fields[name].type) for name in names}
+
+
+def track_dirty(instance: Any, attribute: attrs.Attribute, value: Any) -> Any:
+    """
+    attrs `on_setattr` hook that records assigned fields in `instance.dirty`, so a cache only serializes those.
+
+    Changes made in place (appending to a list, setting a key in a dict) aren't assignments; add the field to
+    `dirty` by hand after those.
+    """
+    if attribute.init and getattr(instance, attribute.name, attrs.NOTHING) != value:
+        instance.dirty.add(attribute.name)
+    return value
+
+
 @attrs.define(eq=False, order=False, hash=False, kw_only=False)
 class DiffableTTLItem(TTLItem[VT]):
+    """
+    A cached value and the raw document it was last read as or written as.
+
+    Values that keep a `dirty` set of field names (see `track_dirty`) are only serialized field by field, and not at
+    all when nothing is dirty.  Anything else is serialized in full and compared against `initial_raw_value`.
+    """
+
     initial_raw_value: dict = attrs.field(repr=False)
 
-    def diff(self) -> dict:
-        return diff_dict(to_dict(self.value), self.initial_raw_value)
+    def _dirty(self) -> set[str] | None:
+        if not self.initial_raw_value or isinstance(self.value, DictSerializationMixin) or not attrs.has(type(self.value)):
+            return None
+        dirty = getattr(self.value, "dirty", None)
+        return dirty if isinstance(dirty, set) else None
+
+    def changed_fields(self) -> dict:
+        """Top-level fields that may differ from `initial_raw_value`, unstructured."""
+        dirty = self._dirty()
+        if dirty is None:
+            return to_dict(self.value)
+        return unstructure_fields(self.value, dirty) if dirty else {}
+
+    def diff(self, fields: dict | None = None) -> dict:
+        """The `$set` document that brings `initial_raw_value` up to date, with dotted paths into nested documents."""
+        if fields is None:
+            fields = self.changed_fields()
+        update = {}
+        for name, raw in fields.items():
+            if name in self.initial_raw_value:
+                set_paths(raw, self.initial_raw_value[name], name, update)
+            else:
+                update[name] = raw
+        return update
+
+    def take_changes(self) -> dict:
+        """`changed_fields`, and forget which fields were dirty.  Give them back with `restore` if the write fails."""
+        fields = self.changed_fields()
+        dirty = self._dirty()
+        if dirty:
+            dirty.clear()
+        return fields
+
+    def restore(self, fields: dict) -> None:
+        dirty = self._dirty()
+        if dirty is not None:
+            dirty.update(fields)
+
+    def mark_written(self, fields: dict) -> None:
+        if self.initial_raw_value:
+            self.initial_raw_value.update(fields)
+        else:
+            self.initial_raw_value = fields
+
+
+MAX_RETRY_DELAY = 300.0  # seconds between retries of a write-behind flush that keeps failing
 
 
 class ExternalTTLCache(OrderedDict[KT, DiffableTTLItem[VT]]):
+    """
+    A TTL cache backed by an external store, without doing any I/O itself.
+
+    New and evicted items go into a write-behind buffer (`pending`) that is handed to `write_items` in batches, once
+    `write_batch` items are waiting or `write_delay` seconds after the first one was queued, and again until the buffer
+    is empty.  A failed write leaves the items queued and is retried with backoff.  `await flush()` writes the buffer
+    and every cached item that has changed.  Reads that miss go through `fetch`, which loads from the store once no
+    matter how many coroutines ask for the same key.
+    """
+
     def __init__(
         self,
         factory: Type[VT],
@@ -79,6 +176,8 @@ class ExternalTTLCache(OrderedDict[KT, DiffableTTLItem[VT]]):
         soft_limit: int = 50,
         hard_limit: int = 250,
         on_expire: Optional[Callable] = None,
+        write_batch: int = 100,
+        write_delay: float = 5.0,
     ) -> None:
         super().__init__()
         self.factory = factory
@@ -86,6 +185,14 @@ class ExternalTTLCache(OrderedDict[KT, DiffableTTLItem[VT]]):
         self.hard_limit = hard_limit
         self.soft_limit = min(soft_limit, hard_limit)
         self.on_expire = on_expire
+        self.write_batch = write_batch
+        self.write_delay = write_delay
+        self.pending: dict[KT, DiffableTTLItem[VT]] = {}  # queued, not yet written
+        self.writing: dict[KT, DiffableTTLItem[VT]] = {}  # being written right now
+        self.loading: dict[KT, asyncio.Task] = {}
+        self._flush_lock = asyncio.Lock()
+        self._batch_full = asyncio.Event()
+        self._flush_task: asyncio.Task | None = None
 
     def __setitem__(self, key: KT, value: VT) -> None:
         expire = time.monotonic() + self.ttl
@@ -94,9 +201,9 @@ class ExternalTTLCache(OrderedDict[KT, DiffableTTLItem[VT]]):
             item.expire = expire
         else:
             item = DiffableTTLItem(value, expire, {})
-            result = self.write_to_db(key, item)
-            if key is None and result is not None:
-                key = result
+            if key is None:
+                key = self.new_key(item)
+            self.write_behind(key, item)
         super().__setitem__(key, item)
         self.move_to_end(key)
 
@@ -120,18 +227,47 @@ class ExternalTTLCache(OrderedDict[KT, DiffableTTLItem[VT]]):
         return default
 
     def get(self, key: KT, default: Optional[VT] = None, reset_expiration: bool = True) -> VT:
-        item = super().get(key, default)
-        if item is not default:
+        """Get an item that is in memory.  Use `fetch` to fall back to the external store."""
+        item = super().get(key, _MISSING)
+        if item is not _MISSING:
             if reset_expiration:
                 self._reset_expiration(key, item)
             return item.value
-        item = self.load_from_db(key)
+        # Evicted but not written yet; the store is older than this.
+        item = self.pending.get(key) or self.writing.get(key)
         if item is not None:
             self[key] = item
             return item.value
 
         return default
 
+    async def fetch(self, key: KT, default: Optional[VT] = None) -> VT:
+        """Get an item, loading it from the external store if it isn't in memory."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        task = self.loading.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key))
+            self.loading[key] = task
+        # Shielded, so one caller being cancelled doesn't cancel the load for everyone else waiting on it.
+        item = await asyncio.shield(task)
+        return default if item is None else item.value
+
+    async def _load(self, key: KT) -> Optional[DiffableTTLItem[VT]]:
+        try:
+            item = await self.load_from_db(key)
+        finally:
+            del self.loading[key]
+        # Set or written back while the load was in flight; that copy is newer.
+        current = super().get(key) or self.pending.get(key) or self.writing.get(key)
+        if current is not None:
+            item = current
+        if item is not None:
+            self[key] = item
+        return item
+
     def values(self) -> ValuesView[VT]:
         return _CacheValuesView(self)
 
@@ -166,93 +302,175 @@ class ExternalTTLCache(OrderedDict[KT, DiffableTTLItem[VT]]):
 
     def _expire_first(self) -> None:
         key, value = self.popitem(last=False)
-        self.write_to_db(key, value)
+        self.write_behind(key, value)
         if self.on_expire:
             self.on_expire(key, value)
 
-    def write_to_db(self, key: KT, item: DiffableTTLItem[VT]):
+    def write_behind(self, key: KT, item: DiffableTTLItem[VT]) -> None:
+        """Queue an item to be written by the next flush."""
+        self.pending[key] = item
+        if len(self.pending) >= self.write_batch:
+            self._batch_full.set()
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+            except RuntimeError:
+                # No event loop; whoever owns the cache has to await flush().
+                pass
+
+    async def _flush_later(self) -> None:
+        """Flush until nothing is queued, including items queued during a flush.  Failed flushes back off and retry."""
+        failures = 0
+        while True:
+            if failures:
+                await asyncio.sleep(min(max(self.write_delay, 1.0) * 2**failures, MAX_RETRY_DELAY))
+            else:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.write_delay)
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                await self.flush(everything=False)
+                failures = 0
+            except Exception:
+                failures += 1
+                logging.exception(f"Write-behind flush failed; retrying {len(self.pending)} queued items")
+            if not self.pending:
+                # Nothing awaits between this check and the task finishing, so write_behind starts a new one if needed.
+                return
+
+    async def flush(self, everything: bool = True) -> None:
+        """
+        Write queued items to the external store.
+
+        With `everything`, items that are still cached are written too if they've changed.
+        """
+        async with self._flush_lock:
+            self._batch_full.clear()
+            batch, self.pending = self.pending, {}
+            if everything:
+                batch.update(super().items())
+            if not batch:
+                return
+            self.writing = batch
+            try:
+                await self.write_items(batch)
+            except Exception:
+                for key, item in batch.items():
+                    self.pending.setdefault(key, item)
+                raise
+            finally:
+                self.writing = {}
+
+    def new_key(self, item: DiffableTTLItem[VT]) -> KT:
+        raise KeyError("This cache can't generate keys")
+
+    async def write_items(self, items: dict[KT, DiffableTTLItem[VT]]) -> None:
         pass
 
-    def load_from_db(self, key: KT) -> Optional[DiffableTTLItem[VT]]:
+    async def load_from_db(self, key: KT) -> Optional[DiffableTTLItem[VT]]:
         pass
 
-    def flush(self) -> None:
-        """Flushes the cache."""
-        for key, item in self.items(with_container=True):
-            self.write_to_db(key, item)
-
 
 class MongoCache(ExternalTTLCache):
+    """An `ExternalTTLCache` stored in a MongoDB collection, written with `bulk_write`."""
+
     def __init__(
         self,
         factory: Type[VT],
-        collection: Collection,
+        collection: AsyncCollection,
         ttl: int = 600,
         soft_limit: int = 50,
         hard_limit: int = 250,
         on_expire: Optional[Callable] = None,
         key_field: str = "_key",
+        write_batch: int = 100,
+        write_delay: float = 5.0,
     ) -> None:
-        super().__init__(factory=factory, ttl=ttl, soft_limit=soft_limit, hard_limit=hard_limit, on_expire=on_expire)
+        super().__init__(
+            factory=factory,
+            ttl=ttl,
+            soft_limit=soft_limit,
+            hard_limit=hard_limit,
+            on_expire=on_expire,
+            write_batch=write_batch,
+            write_delay=write_delay,
+        )
         self.collection = collection
         self.key_field = key_field
 
-    def write_to_db(self, key, item):
-        if self.key_field == "_id" and getattr(item.value, "_id", None) is None:
-            diff = to_dict(item.value)
-            if "_id" in diff:
-                del diff["_id"]
-            result = self.collection.insert_one(diff)
-            item.value._id = str(result.inserted_id)
-            return result.inserted_id
-
-        diff = item.diff()
-        if self.key_field in diff:
-            del diff[self.key_field]
-        if diff:
-            if not item.initial_raw_value:
-                print(f"Inserting {key} into MongoDB")
-            else:
-                print(f"Updating {key} in MongoDB with diff {diff}")
-            if self.key_field == "_id" and isinstance(key, str):
-                key = ObjectId(key)
-            self.collection.update_one({self.key_field: key}, {"$set": diff}, upsert=True)
-            item.initial_raw_value = to_dict(item.value)
-
-    def load_from_db(self, key):
-        raw = self.collection.find_one({self.key_field: key})
+    def _db_key(self, key: KT) -> Any:
+        if self.key_field == "_id" and isinstance(key, str) and ObjectId.is_valid(key):
+            return ObjectId(key)
+        return key
+
+    def new_key(self, item: DiffableTTLItem[VT]) -> KT:
+        if self.key_field != "_id":
+            return super().new_key(item)
+        # Generated here rather than by an insert, so the item has its key before it's written.
+        if getattr(item.value, "_id", None) is None:
+            item.value._id = str(ObjectId())
+        return item.value._id
+
+    async def write_items(self, items: dict[KT, DiffableTTLItem[VT]]) -> None:
+        ops = []
+        written = []
+        for key, item in items.items():
+            fields = item.take_changes()
+            fields.pop(self.key_field, None)
+            diff = item.diff(fields)
+            if not diff:
+                continue
+            logging.debug(f"{'Updating' if item.initial_raw_value else 'Inserting'} {key} in {self.collection.name}")
+            ops.append(UpdateOne({self.key_field: self._db_key(key)}, {"$set": diff}, upsert=True))
+            written.append((item, fields))
+        if not ops:
+            return
+        try:
+            await self.collection.bulk_write(ops, ordered=False)
+        except Exception:
+            for item, fields in written:
+                item.restore(fields)
+            raise
+        # The baseline is what was sent, so anything changed while the write was in flight is still a diff.
+        for item, fields in written:
+            item.mark_written(fields)
+
+    async def load_from_db(self, key: KT) -> Optional[DiffableTTLItem[VT]]:
+        raw = await self.collection.find_one({self.key_field: self._db_key(key)})
         if raw is None:
             return None
         return DiffableTTLItem(from_dict(raw, self.factory), time.monotonic() + self.ttl, raw)
 
-    def find(self, *args: Any, **kwargs: Any) -> list[VT]:
-        results = self.collection.find(*args, **kwargs)
+    async def find(self, *args: Any, **kwargs: Any) -> list[VT]:
         items = []
-        for raw in results:
+        async for raw in self.collection.find(*args, **kwargs):
             key = raw[self.key_field]
             if isinstance(key, ObjectId):
                 key = str(key)
-            if key in self:
-                item = self.get(key, reset_expiration=True)
-            else:
+            # Anything in memory or waiting to be written is newer than what was just read.
+            value = self.get(key, _MISSING)
+            if value is _MISSING:
                 item = DiffableTTLItem(from_dict(raw, self.factory), time.monotonic() + self.ttl, raw)
                 self[key] = item
-
-            if isinstance(item, DiffableTTLItem):
-                item = item.value
-            items.append(item)
+                value = item.value
+            items.append(value)
         return items
 
-    def delete_one(self, *args: Any, **kwargs: Any) -> None:
-        self.collection.delete_one(*args, **kwargs)
+    async def delete_one(self, *args: Any, **kwargs: Any) -> None:
         if self.key_field in args[0]:
             key = args[0][self.key_field]
             if isinstance(key, ObjectId):
                 key = str(key)
             if key in self:
                 del self[key]
+            self.pending.pop(key, None)
+        await self.collection.delete_one(*args, **kwargs)
 
     def __getattr__(self, name: str) -> Any:
-        if hasattr(self.collection, name):
+        if name != "collection" and hasattr(self.collection, name):
             return getattr(self.collection, name)
-        return super().__getattr__(name)
+        raise AttributeError(name)
+
+
+_MISSING: Any = object()
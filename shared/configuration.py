@@ -1,6 +1,15 @@
+"""
+Settings from `config.json`, environment variables and `DEFAULTS`, in that order of precedence.
+
+The file is read once and kept in memory.  It's only read again if its modification time or size changes, checked
+at most every `CHECK_INTERVAL` seconds, so a lookup is normally a dictionary read.  Defaults and environment
+variables that are used get written back to the file, but only when that changes what's in it.
+"""
 import inspect
 import json
 import os
+import threading
+import time
 from typing import Any
 
 from .exceptions import InvalidArgumentException
@@ -11,42 +20,92 @@ DEFAULTS = {
     "sentry_dsn": "https://7aadf0c15f880e90e01c4dba496f152d@o233010.ingest.us.sentry.io/4507219660832768",
 }
 
+PATH = "config.json"
+CHECK_INTERVAL = 1.0
 
-def get(key: str) -> Any:
+_lock = threading.RLock()
+_cfg: dict[str, Any] | None = None
+_stamp: tuple[int, int] | None = None  # (mtime_ns, size) of the file as last read or written
+_checked = 0.0
+
+
+def _file_stamp() -> tuple[int, int] | None:
     try:
-        cfg = json.load(open("config.json"))
+        stat = os.stat(PATH)
     except FileNotFoundError:
-        cfg = {}
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _load() -> dict[str, Any]:
+    global _cfg, _stamp, _checked
+    now = time.monotonic()
+    if _cfg is not None and now - _checked < CHECK_INTERVAL:
+        return _cfg
+    with _lock:
+        _checked = now
+        stamp = _file_stamp()
+        if _cfg is None or stamp != _stamp:
+            try:
+                with open(PATH) as f:
+                    _cfg = json.load(f)
+            except FileNotFoundError:
+                _cfg = {}
+            _stamp = stamp
+        return _cfg
+
+
+def _store(key: str, value: Any, sort_keys: bool = False) -> Any:
+    global _stamp
+    with _lock:
+        cfg = _load()
+        if key in cfg and cfg[key] == value:
+            return value
+        cfg[key] = value
+        print("CONFIG: {0}={1}".format(key, value))
+        with open(PATH + ".tmp", "w") as fh:
+            fh.write(json.dumps(cfg, indent=4, sort_keys=sort_keys))
+        os.replace(PATH + ".tmp", PATH)
+        _stamp = _file_stamp()
+        return value
+
+
+def get(key: str) -> Any:
+    cfg = _load()
     if key in os.environ:
         if cfg.get(key, "") == os.environ[key]:
             return cfg[key]
-        cfg[key] = os.environ[key]
-    elif key in cfg:
+        return _store(key, os.environ[key])
+    if key in cfg:
         return cfg[key]
-    elif key in DEFAULTS:
+    if key in DEFAULTS:
         # Lock in the default value if we use it.
-        cfg[key] = DEFAULTS[key]
+        value = DEFAULTS[key]
+        if inspect.isfunction(value):  # If default value is a function, call it.
+            value = value()
+        return _store(key, value)
+    raise InvalidArgumentException("No default or other configuration value available for {key}".format(key=key))
 
-        if inspect.isfunction(cfg[key]):  # If default value is a function, call it.
-            cfg[key] = cfg[key]()
-    else:
-        raise InvalidArgumentException("No default or other configuration value available for {key}".format(key=key))
 
-    print("CONFIG: {0}={1}".format(key, cfg[key]))
-    fh = open("config.json", "w")
-    fh.write(json.dumps(cfg, indent=4))
-    return cfg[key]
+def get_str(key: str) -> str:
+    value = get(key)
+    return "" if value is None else str(value)
 
 
-def write(key: str, value: str) -> str:
-    try:
-        cfg = json.load(open("config.json"))
-    except FileNotFoundError:
-        cfg = {}
+def get_int(key: str) -> int:
+    return int(get(key) or 0)
+
+
+def get_float(key: str) -> float:
+    return float(get(key) or 0)
+
+
+def get_bool(key: str) -> bool:
+    value = get(key)
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
 
-    cfg[key] = value
 
-    print("CONFIG: {0}={1}".format(key, cfg[key]))
-    fh = open("config.json", "w")
-    fh.write(json.dumps(cfg, indent=4, sort_keys=True))
-    return cfg[key]
+def write(key: str, value: Any) -> Any:
+    return _store(key, value, sort_keys=True)
@@ -0,0 +1,173 @@
+"""
+The cattrs converter shared by everything that is persisted.
+
+`precompile` generates a structure and an unstructure function for each attrs class it's given and registers them
+as hooks.  Unlike cattrs' own generated hooks, values that JSON and BSON already hold in the right type (numbers,
+bools, and str-keyed dicts and lists of them) are copied straight through, enums are looked up in their value map,
+datetimes are parsed inline, and defaults are filled in without building a keyword dict.  Strings are still passed
+through `str()`, since Mongo hands back `_id` as an ObjectId.  Anything else goes through the converter's hook for
+the field's type.  Container types passed to `precompile` have their hooks built up front.
+"""
+import datetime
+import enum
+import linecache
+import types
+import typing
+from typing import Any, Callable
+
+import attrs
+import cattrs
+
+converter = cattrs.Converter(detailed_validation=False)
+
+PRIMITIVES = (str, int, float, bool)
+
+
+def structure_datetime(value: str | None, _type: type = datetime.datetime) -> datetime.datetime | None:
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def unstructure_datetime(value: datetime.datetime | None) -> str | None:
+    return value.isoformat() if value else None
+
+
+def make_enum_structure(cls: type[enum.Enum]) -> Callable[..., enum.Enum]:
+    members = cls._value2member_map_
+
+    def structure_enum(value: Any, _type: type = cls) -> enum.Enum:
+        try:
+            return members[value]
+        except (KeyError, TypeError):
+            # Unknown values, flag combinations not seen yet and anything handled by _missing_.
+            return cls(value)
+
+    return structure_enum
+
+
+converter.register_structure_hook(datetime.datetime, structure_datetime)
+converter.register_unstructure_hook(datetime.datetime, unstructure_datetime)
+converter.register_structure_hook_factory(lambda t: isinstance(t, type) and issubclass(t, enum.Enum), make_enum_structure)
+
+
+def _optional_of(t: Any) -> Any:
+    if typing.get_origin(t) in (typing.Union, types.UnionType):
+        args = [arg for arg in typing.get_args(t) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return None
+
+
+def _is_primitive(t: Any) -> bool:
+    return t in PRIMITIVES or _optional_of(t) in PRIMITIVES
+
+
+def _container_of_primitives(t: Any) -> str | None:
+    """`dict` or `list` if `t` is a str-keyed dict or a list of primitives, which only need copying."""
+    origin, args = typing.get_origin(t), typing.get_args(t)
+    if origin is dict and len(args) == 2 and args[0] is str and _is_primitive(args[1]):
+        return "dict"
+    if origin is list and len(args) == 1 and _is_primitive(args[0]):
+        return "list"
+    return None
+
+
+def _compile(name: str, source: str, namespace: dict) -> Callable:
+    filename = f"<shared.converter {name}>"
+    exec(compile(source, filename, "exec"), namespace)
+    # Lets tracebacks and profilers show the generated source.
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    return namespace[name]
+
+
+def make_structure(cl: type) -> Callable[[dict, type], Any]:
+    attrs.resolve_types(cl)
+    namespace: dict[str, Any] = {"__cl": cl}
+    arguments, deferred = [], []
+    for i, a in enumerate(attrs.fields(cl)):
+        if not a.init:
+            continue
+        key = repr(a.name)
+        if a.type is str:
+            value = f"str(o[{key}])"
+        elif _optional_of(a.type) is str:
+            value = f"(None if (v := o[{key}]) is None else str(v))"
+        elif _is_primitive(a.type):
+            value = f"o[{key}]"
+        elif copy := _container_of_primitives(a.type):
+            value = f"{copy}(o[{key}])"
+        elif a.type is datetime.datetime:
+            namespace[f"__s{i}"] = structure_datetime
+            value = f"__s{i}(o[{key}])"
+        elif isinstance(a.type, type) and issubclass(a.type, enum.Enum):
+            namespace[f"__s{i}"] = make_enum_structure(a.type)
+            value = f"__s{i}(o[{key}])"
+        else:
+            namespace[f"__s{i}"] = converter.get_structure_hook(a.type)
+            namespace[f"__t{i}"] = a.type
+            value = f"__s{i}(o[{key}], __t{i})"
+
+        if isinstance(a.default, attrs.Factory) and a.default.takes_self:
+            # Needs the instance, so it's only passed when present and __init__ fills it in otherwise.
+            deferred.append((a.alias, key, value))
+            continue
+        if isinstance(a.default, attrs.Factory):
+            namespace[f"__f{i}"] = a.default.factory
+            value = f"({value} if {key} in o else __f{i}())"
+        elif a.default is not attrs.NOTHING:
+            namespace[f"__d{i}"] = a.default
+            value = f"({value} if {key} in o else __d{i})"
+        arguments.append(f"{a.alias}={value}" if a.kw_only else value)
+
+    name = f"structure_{cl.__name__}"
+    lines = [f"def {name}(o, _=None):"]
+    if deferred:
+        lines.append("    kw = {}")
+        lines.extend(f"    if {key} in o: kw[{alias!r}] = {value}" for alias, key, value in deferred)
+        arguments.append("**kw")
+    lines.append(f"    return __cl({', '.join(arguments)})")
+    return _compile(name, "\n".join(lines) + "\n", namespace)
+
+
+def make_unstructure(cl: type) -> Callable[[Any], dict]:
+    attrs.resolve_types(cl)
+    namespace: dict[str, Any] = {}
+    items = []
+    for i, a in enumerate(attrs.fields(cl)):
+        if not a.init:
+            continue
+        attribute = f"i.{a.name}"
+        if _is_primitive(a.type):
+            value = attribute
+        elif copy := _container_of_primitives(a.type):
+            value = f"{copy}({attribute})"
+        elif a.type is datetime.datetime:
+            namespace[f"__u{i}"] = unstructure_datetime
+            value = f"__u{i}({attribute})"
+        elif isinstance(a.type, type) and issubclass(a.type, enum.Enum):
+            # Some objects are built straight from API JSON and hold the raw value instead of the member.
+            namespace["__Enum"] = enum.Enum
+            value = f"(v.value if isinstance(v := {attribute}, __Enum) else v)"
+        else:
+            namespace[f"__u{i}"] = converter.get_unstructure_hook(a.type)
+            value = f"__u{i}({attribute})"
+        items.append(f"{a.name!r}: {value}")
+
+    name = f"unstructure_{cl.__name__}"
+    source = f"def {name}(i):\n    return {{{', '.join(items)}}}\n"
+    return _compile(name, source, namespace)
+
+
+def precompile(*types_: Any) -> None:
+    """
+    Build the hooks for `types_` now.
+
+    Attrs classes get `make_structure`/`make_unstructure` hooks, so list them before any container types that hold
+    them.
+    """
+    for cl in types_:
+        if attrs.has(cl):
+            converter.register_structure_hook(cl, make_structure(cl))
+            converter.register_unstructure_hook(cl, make_unstructure(cl))
+        else:
+            converter.get_structure_hook(cl)
+            converter.get_unstructure_hook(cl)
@@ -0,0 +1,55 @@
+"""
+Startup timeline.
+
+Import this before anything heavy, so `STARTED` is as close as possible to the process starting.  Each phase of
+startup is timed with `phase()`, and points in time that aren't phases (like being able to answer commands) are
+recorded with `mark()`.  Phases can overlap, since some of them run in the background.  `timeline()` is what goes into
+`stats.json`, and `report()` logs the whole thing once the last phase is done.
+"""
+import contextlib
+import logging
+import time
+from typing import Iterator
+
+STARTED = time.perf_counter()
+
+logger = logging.getLogger("shared.startup")
+logger.setLevel(logging.INFO)
+
+# name -> {"start": seconds after STARTED, "seconds": duration}.  Marks have no duration.
+PHASES: dict[str, dict[str, float | None]] = {}
+
+
+def elapsed() -> float:
+    return time.perf_counter() - STARTED
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    start = elapsed()
+    try:
+        yield
+    finally:
+        seconds = elapsed() - start
+        PHASES[name] = {"start": round(start, 3), "seconds": round(seconds, 3)}
+        logger.info(f"Startup: {name} took {seconds:.2f}s ({start:.2f}s after start)")
+
+
+def mark(name: str) -> None:
+    at = elapsed()
+    PHASES[name] = {"start": round(at, 3), "seconds": None}
+    logger.info(f"Startup: {name} {at:.2f}s after start")
+
+
+def timeline() -> dict[str, dict[str, float | None]]:
+    return dict(sorted(PHASES.items(), key=lambda item: item[1]["start"]))
+
+
+def report() -> None:
+    lines = []
+    for name, entry in timeline().items():
+        if entry["seconds"] is None:
+            lines.append(f"  {entry['start']:>8.2f}s  {name}")
+        else:
+            lines.append(f"  {entry['start']:>8.2f}s  {name} ({entry['seconds']:.2f}s)")
+    logger.info("Startup timeline:\n" + "\n".join(lines))
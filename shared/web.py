@@ -1,7 +1,38 @@
+import time
+import types
+
 import aiohttp
 
+from shared import metrics
+
+HTTP_REQUEST_SECONDS = metrics.Histogram("mwtb_http_request_seconds", "Time until response headers were received.", ("agent", "host", "status"))
+HTTP_RESPONSE_BYTES = metrics.Counter("mwtb_http_response_bytes_total", "Response body bytes downloaded.", ("agent", "host"))
+HTTP_ERRORS = metrics.Counter("mwtb_http_errors_total", "HTTP requests that raised before a response was received.", ("agent", "host", "exception"))
+
+
+def _trace_config(agent: str) -> aiohttp.TraceConfig:
+    async def on_request_start(_session, ctx: types.SimpleNamespace, params: aiohttp.TraceRequestStartParams) -> None:
+        ctx.start = time.perf_counter()
+        ctx.host = params.url.host or ""
+
+    async def on_request_end(_session, ctx: types.SimpleNamespace, params: aiohttp.TraceRequestEndParams) -> None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - ctx.start, agent=agent, host=ctx.host, status=params.response.status)
+
+    async def on_request_exception(_session, ctx: types.SimpleNamespace, params: aiohttp.TraceRequestExceptionParams) -> None:
+        HTTP_ERRORS.inc(agent=agent, host=ctx.host, exception=type(params.exception).__name__)
+
+    async def on_response_chunk_received(_session, ctx: types.SimpleNamespace, params: aiohttp.TraceResponseChunkReceivedParams) -> None:
+        HTTP_RESPONSE_BYTES.inc(len(params.chunk), agent=agent, host=ctx.host)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    trace_config.on_response_chunk_received.append(on_response_chunk_received)
+    return trace_config
+
 
-def make_session() -> aiohttp.ClientSession:
+def make_session(agent: str = "other") -> aiohttp.ClientSession:
     """Create an aiohttp ClientSession with default headers."""
     headers = {"User-Agent": "MultiworldTrackerBot/Silasary"}
-    return aiohttp.ClientSession(headers=headers)
+    return aiohttp.ClientSession(headers=headers, trace_configs=[_trace_config(agent)])